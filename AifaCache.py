@@ -0,0 +1,190 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+
+
+CACHE_DIR = ".aifa_cache"
+DEFAULT_TTL = 7 * 24 * 3600         # seconds before an entry is revalidated
+DEFAULT_MAX_BYTES = 2 * 1024 ** 3   # total blob size kept on disk
+
+
+class HttpCache:
+    """
+    On-disk HTTP response cache for AIFA JSON and RCP PDFs.
+
+    Bodies are stored content-addressed (sha256) under `path/blobs`, so identical
+    documents are kept once; `path/index.sqlite` maps each URL to its blob and
+    validators. Fresh entries (younger than `ttl`) are served without a request,
+    stale ones are revalidated with If-None-Match / If-Modified-Since, and the
+    least recently used entries are evicted once blobs exceed `max_bytes`.
+    """
+
+    def __init__(self, path=CACHE_DIR, ttl=DEFAULT_TTL, max_bytes=DEFAULT_MAX_BYTES, offline=False):
+        self.path = path
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.offline = offline
+        self.blob_dir = os.path.join(path, "blobs")
+        os.makedirs(self.blob_dir, exist_ok=True)
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(os.path.join(path, "index.sqlite"), check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS entries (
+                url TEXT PRIMARY KEY,
+                sha256 TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                etag TEXT,
+                last_modified TEXT,
+                fetched_at REAL NOT NULL,
+                accessed_at REAL NOT NULL
+            )
+        """)
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_entries_accessed ON entries (accessed_at)")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_entries_sha ON entries (sha256)")
+        self.conn.commit()
+        self.counters = {"hits": 0, "misses": 0, "revalidated": 0, "refreshed": 0, "evicted": 0}
+
+    def _blob_path(self, sha):
+        return os.path.join(self.blob_dir, sha[:2], sha)
+
+    def _read_blob(self, sha):
+        try:
+            with open(self._blob_path(sha), "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def _write_blob(self, sha, body):
+        blob_path = self._blob_path(sha)
+        if os.path.exists(blob_path):
+            return
+        os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+        tmp_path = f"{blob_path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(body)
+        os.replace(tmp_path, blob_path)
+
+    def lookup(self, url):
+        """Returns the cached body for a URL regardless of age, or None."""
+        with self.lock:
+            row = self.conn.execute("SELECT sha256 FROM entries WHERE url = ?", (url,)).fetchone()
+        return self._read_blob(row[0]) if row else None
+
+    def get(self, url, fetcher, ttl=None):
+        """
+        Returns the body for `url`, going to the network only when needed.
+
+        Args:
+            url (str): The URL, also used as the cache key.
+            fetcher (callable): fetcher(url, headers) -> requests.Response. Called
+                with conditional headers when a stale entry is revalidated.
+            ttl (int, optional): Overrides the cache TTL for this call.
+
+        Returns:
+            bytes: The response body.
+        """
+        ttl = self.ttl if ttl is None else ttl
+        now = time.time()
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT sha256, etag, last_modified, fetched_at FROM entries WHERE url = ?", (url,)
+            ).fetchone()
+        body = self._read_blob(row[0]) if row else None
+
+        if body is not None and (self.offline or now - row[3] < ttl):
+            self._touch(url, now)
+            self._count("hits")
+            return body
+        if self.offline:
+            self._count("misses")
+            raise KeyError(f"Not cached (offline mode): {url}")
+
+        headers = {}
+        if body is not None:
+            if row[1]:
+                headers["If-None-Match"] = row[1]
+            if row[2]:
+                headers["If-Modified-Since"] = row[2]
+        response = fetcher(url, headers)
+
+        if body is not None and response.status_code == 304:
+            with self.lock:
+                self.conn.execute(
+                    "UPDATE entries SET fetched_at = ?, accessed_at = ? WHERE url = ?", (now, now, url)
+                )
+                self.conn.commit()
+            self._count("revalidated")
+            return body
+
+        self._count("refreshed" if body is not None else "misses")
+        self.put(url, response.content, response.headers.get("ETag"), response.headers.get("Last-Modified"))
+        return response.content
+
+    def put(self, url, body, etag=None, last_modified=None):
+        """Stores a body for a URL and evicts old entries if over the size bound."""
+        sha = hashlib.sha256(body).hexdigest()
+        self._write_blob(sha, body)
+        now = time.time()
+        with self.lock:
+            old = self.conn.execute("SELECT sha256 FROM entries WHERE url = ?", (url,)).fetchone()
+            self.conn.execute(
+                "INSERT OR REPLACE INTO entries (url, sha256, size, etag, last_modified, fetched_at, accessed_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (url, sha, len(body), etag, last_modified, now, now),
+            )
+            self.conn.commit()
+            if old and old[0] != sha:
+                self._drop_blob_if_unused(old[0])
+            self._evict()
+
+    def _touch(self, url, now):
+        with self.lock:
+            self.conn.execute("UPDATE entries SET accessed_at = ? WHERE url = ?", (now, url))
+            self.conn.commit()
+
+    def _count(self, name):
+        with self.lock:
+            self.counters[name] += 1
+
+    def _drop_blob_if_unused(self, sha):
+        # Caller holds self.lock
+        if not self.conn.execute("SELECT 1 FROM entries WHERE sha256 = ? LIMIT 1", (sha,)).fetchone():
+            try:
+                os.remove(self._blob_path(sha))
+            except FileNotFoundError:
+                pass
+
+    def _evict(self):
+        # Caller holds self.lock. Blobs shared by several URLs count once.
+        total = self.conn.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM (SELECT DISTINCT sha256, size FROM entries)"
+        ).fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        for url, sha, size in self.conn.execute(
+            "SELECT url, sha256, size FROM entries ORDER BY accessed_at"
+        ).fetchall():
+            self.conn.execute("DELETE FROM entries WHERE url = ?", (url,))
+            self.counters["evicted"] += 1
+            if not self.conn.execute("SELECT 1 FROM entries WHERE sha256 = ? LIMIT 1", (sha,)).fetchone():
+                self._drop_blob_if_unused(sha)
+                total -= size
+            if total <= self.max_bytes:
+                break
+        self.conn.commit()
+
+    def stats(self):
+        """Returns hit/miss counters plus the number of entries and bytes on disk."""
+        with self.lock:
+            entries = self.conn.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+            size = self.conn.execute(
+                "SELECT COALESCE(SUM(size), 0) FROM (SELECT DISTINCT sha256, size FROM entries)"
+            ).fetchone()[0]
+            return dict(self.counters, entries=entries, bytes=size)
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
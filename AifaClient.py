@@ -0,0 +1,354 @@
+import json
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from urllib.parse import quote, urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from AifaCache import HttpCache
+from Metrics import incr, timer
+
+
+API_BASE = "https://api.aifa.gov.it/aifa-bdf-eif-be/1.0.0"
+
+# Requests per second allowed for each host; hosts not listed use DEFAULT_RATE
+HOST_RATE_LIMITS = {
+    "api.aifa.gov.it": 5.0,
+}
+DEFAULT_RATE = 5.0
+MAX_WORKERS = 8
+MAX_PAGES = 20  # result pages read per search
+
+# Keys that may hold a package's 9-digit AIC in a search result's "confezioni" list
+PACKAGE_KEYS = ("aic", "codiceAic", "aic9")
+
+# Retry policy for throttling and transient server errors
+RETRY_TOTAL = 5
+RETRY_BACKOFF = 1.0
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+# RCP URLs built by get_aifa_urls: one per (codiceSis, aic6), shared by all its packages
+RCP_URL_RE = re.compile(r"/organizzazione/([^/]+)/farmaci/([^/?]+)/stampati")
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket. acquire() blocks until a token is available,
+    so at most `rate` requests per second leave (with bursts up to `capacity`).
+    """
+
+    def __init__(self, rate, capacity=None):
+        self.rate = float(rate)
+        self.capacity = float(capacity if capacity is not None else max(1.0, rate))
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+_buckets = {}
+_buckets_lock = threading.Lock()
+_session = None
+_session_lock = threading.Lock()
+_cache = None
+
+
+def get_bucket(host):
+    """Returns the shared rate limiter for a host, creating it on first use."""
+    with _buckets_lock:
+        bucket = _buckets.get(host)
+        if bucket is None:
+            bucket = TokenBucket(HOST_RATE_LIMITS.get(host, DEFAULT_RATE))
+            _buckets[host] = bucket
+        return bucket
+
+
+def make_session(pool_size=MAX_WORKERS):
+    """
+    Builds a requests.Session with a connection pool sized for the worker count
+    and automatic retry with exponential backoff on 429/5xx (honouring Retry-After).
+    """
+    retry = Retry(
+        total=RETRY_TOTAL,
+        backoff_factor=RETRY_BACKOFF,
+        status_forcelist=RETRY_STATUSES,
+        allowed_methods=frozenset(["GET", "HEAD"]),
+        respect_retry_after_header=True,
+    )
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+    session = requests.Session()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def get_session():
+    """Returns the process-wide pooled session."""
+    global _session
+    with _session_lock:
+        if _session is None:
+            _session = make_session()
+        return _session
+
+
+def fetch(url, session=None, timeout=30, **kwargs):
+    """
+    GETs a URL through the shared session after taking a token from the
+    host's rate limiter. Raises for HTTP errors left after retries.
+    """
+    get_bucket(urlsplit(url).hostname).acquire()
+    incr("http_requests")
+    try:
+        response = (session or get_session()).get(url, timeout=timeout, **kwargs)
+    except requests.RequestException:
+        incr("http_errors")
+        raise
+    retries = response.raw.retries if response.raw is not None else None
+    if retries is not None and retries.history:
+        incr("http_retries", len(retries.history))
+    if response.status_code >= 400:
+        incr("http_errors")
+    response.raise_for_status()
+    return response
+
+
+def enable_cache(**kwargs):
+    """
+    Turns on the on-disk response cache for fetch_bytes (see AifaCache.HttpCache
+    for the accepted arguments) and returns it.
+    """
+    global _cache
+    _cache = HttpCache(**kwargs)
+    return _cache
+
+
+def get_cache():
+    """Returns the active HttpCache, or None when caching is off."""
+    return _cache
+
+
+def fetch_bytes(url, session=None):
+    """
+    Returns the body of a URL, served from the response cache when one is
+    enabled (revalidating stale entries) and fetched directly otherwise.
+    """
+    if _cache is None:
+        return fetch(url, session=session).content
+    return _cache.get(url, lambda u, headers: fetch(u, session=session, headers=headers))
+
+
+def search_url(query, page=0):
+    return f"{API_BASE}/formadosaggio/ricerca?query={quote(str(query))}&spellingCorrection=true&page={page}"
+
+
+def search(query, session=None, max_pages=MAX_PAGES):
+    """
+    Runs a formadosaggio search and returns the content entries of every page
+    of the result (at most `max_pages` pages).
+    """
+    entries = []
+    page = 0
+    while page < max_pages:
+        with timer("aifa_api"):
+            data = json.loads(fetch_bytes(search_url(query, page), session=session)).get("data") or {}
+        entries.extend(data.get("content") or [])
+        # Spring-style page metadata; a response without it is a single page
+        if "totalPages" in data:
+            if page + 1 >= data["totalPages"]:
+                break
+        elif data.get("last", True):
+            break
+        page += 1
+    return entries
+
+
+def entry_info(entry):
+    """The (codiceSis, aic6, ATC) of one search result entry, or None if incomplete."""
+    medicinale = entry.get("medicinale") or {}
+    codiceSis = medicinale.get("codiceSis")
+    aic6 = medicinale.get("aic6")
+    if not (codiceSis and aic6):
+        return None
+    codiceAtc = entry.get("codiceAtc")[0] if entry.get("codiceAtc") else None
+    descrizioneAtc = entry.get("descrizioneAtc")[0] if entry.get("descrizioneAtc") else None
+    return {"codiceSis": codiceSis, "aic6": str(aic6).zfill(6), "ATC": f"{codiceAtc} - {descrizioneAtc}"}
+
+
+def package_codes(entry):
+    """9-digit AIC codes of the packages listed in an entry, when the entry lists them."""
+    codes = []
+    for package in entry.get("confezioni") or []:
+        if isinstance(package, dict):
+            code = next((package[k] for k in PACKAGE_KEYS if package.get(k)), None)
+            if code is not None and str(code).isdigit():
+                codes.append(str(code).zfill(9))
+    return codes
+
+
+def urls_for(aic, info):
+    """The get_aifa_urls result for an AIC, from its (codiceSis, aic6, ATC)."""
+    return {
+        "URL_PDF": f"{API_BASE}/organizzazione/{info['codiceSis']}/farmaci/{info['aic6']}/stampati?ts=RCP",
+        "URL_json": search_url(f"0{aic}"),
+        "ATC": info["ATC"],
+    }
+
+
+class AifaResolver:
+    """
+    Resolves AIC codes to RCP URLs, harvesting every entry of every result page
+    into a map so that later codes are answered without a request.
+
+    The first six digits of a 9-digit AIC are the medicine's aic6, shared by all
+    its packages, which also share codiceSis, ATC and RCP. Any result entry
+    therefore resolves every package of its medicine, including the siblings
+    of the code that was searched for.
+    """
+
+    def __init__(self, session=None):
+        self.session = session or get_session()
+        self.lock = threading.Lock()
+        self.by_aic = {}   # 9-digit AIC -> info, from package lists
+        self.by_aic6 = {}  # aic6 -> info
+        self.queried = set()
+
+    def harvest(self, entries):
+        """Adds search result entries to the map; returns how many medicines were new."""
+        added = 0
+        with self.lock:
+            for entry in entries:
+                info = entry_info(entry)
+                if info is None:
+                    continue
+                if info["aic6"] not in self.by_aic6:
+                    self.by_aic6[info["aic6"]] = info
+                    added += 1
+                for code in package_codes(entry):
+                    self.by_aic.setdefault(code, info)
+        return added
+
+    def lookup(self, aic):
+        """The get_aifa_urls result from the map alone, or None."""
+        code = str(aic).zfill(9)
+        with self.lock:
+            info = self.by_aic.get(code) or self.by_aic6.get(code[:6])
+        return urls_for(aic, info) if info is not None else None
+
+    def prefetch(self, query):
+        """Harvests all pages of one search (an active ingredient, an aic6...)."""
+        with self.lock:
+            if query in self.queried:
+                return 0
+            self.queried.add(query)
+        try:
+            return self.harvest(search(query, session=self.session))
+        except Exception:
+            return 0
+
+    def resolve(self, aic):
+        """
+        Given an AIC code, returns the PDF and JSON URLs, from the map or by
+        searching for the code. Returns None if AIFA has no data for it.
+        """
+        result = self.lookup(aic)
+        if result is not None:
+            incr("aifa_map_hits")
+            return result
+        try:
+            entries = search(f"0{aic}", session=self.session)
+        except Exception:
+            return None
+        self.harvest(entries)
+        result = self.lookup(aic)
+        if result is None and entries:
+            # A result for another medicine (spelling correction): the first entry, as before
+            info = entry_info(entries[0])
+            if info is not None:
+                result = urls_for(aic, info)
+        return result
+
+    def resolve_many(self, aics, max_workers=MAX_WORKERS, queries=()):
+        """
+        Resolves many AIC codes: first harvests the given `queries` (e.g. the
+        active ingredients shared by many of the codes), then searches for one
+        code per medicine still unknown and answers its siblings from the map.
+
+        Yields:
+            tuple: (aic, dict or None), siblings right after the code searched.
+        """
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            for _ in executor.map(self.prefetch, queries):
+                pass
+
+            groups = {}
+            for aic in aics:
+                groups.setdefault(str(aic).zfill(9)[:6], []).append(aic)
+
+            def resolve_group(group):
+                results = []
+                for i, aic in enumerate(group):
+                    result = self.resolve(aic)
+                    results.append((aic, result))
+                    if result is not None:
+                        results.extend((sibling, self.lookup(sibling) or self.resolve(sibling))
+                                       for sibling in group[i + 1:])
+                        break
+                return results
+
+            futures = [executor.submit(resolve_group, group) for group in groups.values()]
+            for future in as_completed(futures):
+                yield from future.result()
+
+
+def get_aifa_urls(aic, session=None):
+    """
+    Given an AIC code, fetches codiceSis and aic6 from the AIFA API and returns the PDF and JSON URLs.
+    Returns None if the content is missing.
+    """
+    return AifaResolver(session).resolve(aic)
+
+
+def rcp_key(url):
+    """
+    Returns (codiceSis, aic6) for an RCP URL built by get_aifa_urls, so that
+    packages of the same medicine map to one document; other URLs are their
+    own key.
+    """
+    match = RCP_URL_RE.search(url or "")
+    if match is None:
+        return url
+    return match.groups()
+
+
+def resolve_aifa_urls(aics, max_workers=MAX_WORKERS, queries=()):
+    """
+    Resolves many AIC codes concurrently, with one search per medicine rather
+    than per package (see AifaResolver).
+
+    Args:
+        aics (iterable): AIC codes to look up.
+        max_workers (int): Number of requests in flight at once. The per-host
+            token bucket still caps the request rate.
+        queries (iterable): Searches to harvest first, such as active
+            ingredients shared by many of the codes.
+
+    Yields:
+        tuple: (aic, dict or None) in completion order, with the same dict
+        get_aifa_urls returns.
+    """
+    return AifaResolver().resolve_many(aics, max_workers=max_workers, queries=queries)
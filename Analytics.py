@@ -0,0 +1,243 @@
+import argparse
+import sqlite3
+
+from Schema import DB_NAME, SECTION_COLUMNS, TABLE_NAME, quote
+
+
+# ATC level -> length of its code (WHO ATC: A, A10, A10B, A10BA, A10BA02)
+ATC_LEVELS = {1: 1, 2: 3, 3: 4, 4: 5, 5: 7}
+# What a value must start with to count as an ATC code; the others are counted as UNKNOWN_ATC
+ATC_GLOB = "[A-Z][0-9][0-9]*"
+UNKNOWN_ATC = "unknown"
+NOT_FOUND = "NON - TROVATO"  # written by FetchingDaata when an RCP could not be processed
+ABSENT = "Not found"         # the RCP was parsed but had no such section
+# Outcome of every RCP section column, as counted per section
+SECTION_STATUSES = ["present", "absent", "failed", "empty"]
+
+
+def stats_table(table):
+    return f"{table}_stats"
+
+
+def _atc(row, length):
+    # The code is the first word ("N02BE01 - PARACETAMOLO"); placeholders such as
+    # "NON" (MakingURLs) or "None - None" (AifaClient) are not ATC codes
+    atc = f"upper(trim(coalesce({row}.ATC, '')))"
+    code = f"substr({atc}, 1, instr({atc} || ' ', ' ') - 1)"
+    return (f"CASE WHEN {atc} NOT GLOB '{ATC_GLOB}' THEN '{UNKNOWN_ATC}' "
+            f"WHEN length({code}) >= {length} THEN substr({code}, 1, {length}) ELSE {code} END")
+
+
+def _text(row, column):
+    return f"trim(coalesce({row}.{quote(column)}, ''))"
+
+
+def _section_status(row, column):
+    value = _text(row, column)
+    return (f"CASE WHEN {value} = '' THEN 'empty' WHEN {value} = '{NOT_FOUND}' THEN 'failed' "
+            f"WHEN {value} = '{ABSENT}' THEN 'absent' ELSE 'present' END")
+
+
+def dimensions(row):
+    """
+    The counted dimensions as {name: SQL expression over `row`} (a table
+    alias, or new/old in a trigger). Every package counts once per dimension.
+    """
+    dims = {f"atc{level}": _atc(row, length) for level, length in ATC_LEVELS.items()}
+    dims["group"] = _text(row, "Codice Gruppo Equivalenza")
+    dims["holder"] = _text(row, "Titolare AIC")
+    dims["ingredient"] = _text(row, "Principio Attivo")
+    dims["class"] = _text(row, "Class")
+    for column in SECTION_COLUMNS.values():
+        dims[f"section:{column}"] = _section_status(row, column)
+    return dims
+
+
+def tracked_columns():
+    return ["ATC", "Codice Gruppo Equivalenza", "Titolare AIC", "Principio Attivo", "Class"] + \
+        list(SECTION_COLUMNS.values())
+
+
+def _count_sql(stats, row, delta):
+    values = ", ".join(f"('{name}', {expr}, {delta})" for name, expr in dimensions(row).items())
+    return (f"INSERT INTO {quote(stats)} (dimension, value, packages) VALUES {values} "
+            f"ON CONFLICT (dimension, value) DO UPDATE SET packages = packages + excluded.packages;")
+
+
+def ensure_analytics(conn, table=TABLE_NAME):
+    """
+    Creates the summary table of `table` if needed, with triggers that keep it
+    up to date on every insert, update and delete, and fills it from the
+    current rows.
+
+    The summary holds the number of packages per dimension value (ATC code at
+    each level, equivalence group, marketing authorisation holder, active
+    ingredient, class, and the outcome of every RCP section), so the dashboard
+    reads a few hundred small rows instead of scanning the catalogue. Every
+    write adjusts the counts it touches, so nothing has to be recomputed.
+    Triggers dropped with the table (Schema.migrate_table), or counting the
+    dimensions differently from dimensions(), are recreated and the summary
+    filled again.
+    """
+    stats = stats_table(table)
+    current = conn.execute("SELECT sql FROM sqlite_master WHERE type = 'trigger' AND name = ?",
+                           (stats + "_ad",)).fetchone()
+    if current is not None and _count_sql(stats, "old", -1) in current[0]:
+        return
+    existing = {row[1] for row in conn.execute(f"PRAGMA table_info({quote(table)})")}
+    if not set(tracked_columns()) <= existing:
+        return
+    columns = ", ".join(quote(col) for col in tracked_columns())
+    with conn:
+        conn.execute(f"""
+            CREATE TABLE IF NOT EXISTS {quote(stats)} (
+                dimension TEXT NOT NULL,
+                value TEXT NOT NULL,
+                packages INTEGER NOT NULL,
+                PRIMARY KEY (dimension, value)
+            ) WITHOUT ROWID
+        """)
+        for suffix in ("_ai", "_ad", "_au"):
+            conn.execute(f"DROP TRIGGER IF EXISTS {quote(stats + suffix)}")
+        conn.execute(f"""
+            CREATE TRIGGER {quote(stats + '_ai')} AFTER INSERT ON {quote(table)} BEGIN
+                {_count_sql(stats, 'new', 1)}
+            END
+        """)
+        conn.execute(f"""
+            CREATE TRIGGER {quote(stats + '_ad')} AFTER DELETE ON {quote(table)} BEGIN
+                {_count_sql(stats, 'old', -1)}
+            END
+        """)
+        conn.execute(f"""
+            CREATE TRIGGER {quote(stats + '_au')} AFTER UPDATE OF {columns} ON {quote(table)} BEGIN
+                {_count_sql(stats, 'old', -1)}
+                {_count_sql(stats, 'new', 1)}
+            END
+        """)
+        _fill(conn, table)
+
+
+def _fill(conn, table):
+    stats = stats_table(table)
+    parts = [f"SELECT '{name}' AS dimension, {expr} AS value FROM {quote(table)} t"
+             for name, expr in dimensions("t").items()]
+    conn.execute(f"DELETE FROM {quote(stats)}")
+    conn.execute(
+        f"INSERT INTO {quote(stats)} (dimension, value, packages) "
+        f"SELECT dimension, value, COUNT(*) FROM ({' UNION ALL '.join(parts)}) GROUP BY dimension, value"
+    )
+
+
+def rebuild(conn, table=TABLE_NAME):
+    """Recomputes the summary from scratch and drops the values no package has any more."""
+    with conn:
+        _fill(conn, table)
+
+
+def overview(db, table=TABLE_NAME):
+    """Packages, and distinct ATC codes, groups, holders and ingredients, from the summary."""
+    columns, rows = db.query(
+        f"SELECT dimension, COUNT(*), SUM(packages) FROM {quote(stats_table(table))} "
+        f"WHERE packages > 0 AND value != '' AND dimension IN ('atc5', 'group', 'holder', 'ingredient') "
+        f"AND NOT (dimension = 'atc5' AND value = ?) GROUP BY dimension", (UNKNOWN_ATC,)
+    )
+    counts = {dimension: distinct for dimension, distinct, _ in rows}
+    total = db.query(f"SELECT COALESCE(SUM(packages), 0) FROM {quote(stats_table(table))} "
+                     f"WHERE dimension = 'class'")[1][0][0]
+    return {
+        "packages": total,
+        "atc_codes": counts.get("atc5", 0),
+        "groups": counts.get("group", 0),
+        "holders": counts.get("holder", 0),
+        "ingredients": counts.get("ingredient", 0),
+    }
+
+
+def top_values(db, dimension, limit=20, table=TABLE_NAME):
+    """
+    The values of one dimension ("group", "holder", "ingredient", "class",
+    "atc1".."atc5") with the most packages. Missing or invalid ATC values are
+    counted as UNKNOWN_ATC.
+
+    Returns:
+        tuple: (column names, rows of (value, packages)), largest first.
+    """
+    return db.query(
+        f"SELECT value, packages FROM {quote(stats_table(table))} "
+        f"WHERE dimension = ? AND packages > 0 ORDER BY packages DESC, value LIMIT ?",
+        (dimension, limit)
+    )
+
+
+def atc_breakdown(db, level, prefix="", table=TABLE_NAME):
+    """
+    Packages per ATC code of `level` (1-5), optionally under an ATC prefix
+    (e.g. level 4 under "N02"): a range scan of the summary's primary key.
+    """
+    if level not in ATC_LEVELS:
+        raise ValueError(f"ATC level must be one of {sorted(ATC_LEVELS)}")
+    sql = (f"SELECT value AS ATC, packages FROM {quote(stats_table(table))} "
+           f"WHERE dimension = ? AND packages > 0")
+    params = [f"atc{level}"]
+    if prefix:
+        # Same bounds as DrugQueries.prefix_range
+        prefix = prefix.upper()
+        sql += " AND value >= ? AND value < ?"
+        params += [prefix, prefix[:-1] + chr(ord(prefix[-1]) + 1)]
+    return db.query(sql + " ORDER BY value", params)
+
+
+def section_status(db, table=TABLE_NAME):
+    """
+    One row per RCP section column with the packages whose section is present,
+    absent from the RCP, failed ("NON - TROVATO") or empty.
+    """
+    sums = ", ".join(f"SUM(CASE WHEN value = '{status}' THEN packages ELSE 0 END) AS {status}"
+                     for status in SECTION_STATUSES)
+    columns, rows = db.query(
+        f"SELECT substr(dimension, 9) AS section, {sums} FROM {quote(stats_table(table))} "
+        f"WHERE dimension LIKE 'section:%' GROUP BY dimension ORDER BY dimension"
+    )
+    return columns, rows
+
+
+def group_summary(db, limit=50, table=TABLE_NAME):
+    """
+    Equivalence groups with their packages, holders and active ingredients.
+    An aggregate pushed down to SQLite: it reads only the short leading
+    columns of every row, never the RCP texts.
+    """
+    return db.query(
+        f'SELECT "Codice Gruppo Equivalenza" AS "group", COUNT(*) AS packages, '
+        f'COUNT(DISTINCT "Titolare AIC") AS holders, COUNT(DISTINCT "Principio Attivo") AS ingredients, '
+        f'MIN("Principio Attivo") AS ingredient '
+        f'FROM {quote(table)} WHERE COALESCE("Codice Gruppo Equivalenza", \'\') != \'\' '
+        f'GROUP BY "Codice Gruppo Equivalenza" ORDER BY packages DESC LIMIT ?',
+        (limit,)
+    )
+
+
+if __name__ == "__main__":
+    from Database import Database
+
+    parser = argparse.ArgumentParser(description="Catalogue summary: packages per ATC, group, holder, section.")
+    parser.add_argument("db", nargs="?", default=DB_NAME)
+    parser.add_argument("--table", default=TABLE_NAME)
+    parser.add_argument("--rebuild", action="store_true", help="recompute the summary from scratch")
+    args = parser.parse_args()
+
+    conn = sqlite3.connect(args.db)
+    ensure_analytics(conn, args.table)
+    if args.rebuild:
+        rebuild(conn, args.table)
+    conn.close()
+    db = Database(args.db)
+    print(overview(db, args.table))
+    for dimension in ("atc1", "holder", "group"):
+        print(f"\nTop {dimension}:")
+        for value, packages in top_values(db, dimension, 10, args.table)[1]:
+            print(f"  {packages:>7}  {value or '(none)'}")
+    print("\nRCP sections (" + ", ".join(SECTION_STATUSES) + "):")
+    for section, *counts in section_status(db, args.table)[1]:
+        print(f"  {section:<50} " + " ".join(f"{count:>7}" for count in counts))
@@ -0,0 +1,230 @@
+import argparse
+import asyncio
+import gzip
+import hashlib
+import json
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qs, unquote, urlsplit
+
+import DrugQueries
+from Database import Database
+from Schema import DB_NAME
+
+
+HOST = "127.0.0.1"
+PORT = 8600
+WORKERS = 8            # threads running queries, each with its own read connection
+RESPONSE_CACHE = 4096  # encoded responses kept for hot lookups
+MAX_LIMIT = 1000       # largest page size accepted
+GZIP_MIN_BYTES = 1024  # smaller bodies are sent uncompressed
+MAX_HEADER_BYTES = 16384
+
+REASONS = {200: "OK", 304: "Not Modified", 400: "Bad Request", 404: "Not Found",
+           405: "Method Not Allowed", 500: "Internal Server Error"}
+
+
+class ApiError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+def rows_to_dicts(result):
+    columns, rows = result
+    return [dict(zip(columns, row)) for row in rows]
+
+
+def page_body(result, limit):
+    """A list response, with the rowid to pass as `after` for the next page."""
+    items = rows_to_dicts(result)
+    next_after = items[-1]["rowid"] if len(items) == limit else None
+    return {"items": items, "next_after": next_after}
+
+
+def int_param(params, name, default, low=0, high=None):
+    value = params.get(name, [str(default)])[0]
+    try:
+        value = int(value)
+    except ValueError:
+        raise ApiError(400, f"'{name}' must be an integer")
+    if value < low or (high is not None and value > high):
+        raise ApiError(400, f"'{name}' must be between {low} and {high}")
+    return value
+
+
+def text_param(params, name):
+    value = params.get(name, [""])[0].strip()
+    if not value:
+        raise ApiError(400, f"'{name}' is required")
+    return value
+
+
+class ApiServer:
+    """
+    Read-only JSON API over the medicines database, on asyncio streams.
+
+        GET /drugs/{aic}                   one drug, every column (section texts in full)
+        GET /drugs?after=&limit=           summary rows, paged by rowid
+        GET /drugs?atc=N02B&after=&limit=  by ATC code prefix
+        GET /drugs?ingredient=...          by active ingredient
+        GET /drugs?mentions=...            whose RCP 4.5/4.3 mentions an active ingredient
+        GET /search?q=...&limit=           full-text search (see SearchIndex)
+        GET /health                        row count and data version
+
+    Queries run in a thread pool on the shared Database (one read connection
+    per thread, plus its query cache). Encoded responses are also kept in an
+    LRU keyed on the request, so hot lookups are answered from the event loop;
+    both caches are dropped whenever the data version changes. Responses carry
+    an ETag (answered with 304 on If-None-Match) and are gzipped when the
+    client accepts it. Connections are kept alive between requests.
+    """
+
+    def __init__(self, db, workers=WORKERS, cache_size=RESPONSE_CACHE):
+        self.db = db
+        self.pool = ThreadPoolExecutor(workers)
+        self.cache_size = cache_size
+        self.cache = OrderedDict()
+        self.cache_version = None
+
+    # --- routing -----------------------------------------------------------
+
+    def handle(self, path, params):
+        """Runs one request against the database; returns the JSON-able body."""
+        parts = [unquote(part) for part in path.strip("/").split("/") if part]
+        if parts == ["health"]:
+            return {"rows": DrugQueries.count_rows(self.db), "version": self.db.current_version()}
+        if parts == ["search"]:
+            limit = int_param(params, "limit", 50, 1, MAX_LIMIT)
+            return {"items": rows_to_dicts(DrugQueries.search_data(self.db, text_param(params, "q"), limit))}
+        if parts == ["drugs"]:
+            after = int_param(params, "after", 0)
+            limit = int_param(params, "limit", 100, 1, MAX_LIMIT)
+            if "atc" in params:
+                result = DrugQueries.fetch_by_atc(self.db, text_param(params, "atc"), after, limit)
+            elif "ingredient" in params:
+                result = DrugQueries.fetch_by_ingredient(self.db, text_param(params, "ingredient"), after, limit)
+            elif "mentions" in params:
+                result = DrugQueries.fetch_by_mention(self.db, text_param(params, "mentions"), after, limit)
+            else:
+                result = DrugQueries.fetch_page(self.db, after, limit)
+            return page_body(result, limit)
+        if len(parts) == 2 and parts[0] == "drugs":
+            record = DrugQueries.fetch_by_pk(self.db, parts[1])
+            if record is None:
+                raise ApiError(404, f"No drug with AIC {parts[1]}")
+            return record
+        raise ApiError(404, "Unknown path")
+
+    def encode(self, status, body):
+        data = json.dumps(body, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+        etag = '"' + hashlib.blake2b(data, digest_size=12).hexdigest() + '"'
+        gzipped = gzip.compress(data, 5) if len(data) >= GZIP_MIN_BYTES else None
+        return status, data, gzipped, etag
+
+    async def respond(self, target):
+        """Returns (status, body, gzipped body or None, etag) for a request target."""
+        key = target
+        version = self.db.current_version()
+        if version != self.cache_version:
+            self.cache.clear()
+            self.cache_version = version
+        hit = self.cache.get(key)
+        if hit is not None:
+            self.cache.move_to_end(key)
+            return hit
+        split = urlsplit(target)
+        loop = asyncio.get_running_loop()
+        try:
+            body = await loop.run_in_executor(self.pool, self.handle, split.path, parse_qs(split.query))
+            response = self.encode(200, body)
+        except ApiError as e:
+            return self.encode(e.status, {"error": str(e)})
+        except Exception as e:
+            return self.encode(500, {"error": repr(e)})
+        if self.cache_version == version:
+            self.cache[key] = response
+            if len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+        return response
+
+    # --- HTTP ----------------------------------------------------------------
+
+    async def serve_connection(self, reader, writer):
+        try:
+            while True:
+                try:
+                    head = await reader.readuntil(b"\r\n\r\n")
+                except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+                    return
+                lines = head.decode("latin-1").split("\r\n")
+                try:
+                    method, target, version = lines[0].split(" ", 2)
+                except ValueError:
+                    return
+                headers = {}
+                for line in lines[1:]:
+                    name, _, value = line.partition(":")
+                    if name:
+                        headers[name.strip().lower()] = value.strip()
+                try:
+                    length = int(headers.get("content-length") or 0)
+                except ValueError:
+                    length = -1
+                if length > 0:
+                    await reader.readexactly(length)  # bodies are not used
+
+                if length < 0:
+                    # Where the body ends is unknown, so the connection is closed after the reply
+                    status, data, gzipped, etag = self.encode(400, {"error": "Invalid Content-Length header"})
+                    headers["connection"] = "close"
+                elif method not in ("GET", "HEAD"):
+                    status, data, gzipped, etag = self.encode(405, {"error": "Only GET and HEAD are supported"})
+                else:
+                    status, data, gzipped, etag = await self.respond(target)
+
+                keep_alive = (headers.get("connection", "").lower() != "close"
+                              and (version == "HTTP/1.1" or headers.get("connection", "").lower() == "keep-alive"))
+                extra = []
+                if status == 200 and etag in [tag.strip() for tag in headers.get("if-none-match", "").split(",")]:
+                    status, data = 304, b""
+                elif gzipped is not None and "gzip" in headers.get("accept-encoding", ""):
+                    data = gzipped
+                    extra.append("Content-Encoding: gzip")
+                out = [
+                    f"HTTP/1.1 {status} {REASONS.get(status, '')}",
+                    "Content-Type: application/json; charset=utf-8",
+                    f"ETag: {etag}",
+                    "Vary: Accept-Encoding",
+                    f"Connection: {'keep-alive' if keep_alive else 'close'}",
+                    f"Content-Length: {len(data)}",
+                ] + extra
+                writer.write(("\r\n".join(out) + "\r\n\r\n").encode("latin-1"))
+                if method != "HEAD":
+                    writer.write(data)
+                await writer.drain()
+                if not keep_alive:
+                    return
+        finally:
+            writer.close()
+
+    async def serve(self, host=HOST, port=PORT):
+        server = await asyncio.start_server(self.serve_connection, host, port, limit=MAX_HEADER_BYTES)
+        print(f"Serving {self.db.path} on http://{host}:{port}")
+        async with server:
+            await server.serve_forever()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve the medicines database as a JSON API.")
+    parser.add_argument("--db", default=DB_NAME)
+    parser.add_argument("--host", default=HOST)
+    parser.add_argument("--port", type=int, default=PORT)
+    parser.add_argument("--workers", type=int, default=WORKERS)
+    args = parser.parse_args()
+    try:
+        db = Database(args.db)
+        DrugQueries.init_db(db)
+        asyncio.run(ApiServer(db, workers=args.workers).serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
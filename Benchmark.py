@@ -0,0 +1,619 @@
+"""
+Benchmarks for the fetch / parse / store path, runnable offline.
+
+AIFA is replaced by a local HTTP stand-in serving recorded fixtures (see
+record_fixtures) or, for codes without one, synthetic search results and RCP
+PDFs; Google Sheets by an in-memory worksheet with a fixed latency per API
+call; the app database by a synthetic catalogue of configurable size.
+
+    python Benchmark.py                           # all stages, default sizes
+    python Benchmark.py --stages parse,queries --rows 200000
+    python Benchmark.py --record 043658032 ...    # save real responses as fixtures
+    python Benchmark.py --compare benchmark_results/old.json
+    python Benchmark.py --stages imports          # import-time budget check
+    python Benchmark.py --stages golden           # section extractor on the test_rcp_parser sample
+
+Every run prints per-stage latency percentiles and throughput, and saves them
+with the peak RSS and the git commit to benchmark_results/, so runs from
+different commits can be compared. The "imports" stage imports every entry
+module in a fresh interpreter with the network disabled and exits with status 1
+when one goes over its budget in IMPORT_BUDGETS_MS, loads a module listed in
+DEFERRED_IMPORTS or tries to connect anywhere.
+"""
+import argparse
+import json
+import logging
+import os
+import random
+import resource
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+from gspread.utils import a1_to_rowcol
+
+import AifaClient
+from RcpParser import extract_lines_from_pdf, extract_sections_from_lines, extract_sections_from_pdf
+from RcpPipeline import run_pipeline
+from RcpStore import ensure_tables, write_row_sections
+from Schema import COLUMNS, KEY_COLUMN, SECTION_COLUMNS, TABLE_NAME, create_table_sql, quote
+from SheetSync import SheetWriter, update_row_in_sheet
+from test_rcp_parser import GOLDEN_LINES
+
+
+FIXTURE_DIR = "benchmark_fixtures"   # recorded AIFA responses: json/<aic>.json, pdf/<codiceSis>_<aic6>.pdf
+RESULTS_DIR = "benchmark_results"
+STAGES = ["imports", "golden", "resolve", "parse", "pipeline", "sheet", "queries"]
+
+# Import time allowed per entry module (milliseconds, fresh interpreter, best of
+# IMPORT_RUNS); about twice what they take on a laptop
+IMPORT_BUDGETS_MS = {
+    "RcpParser": 50,
+    "SheetClient": 50,
+    "SheetSync": 100,
+    "DrugQueries": 100,
+    "SheetToDb": 150,
+    "BulkEdit": 150,
+    "Mentions": 100,
+    "ApiServer": 200,
+    "AifaClient": 300,
+    "RcpPipeline": 300,
+    "MakingURLs": 300,
+    "FetchingDaata": 400,
+    "Recommender": 300,
+    "main": 2000,  # the Streamlit app, pandas included
+}
+# Loaded only when a PDF is parsed or a sheet opened, never by importing a module
+DEFERRED_IMPORTS = ("fitz", "gspread", "gspread_dataframe", "oauth2client", "google.oauth2", "sklearn")
+IMPORT_RUNS = 3
+IMPORT_PROBE = """
+import importlib, json, socket, sys, time
+def refuse(*args, **kwargs):
+    raise RuntimeError("network access while importing")
+socket.socket.connect = socket.socket.connect_ex = refuse
+started = time.perf_counter()
+importlib.import_module(sys.argv[1])
+seconds = time.perf_counter() - started
+print(json.dumps({"seconds": seconds, "modules": sorted(sys.modules)}))
+"""
+
+WORDS = ("il paziente deve evitare uso concomitante con farmaci inibitori del CYP3A4 ketoconazolo "
+         "warfarin può essere necessario ridurre la dose della terapia in caso di insufficienza renale").split()
+RCP_SECTIONS = [
+    ("4.1", "Indicazioni terapeutiche"), ("4.2", "Posologia e modo di somministrazione"),
+    ("4.3", "Controindicazioni"), ("4.4", "Avvertenze speciali e precauzioni d'impiego"),
+    ("4.5", "Interazioni con altri medicinali ed altre forme d'interazione"),
+    ("4.6", "Fertilità, gravidanza e allattamento"),
+    ("4.7", "Effetti sulla capacità di guidare veicoli e sull'uso di macchinari"),
+    ("4.8", "Effetti indesiderati"), ("4.9", "Sovradosaggio"), ("5.1", "Proprietà farmacodinamiche"),
+    ("6.1", "Elenco degli eccipienti"), ("6.2", "Incompatibilità"), ("6.3", "Periodo di validità"),
+]
+
+# --- measurements -------------------------------------------------------------
+
+def percentile(sorted_samples, q):
+    if not sorted_samples:
+        return None
+    index = min(len(sorted_samples) - 1, int(round(q / 100 * (len(sorted_samples) - 1))))
+    return sorted_samples[index]
+
+
+def summarize(samples, wall=None, items=None):
+    """
+    Latency percentiles in milliseconds for a list of durations in seconds.
+    With `wall` (seconds for the whole run) also the throughput in items/s,
+    `items` defaulting to the number of samples.
+    """
+    ordered = sorted(samples)
+    result = {"n": len(ordered)}
+    for q in (50, 90, 99):
+        value = percentile(ordered, q)
+        result[f"p{q}_ms"] = None if value is None else round(value * 1000, 3)
+    result["max_ms"] = round(ordered[-1] * 1000, 3) if ordered else None
+    result["mean_ms"] = round(sum(ordered) / len(ordered) * 1000, 3) if ordered else None
+    if wall:
+        result["wall_s"] = round(wall, 3)
+        result["per_s"] = round((len(ordered) if items is None else items) / wall, 1)
+    return result
+
+
+def timed(func, *args, **kwargs):
+    started = time.perf_counter()
+    result = func(*args, **kwargs)
+    return time.perf_counter() - started, result
+
+
+def peak_rss_mb():
+    """Peak resident set size of this process and of its (finished) children, in MB."""
+    # ru_maxrss is in kilobytes on Linux, in bytes on macOS
+    scale = 1 / (1024 * 1024) if sys.platform == "darwin" else 1 / 1024
+    return {
+        "self": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale, 1),
+        "children": round(resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * scale, 1),
+    }
+
+
+# --- fixtures ------------------------------------------------------------------
+
+def synthetic_text(rnd, n_words):
+    return " ".join(rnd.choice(WORDS) for _ in range(n_words))
+
+
+def synthetic_pdf(seed, pages=12):
+    """An RCP-like PDF: numbered section titles followed by paragraphs of text."""
+    import fitz  # PyMuPDF
+
+    rnd = random.Random(seed)
+    lines = ["1. DENOMINAZIONE DEL MEDICINALE", synthetic_text(rnd, 8)]
+    for number, title in RCP_SECTIONS:
+        lines.append(f"{number} {title}")
+        lines.extend(synthetic_text(rnd, 12) for _ in range(rnd.randint(5, 60)))
+    lines.append("7. TITOLARE DELL'AUTORIZZAZIONE ALL'IMMISSIONE IN COMMERCIO")
+    doc = fitz.open()
+    per_page = max(1, len(lines) // pages)
+    for start in range(0, len(lines), per_page):
+        page = doc.new_page()
+        page.insert_text((40, 40), "\n".join(lines[start:start + per_page]), fontsize=7)
+    data = doc.tobytes()
+    doc.close()
+    return data
+
+
+def synthetic_aics(n_medicines, packages):
+    """`packages` 9-digit AIC codes for each of `n_medicines` medicines (aic6 = first 6 digits)."""
+    return [f"{100000 + m:06d}{p:03d}" for m in range(n_medicines) for p in range(packages)]
+
+
+def search_response(aic):
+    """The formadosaggio/ricerca payload get_aifa_urls reads, for a synthetic AIC."""
+    aic6 = aic[:6]
+    return {"data": {"content": [{
+        "medicinale": {"codiceSis": f"S{int(aic6) % 97}", "aic6": aic6},
+        "codiceAtc": ["N02BE01"],
+        "descrizioneAtc": ["PARACETAMOLO"],
+    }]}}
+
+
+def record_fixtures(aics, fixture_dir=FIXTURE_DIR):
+    """Saves the real AIFA search response and RCP PDF of each AIC, for later offline runs."""
+    os.makedirs(os.path.join(fixture_dir, "json"), exist_ok=True)
+    os.makedirs(os.path.join(fixture_dir, "pdf"), exist_ok=True)
+    for aic in aics:
+        urls = AifaClient.get_aifa_urls(aic)
+        if urls is None:
+            print(f"{aic}: no data, skipped")
+            continue
+        with open(os.path.join(fixture_dir, "json", f"{aic}.json"), "wb") as f:
+            f.write(AifaClient.fetch_bytes(urls["URL_json"]))
+        codice_sis, aic6 = AifaClient.rcp_key(urls["URL_PDF"])
+        with open(os.path.join(fixture_dir, "pdf", f"{codice_sis}_{aic6}.pdf"), "wb") as f:
+            f.write(AifaClient.fetch_bytes(urls["URL_PDF"]))
+        print(f"{aic}: recorded")
+
+
+class FixtureServer:
+    """
+    Local stand-in for the two AIFA endpoints used by AifaClient. Recorded
+    fixtures are served when present; otherwise a synthetic response, with
+    the RCP PDF picked from a pool of `n_docs` pre-built documents.
+    """
+
+    def __init__(self, fixture_dir=FIXTURE_DIR, n_docs=20):
+        self.fixture_dir = fixture_dir
+        self.pdfs = [synthetic_pdf(seed) for seed in range(n_docs)]
+        self.requests = 0
+        self.lock = threading.Lock()
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                with server.lock:
+                    server.requests += 1
+                body, content_type = server.respond(self.path)
+                if body is None:
+                    self.send_response(404)
+                    self.end_headers()
+                    return
+                self.send_response(200)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        class Server(ThreadingHTTPServer):
+            request_queue_size = 128  # the default backlog of 5 drops connections under concurrency
+            daemon_threads = True
+
+        self.httpd = Server(("127.0.0.1", 0), Handler)
+        self.base = f"http://127.0.0.1:{self.httpd.server_port}"
+
+    def _fixture(self, *parts):
+        path = os.path.join(self.fixture_dir, *parts)
+        if os.path.exists(path):
+            with open(path, "rb") as f:
+                return f.read()
+        return None
+
+    def documents(self):
+        """The recorded RCP PDFs, followed by the synthetic ones."""
+        pdf_dir = os.path.join(self.fixture_dir, "pdf")
+        recorded = []
+        if os.path.isdir(pdf_dir):
+            for name in sorted(os.listdir(pdf_dir)):
+                with open(os.path.join(pdf_dir, name), "rb") as f:
+                    recorded.append(f.read())
+        return recorded + self.pdfs
+
+    def respond(self, path):
+        parts = urlsplit(path)
+        if parts.path.endswith("/formadosaggio/ricerca"):
+            # get_aifa_urls queries "0" + AIC
+            aic = parse_qs(parts.query).get("query", [""])[0][1:]
+            recorded = self._fixture("json", f"{aic}.json")
+            if recorded is not None:
+                return recorded, "application/json"
+            if not aic.isdigit():
+                return None, None
+            return json.dumps(search_response(aic)).encode(), "application/json"
+        key = AifaClient.rcp_key(parts.path)
+        if isinstance(key, tuple):
+            recorded = self._fixture("pdf", f"{key[0]}_{key[1]}.pdf")
+            if recorded is not None:
+                return recorded, "application/pdf"
+            return self.pdfs[int(key[1]) % len(self.pdfs)], "application/pdf"
+        return None, None
+
+    def __enter__(self):
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+        # Point AifaClient at the stand-in, without its production rate limit
+        self._api_base = AifaClient.API_BASE
+        AifaClient.API_BASE = self.base + urlsplit(self._api_base).path
+        AifaClient.HOST_RATE_LIMITS["127.0.0.1"] = 1e6
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        AifaClient.API_BASE = self._api_base
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+class FakeWorksheet:
+    """In-memory gspread worksheet; every API call costs `latency` seconds and is counted."""
+
+    def __init__(self, rows, latency=0.05):
+        self.rows = [list(row) for row in rows]
+        self.latency = latency
+        self.calls = 0
+
+    def _call(self):
+        self.calls += 1
+        time.sleep(self.latency)
+
+    def row_values(self, row):
+        self._call()
+        return list(self.rows[row - 1])
+
+    def get_all_values(self):
+        self._call()
+        return [list(row) for row in self.rows]
+
+    @property
+    def row_count(self):
+        return len(self.rows)
+
+    def batch_get(self, ranges):
+        self._call()
+        results = []
+        for a1_range in ranges:
+            (first_row, first_col), (last_row, last_col) = (a1_to_rowcol(cell) for cell in a1_range.split(":"))
+            block = [row[first_col - 1:last_col] for row in self.rows[first_row - 1:last_row]]
+            # Like the API: trailing empty cells and rows are left out
+            block = [row[:max([i + 1 for i, cell in enumerate(row) if cell] or [0])] for row in block]
+            while block and not block[-1]:
+                block.pop()
+            results.append(block)
+        return results
+
+    def update(self, range_name=None, values=None):
+        self._call()
+
+    def batch_update(self, data):
+        self._call()
+
+
+class FakeSheet:
+    def __init__(self, worksheet):
+        self.sheet1 = worksheet
+
+
+# --- stages --------------------------------------------------------------------
+
+def import_once(module):
+    """Imports `module` in a fresh interpreter; returns (seconds, loaded module names)."""
+    env = dict(os.environ, STREAMLIT_GLOBAL_SHOW_WARNING_ON_DIRECT_EXECUTION="false")
+    proc = subprocess.run([sys.executable, "-c", IMPORT_PROBE, module], capture_output=True, text=True,
+                          cwd=os.path.dirname(os.path.abspath(__file__)), env=env)
+    if proc.returncode != 0:
+        raise RuntimeError(f"importing {module} failed:\n{proc.stderr.strip()}")
+    probe = json.loads(proc.stdout.strip().splitlines()[-1])
+    return probe["seconds"], probe["modules"]
+
+
+def bench_imports(args):
+    """
+    Import time of every entry module against IMPORT_BUDGETS_MS; the failures
+    (over budget, deferred module loaded, network used) are listed in
+    args.failures.
+    """
+    results = {}
+    for module, budget in IMPORT_BUDGETS_MS.items():
+        try:
+            runs = [import_once(module) for _ in range(IMPORT_RUNS)]
+        except RuntimeError as e:
+            args.failures.append(str(e))
+            continue
+        samples = [seconds for seconds, _ in runs]
+        results[f"import {module}"] = summarize(samples)
+        best = min(samples) * 1000
+        if best > budget:
+            args.failures.append(f"importing {module} takes {best:.0f} ms (budget {budget} ms)")
+        loaded = [name for name in DEFERRED_IMPORTS if name in runs[0][1]]
+        if loaded:
+            args.failures.append(f"importing {module} loads {', '.join(loaded)}")
+    return results
+
+
+def bench_golden(args):
+    """The section extractor on GOLDEN_LINES (its output is checked by test_rcp_parser.py)."""
+    samples = [timed(extract_sections_from_lines, GOLDEN_LINES)[0] for _ in range(args.samples)]
+    return {"golden extract_sections_from_lines": summarize(samples)}
+
+
+def bench_resolve(args):
+    """AIC -> URL resolution: one get_aifa_urls at a time, then resolve_aifa_urls concurrently."""
+    aics = synthetic_aics(args.medicines, args.packages)
+    session = AifaClient.make_session()
+    samples = [timed(AifaClient.get_aifa_urls, aic, session)[0] for aic in aics[:args.samples]]
+    wall, resolved = timed(lambda: list(AifaClient.resolve_aifa_urls(aics)))
+    return {
+        "get_aifa_urls": summarize(samples),
+        "resolve_aifa_urls": summarize([], wall=wall, items=len(resolved)),
+    }
+
+
+def bench_parse(args, server):
+    """PDF parsing on the fixture documents, one call at a time."""
+    lines_samples, sections_samples, full_samples = [], [], []
+    for pdf_bytes in server.documents():
+        elapsed, lines = timed(extract_lines_from_pdf, pdf_bytes)
+        lines_samples.append(elapsed)
+        sections_samples.append(timed(extract_sections_from_lines, lines)[0])
+        full_samples.append(timed(extract_sections_from_pdf, pdf_bytes)[0])
+    return {
+        "extract_lines_from_pdf": summarize(lines_samples, wall=sum(lines_samples)),
+        "extract_sections_from_lines": summarize(sections_samples, wall=sum(sections_samples)),
+        "extract_sections_from_pdf": summarize(full_samples, wall=sum(full_samples)),
+    }
+
+
+def bench_pipeline(args, server):
+    """Download, parse and hand over every package's RCP through run_pipeline."""
+    records = [
+        {KEY_COLUMN: aic, "URL_PDF": f"{AifaClient.API_BASE}/organizzazione/S{int(aic[:6]) % 97}"
+                                     f"/farmaci/{aic[:6]}/stampati?ts=RCP"}
+        for aic in synthetic_aics(args.medicines, args.packages)
+    ]
+    results = {}
+    for name, coalesce in (("run_pipeline", True), ("run_pipeline_uncoalesced", False)):
+        server.requests = 0
+        latencies, started = [], time.perf_counter()
+
+        def on_result(record, sections, error):
+            latencies.append(time.perf_counter() - started)
+
+        wall, count = timed(run_pipeline, records, on_result, parse_workers=args.parse_workers,
+                            coalesce=coalesce)
+        results[name] = summarize(latencies, wall=wall, items=count)
+        results[name]["requests"] = server.requests
+    return results
+
+
+def bench_sheet(args):
+    """Sheet writes: update_row_in_sheet per row against SheetWriter's batches."""
+    aics = synthetic_aics(args.medicines, args.packages)
+    rows = [COLUMNS] + [[aic if col == KEY_COLUMN else "" for col in COLUMNS] for aic in aics]
+    update = {SECTION_COLUMNS["4.1"]: "text", SECTION_COLUMNS["4.3"]: "text"}
+    sample = aics[:min(args.samples, 20)]
+
+    worksheet = FakeWorksheet(rows, latency=args.sheet_latency)
+    samples = [timed(update_row_in_sheet, FakeSheet(worksheet), KEY_COLUMN, aic, update)[0] for aic in sample]
+    per_row = summarize(samples, wall=sum(samples))
+    per_row["api_calls"] = worksheet.calls
+
+    worksheet = FakeWorksheet(rows, latency=args.sheet_latency)
+    started = time.perf_counter()
+    with SheetWriter(FakeSheet(worksheet), KEY_COLUMN) as writer:
+        for aic in aics:
+            writer.update(aic, update)
+    batched = summarize([], wall=time.perf_counter() - started, items=len(aics))
+    batched["api_calls"] = worksheet.calls
+    return {"update_row_in_sheet": per_row, "SheetWriter": batched}
+
+
+def build_catalogue(path, n_rows, n_docs=200, seed=0):
+    """A synthetic drug table of n_rows packages, sharing n_docs distinct RCPs."""
+    rnd = random.Random(seed)
+    docs = []
+    for _ in range(n_docs):
+        docs.append({col: synthetic_text(rnd, rnd.randint(20, 400)) for col in SECTION_COLUMNS.values()})
+    ingredients = [synthetic_text(rnd, 1).upper() + f" {i}" for i in range(max(1, n_rows // 50))]
+    conn = sqlite3.connect(path)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute(create_table_sql(TABLE_NAME))
+    ensure_tables(conn)
+    placeholders = ", ".join(["?"] * len(COLUMNS))
+    insert = f"INSERT INTO {quote(TABLE_NAME)} ({', '.join(quote(c) for c in COLUMNS)}) VALUES ({placeholders})"
+    with conn:
+        for i in range(n_rows):
+            aic = f"{100000000 + i:09d}"
+            row = {col: "" for col in COLUMNS}
+            row.update(docs[(i // 5) % n_docs])
+            row.update({
+                KEY_COLUMN: aic,
+                "Principio Attivo": rnd.choice(ingredients),
+                "Denominazione e Confezione": f"FARMACO {i // 5} {synthetic_text(rnd, 2)}",
+                "Titolare AIC": f"TITOLARE {i % 300}",
+                "ATC": f"N0{i % 8}BE0{i % 9}",
+            })
+            row = write_row_sections(conn, row)
+            conn.execute(insert, [row[col] for col in COLUMNS])
+    conn.close()
+
+
+def bench_queries(args):
+    """The main.py query functions on a synthetic catalogue of `--rows` drugs."""
+    logging.getLogger("streamlit").setLevel(logging.ERROR)
+    import main
+
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "catalogue.db")
+        wall, _ = timed(build_catalogue, path, args.rows)
+        results["build_catalogue"] = summarize([], wall=wall, items=args.rows)
+        main.DB_NAME = path
+        main.get_db.clear()
+        wall, db = timed(main.get_db)  # schema checks and full-text index build
+        results["init_db"] = summarize([wall])
+
+        rnd = random.Random(1)
+        n = args.samples
+        aics = [f"{100000000 + rnd.randrange(args.rows):09d}" for _ in range(n)]
+        cases = {
+            "count_rows": lambda i: main.count_rows(),
+            "fetch_page": lambda i: main.fetch_page(after=rnd.randrange(args.rows), limit=20),
+            "fetch_details": lambda i: main.fetch_details(rnd.randrange(1, args.rows + 1)),
+            "fetch_by_pk": lambda i: main.fetch_by_pk(aics[i]),
+            "search_data": lambda i: main.search_data(rnd.choice(["warfarin", "ketoconaz", "FARMACO 1", aics[i]])),
+        }
+        for name, case in cases.items():
+            db.invalidate()
+            cold = [timed(case, i)[0] for i in range(n)]
+            results[name] = summarize(cold, wall=sum(cold))
+        main.get_db.clear()
+    return results
+
+
+# --- reporting -----------------------------------------------------------------
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_results(stages):
+    print(f"{'stage':<30} {'n':>6} {'p50 ms':>10} {'p90 ms':>10} {'p99 ms':>10} {'per s':>10}")
+    for name, row in stages.items():
+        cells = [row.get(key) for key in ("p50_ms", "p90_ms", "p99_ms", "per_s")]
+        cells = ["-" if cell is None else f"{cell:,.2f}" for cell in cells]
+        print(f"{name:<30} {row['n']:>6} " + " ".join(f"{cell:>10}" for cell in cells))
+
+
+def compare(old, new):
+    """Prints the ratio new/old of p50 latency and throughput for the stages in both runs."""
+    print(f"Compared with {old.get('commit')} ({old.get('timestamp')}):")
+    for name, row in new["stages"].items():
+        before = old.get("stages", {}).get(name)
+        if before is None:
+            continue
+        parts = []
+        for key in ("p50_ms", "per_s"):
+            if row.get(key) and before.get(key):
+                parts.append(f"{key} x{row[key] / before[key]:.2f}")
+        if parts:
+            print(f"  {name:<30} " + ", ".join(parts))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the fetch / parse / store pipeline offline.")
+    parser.add_argument("--stages", default=",".join(STAGES), help="comma-separated: " + ", ".join(STAGES))
+    parser.add_argument("--medicines", type=int, default=40, help="distinct medicines (RCPs) in the run")
+    parser.add_argument("--packages", type=int, default=5, help="packages (AIC codes) per medicine")
+    parser.add_argument("--docs", type=int, default=20, help="distinct synthetic PDFs served")
+    parser.add_argument("--samples", type=int, default=100, help="calls timed one by one per stage")
+    parser.add_argument("--rows", type=int, default=20000, help="rows of the synthetic catalogue")
+    parser.add_argument("--parse-workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--sheet-latency", type=float, default=0.05, help="seconds per fake Sheets API call")
+    parser.add_argument("--fixtures", default=FIXTURE_DIR)
+    parser.add_argument("--record", nargs="+", metavar="AIC", help="record real AIFA fixtures and exit")
+    parser.add_argument("--compare", metavar="JSON", help="earlier result file to compare with")
+    parser.add_argument("--output", help="result file (default: benchmark_results/<time>-<commit>.json)")
+    args = parser.parse_args()
+
+    if args.record:
+        record_fixtures(args.record, args.fixtures)
+        return
+
+    selected = [stage.strip() for stage in args.stages.split(",") if stage.strip()]
+    stages = {}
+    args.failures = []
+    if "imports" in selected:
+        stages.update(bench_imports(args))
+    if "golden" in selected:
+        stages.update(bench_golden(args))
+    with FixtureServer(args.fixtures, n_docs=args.docs) as server:
+        if "resolve" in selected:
+            stages.update(bench_resolve(args))
+        if "parse" in selected:
+            stages.update(bench_parse(args, server))
+        if "pipeline" in selected:
+            stages.update(bench_pipeline(args, server))
+    if "sheet" in selected:
+        stages.update(bench_sheet(args))
+    if "queries" in selected:
+        stages.update(bench_queries(args))
+
+    result = {
+        "commit": git_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": sys.version.split()[0],
+        "params": {key: value for key, value in vars(args).items()
+                   if key not in ("record", "compare", "output", "failures")},
+        "stages": stages,
+        "failures": args.failures,
+        "peak_rss_mb": peak_rss_mb(),
+    }
+    print_results(stages)
+    print(f"Peak RSS: {result['peak_rss_mb']['self']} MB (child processes: {result['peak_rss_mb']['children']} MB)")
+
+    output = args.output
+    if output is None:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        output = os.path.join(RESULTS_DIR, f"{time.strftime('%Y%m%d-%H%M%S')}-{result['commit'] or 'nogit'}.json")
+    with open(output, "w") as f:
+        json.dump(result, f, indent=2)
+    print(f"Saved {output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(json.load(f), result)
+
+    if args.failures:
+        print("Failed checks:\n  " + "\n  ".join(args.failures))
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,290 @@
+import argparse
+import csv
+import io
+import os
+import tempfile
+
+from DrugQueries import atc_condition
+from Mentions import refresh_mentions
+from RcpStore import TRUNCATED_MARK, index_sections, section_texts, write_row_sections
+from Schema import COLUMNS, DB_NAME, KEY_COLUMN, SECTION_COLUMNS, TABLE_NAME, canonical_name, quote
+from SearchIndex import build_match_query, fts_table
+
+
+CHUNK_ROWS = 500          # rows per lookup when diffing and per read when exporting
+XLSX_MAX_CELL = 32767     # Excel's limit on the characters of one cell
+# Export formats and their MIME types; xlsx needs openpyxl, parquet pyarrow
+FORMATS = {
+    "csv": "text/csv",
+    "xlsx": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+    "parquet": "application/vnd.apache.parquet",
+}
+
+
+def _cell(value):
+    """An uploaded cell as text: blanks and NaN as "", whole floats (AIC codes read as numbers) without ".0"."""
+    if value is None or value != value:
+        return ""
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value).strip()
+
+
+def read_upload(file, name):
+    """
+    Reads an uploaded CSV, XLSX or Parquet file into records.
+
+    Column names are matched to the canonical ones (legacy spellings
+    included, see Schema.LEGACY_NAMES); unknown columns are ignored. The file
+    needs the AIC column; the other columns may be any subset.
+
+    Returns:
+        tuple: (columns, records, skipped) - the canonical columns found, AIC
+        first; one dict per row (a later row for the same AIC replaces an
+        earlier one); messages about the rows left out.
+    """
+    import pandas as pd
+
+    extension = os.path.splitext(name)[1].lower()
+    if extension == ".csv":
+        df = pd.read_csv(file, dtype=str, keep_default_na=False, encoding="utf-8-sig")
+    elif extension in (".xlsx", ".xls"):
+        df = pd.read_excel(file, dtype=str)
+    elif extension == ".parquet":
+        df = pd.read_parquet(file)
+    else:
+        raise ValueError(f"Unsupported file type {extension!r}; use .csv, .xlsx or .parquet")
+
+    positions = {}
+    for i, column in enumerate(df.columns):
+        name = canonical_name(str(column).strip())
+        if name in COLUMNS and name not in positions:
+            positions[name] = i
+    if KEY_COLUMN not in positions:
+        raise ValueError(f'The file has no "{KEY_COLUMN}" column')
+    columns = [KEY_COLUMN] + [col for col in COLUMNS if col in positions and col != KEY_COLUMN]
+
+    records = {}
+    skipped = []
+    for line, values in enumerate(df.itertuples(index=False, name=None), start=2):
+        record = {col: _cell(values[positions[col]]) for col in columns}
+        if not record[KEY_COLUMN]:
+            skipped.append(f"row {line}: no AIC code")
+            continue
+        if record[KEY_COLUMN] in records:
+            skipped.append(f"row {line}: AIC {record[KEY_COLUMN]} repeated, the last row is used")
+            del records[record[KEY_COLUMN]]
+        records[record[KEY_COLUMN]] = record
+    return columns, list(records.values()), skipped
+
+
+def diff_upload(conn, columns, records, table=TABLE_NAME):
+    """
+    Compares uploaded records with the table. A blank cell leaves the stored
+    value as it is, so only non-blank cells that differ count as changes;
+    section texts are compared in full, not with their inline preview.
+
+    Returns:
+        dict: "new" (records for AIC codes not in the table), "changed"
+        (list of (record, {column: (old, new)})) and "unchanged" (count).
+    """
+    sections = [col for col in columns if col in SECTION_COLUMNS.values()]
+    select = ", ".join(quote(col) for col in columns)
+    diff = {"new": [], "changed": [], "unchanged": 0}
+    for start in range(0, len(records), CHUNK_ROWS):
+        chunk = records[start:start + CHUNK_ROWS]
+        aics = [record[KEY_COLUMN] for record in chunk]
+        existing = {
+            row[0]: dict(zip(columns, row))
+            for row in conn.execute(
+                f"SELECT {select} FROM {quote(table)} WHERE {quote(KEY_COLUMN)} IN ({', '.join('?' * len(aics))})",
+                aics,
+            )
+        }
+        full = section_texts(conn, sections, list(existing))
+        for record in chunk:
+            old = existing.get(record[KEY_COLUMN])
+            if old is None:
+                diff["new"].append(record)
+                continue
+            old.update(full.get(record[KEY_COLUMN], {}))
+            changes = {
+                col: (old[col], value) for col, value in record.items()
+                if col != KEY_COLUMN and value != "" and value != (old[col] or "")
+            }
+            if changes:
+                diff["changed"].append((record, changes))
+            else:
+                diff["unchanged"] += 1
+    return diff
+
+
+def apply_upload(conn, columns, records, table=TABLE_NAME):
+    """
+    Upserts records on the AIC code in one statement: new AIC codes are
+    inserted, existing rows get the non-blank cells of the record. Section
+    texts go to the RCP store first (see RcpStore.write_row_sections); the
+    search and mention indexes are updated for the written rows. Runs on the
+    caller's transaction; the other indexes and summary tables are kept in
+    step by their triggers.
+
+    Returns:
+        int: Records written.
+    """
+    if not records:
+        return 0
+    # A blank section cell keeps the stored text, so only non-blank ones go to the store
+    sections = set(SECTION_COLUMNS.values())
+    rows = [
+        dict(record, **write_row_sections(conn, {col: value for col, value in record.items()
+                                                 if col not in sections or value}))
+        for record in records
+    ]
+    updates = ", ".join(
+        f"{quote(col)} = COALESCE(NULLIF(excluded.{quote(col)}, ''), {quote(col)})"
+        for col in columns if col != KEY_COLUMN
+    )
+    sql = (f"INSERT INTO {quote(table)} ({', '.join(quote(col) for col in columns)}) "
+           f"VALUES ({', '.join('?' * len(columns))}) ON CONFLICT ({quote(KEY_COLUMN)}) ")
+    sql += f"DO UPDATE SET {updates}" if updates else "DO NOTHING"
+    conn.executemany(sql, ([row[col] for col in columns] for row in rows))
+    aics = [record[KEY_COLUMN] for record in records]
+    index_sections(conn, aics, table)
+    refresh_mentions(conn, table, aics=aics)
+    return len(rows)
+
+
+def export_filter(atc=None, ingredient=None, term=None, table=TABLE_NAME):
+    """WHERE conditions and parameters selecting the drugs to export."""
+    conditions, params = [], []
+    if atc and atc.strip():
+        condition, atc_params = atc_condition(atc)
+        conditions.append(condition)
+        params += atc_params
+    if ingredient:
+        conditions.append('"Principio Attivo" IN (?, ?)')
+        params += [ingredient, ingredient.upper()]
+    if term and build_match_query(term):
+        fts = quote(fts_table(table))
+        conditions.append(f"rowid IN (SELECT rowid FROM {fts} WHERE {fts} MATCH ?)")
+        params.append(build_match_query(term))
+    return conditions, params
+
+
+def iter_export(conn, atc=None, ingredient=None, term=None, chunk_rows=CHUNK_ROWS, table=TABLE_NAME):
+    """
+    Yields the selected drugs, every column with the section texts in full, in
+    lists of at most `chunk_rows` row tuples. Pages are read by keyset on
+    rowid, so only one chunk is in memory at a time.
+    """
+    conditions, params = export_filter(atc, ingredient, term, table)
+    where = "".join(f" AND {condition}" for condition in conditions)
+    sections = list(SECTION_COLUMNS.values())
+    key_pos = COLUMNS.index(KEY_COLUMN)
+    sql = (f"SELECT rowid, {', '.join(quote(col) for col in COLUMNS)} FROM {quote(table)} "
+           f"WHERE rowid > ?{where} ORDER BY rowid LIMIT ?")
+    after = 0
+    while True:
+        rows = conn.execute(sql, [after] + params + [chunk_rows]).fetchall()
+        if not rows:
+            return
+        after = rows[-1][0]
+        full = section_texts(conn, sections, [row[1 + key_pos] for row in rows])
+        chunk = []
+        for row in rows:
+            stored = full.get(row[1 + key_pos], {})
+            chunk.append(tuple(stored.get(col, value) for col, value in zip(COLUMNS, row[1:])))
+        yield chunk
+
+
+def write_export(conn, out, fmt="csv", **filters):
+    """
+    Writes the drugs selected by `filters` (see iter_export) to the binary
+    file `out`, a chunk at a time.
+
+    Returns:
+        int: Rows written.
+    """
+    count = 0
+    if fmt == "csv":
+        # utf-8-sig so Excel shows the accents; read_upload reads it back
+        text = io.TextIOWrapper(out, encoding="utf-8-sig", newline="", write_through=True)
+        writer = csv.writer(text)
+        writer.writerow(COLUMNS)
+        for chunk in iter_export(conn, **filters):
+            writer.writerows(chunk)
+            count += len(chunk)
+        text.detach()
+    elif fmt == "parquet":
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        schema = pa.schema([(col, pa.string()) for col in COLUMNS])
+        with pq.ParquetWriter(out, schema, compression="zstd") as writer:
+            for chunk in iter_export(conn, **filters):
+                writer.write_table(pa.Table.from_arrays(
+                    [pa.array(values, pa.string()) for values in zip(*chunk)], schema=schema
+                ))
+                count += len(chunk)
+    elif fmt == "xlsx":
+        from openpyxl import Workbook
+
+        workbook = Workbook(write_only=True)
+        sheet = workbook.create_sheet("drugs")
+        sheet.append(COLUMNS)
+        limit = XLSX_MAX_CELL - len(TRUNCATED_MARK)
+        for chunk in iter_export(conn, **filters):
+            for row in chunk:
+                sheet.append([value[:limit] + TRUNCATED_MARK if value and len(value) > XLSX_MAX_CELL else value
+                              for value in row])
+            count += len(chunk)
+        workbook.save(out)
+    else:
+        raise ValueError(f"Unknown export format {fmt!r}; use one of {', '.join(FORMATS)}")
+    return count
+
+
+def export_file(conn, fmt="csv", **filters):
+    """The export as a temporary file (deleted when closed), rewound for reading."""
+    out = tempfile.TemporaryFile()
+    write_export(conn, out, fmt, **filters)
+    out.seek(0)
+    return out
+
+
+if __name__ == "__main__":
+    import sqlite3
+
+    parser = argparse.ArgumentParser(description="Bulk import into / export from the medicines database.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    load = sub.add_parser("import", help="show what a CSV/XLSX/Parquet file would change, and apply it")
+    load.add_argument("file")
+    load.add_argument("--apply", action="store_true", help="write the changes (default: preview only)")
+    dump = sub.add_parser("export", help="export drugs to .csv, .xlsx or .parquet")
+    dump.add_argument("file")
+    dump.add_argument("--atc", help="ATC code prefix")
+    dump.add_argument("--ingredient", help="active ingredient")
+    dump.add_argument("--search", help="full-text search")
+    parser.add_argument("--db", default=DB_NAME)
+    args = parser.parse_args()
+
+    conn = sqlite3.connect(args.db)
+    if args.command == "import":
+        with open(args.file, "rb") as f:
+            columns, records, skipped = read_upload(f, args.file)
+        for message in skipped:
+            print(f"Skipped {message}")
+        diff = diff_upload(conn, columns, records)
+        print(f"{len(diff['new'])} new, {len(diff['changed'])} changed, {diff['unchanged']} unchanged")
+        for record, changes in diff["changed"][:20]:
+            print(f"  {record[KEY_COLUMN]}: {', '.join(changes)}")
+        if args.apply:
+            with conn:
+                written = apply_upload(conn, columns, diff["new"] + [record for record, _ in diff["changed"]])
+            print(f"Applied {written} rows")
+    else:
+        fmt = os.path.splitext(args.file)[1].lower().lstrip(".")
+        with open(args.file, "wb") as f:
+            written = write_export(conn, f, fmt, atc=args.atc, ingredient=args.ingredient, term=args.search)
+        print(f"Exported {written} rows to {args.file}")
+    conn.close()
@@ -1,58 +1,110 @@
 import csv
 import sqlite3
+import time
+from itertools import chain, islice
+
+from Schema import KEY_COLUMN, canonical_name, create_indexes
 
 CSV_FILE = 'TestMohammad-Omid - Sheet1.csv'
 DB_FILE = 'test_mohammad_omid2.db'
 TABLE_NAME = 'data'
 
-def infer_column_types(sample_row):
-    types = []
-    for value in sample_row:
+SAMPLE_ROWS = 1000   # rows read to infer column types
+CHUNK_SIZE = 5000    # rows per executemany call
+
+def infer_value_type(value):
+    # Codes such as AIC "043658032" must keep their leading zeros
+    if len(value) > 1 and value[0] == '0' and value[1] != '.':
+        return 'TEXT'
+    try:
+        int(value)
+        return 'INTEGER'
+    except ValueError:
         try:
-            int(value)
-            types.append('INTEGER')
+            float(value)
+            return 'REAL'
         except ValueError:
-            try:
-                float(value)
-                types.append('REAL')
-            except ValueError:
-                types.append('TEXT')
-    return types
-
-def main():
-    with open(CSV_FILE, newline='', encoding='utf-8') as csvfile:
+            return 'TEXT'
+
+def infer_column_types(sample_rows, n_columns):
+    """
+    Infers one type per column over a window of rows: a column is INTEGER or REAL
+    only if every non-empty sampled value parses as such, otherwise TEXT.
+    Columns with no values in the sample default to TEXT.
+    """
+    rank = {'INTEGER': 0, 'REAL': 1, 'TEXT': 2}
+    types = [None] * n_columns
+    for row in sample_rows:
+        for i, value in enumerate(row[:n_columns]):
+            value = value.strip()
+            if not value or types[i] == 'TEXT':
+                continue
+            value_type = infer_value_type(value)
+            if types[i] is None or rank[value_type] > rank[types[i]]:
+                types[i] = value_type
+    return [t or 'TEXT' for t in types]
+
+def fit_row(row, n_columns):
+    """Pads or trims a CSV row to the header width."""
+    if len(row) < n_columns:
+        return row + [''] * (n_columns - len(row))
+    return row[:n_columns]
+
+def main(csv_file=CSV_FILE, db_file=DB_FILE, table_name=TABLE_NAME):
+    started = time.perf_counter()
+    with open(csv_file, newline='', encoding='utf-8') as csvfile:
         reader = csv.reader(csvfile)
-        headers = next(reader)
-        sample_row = next(reader)
-        csvfile.seek(0)
-        next(reader)  # skip header again
+        # Same column names as the app and the scrapers, whatever the export used
+        headers = [canonical_name(name) for name in next(reader)]
+        n_columns = len(headers)
+        sample_rows = list(islice(reader, SAMPLE_ROWS))
 
-        # Infer types from the sample row
-        column_types = infer_column_types(sample_row)
+        # Infer types from a window of rows rather than a single one
+        column_types = infer_column_types(sample_rows, n_columns)
+        # AIC codes are looked up as text everywhere
+        column_types = ['TEXT' if name == KEY_COLUMN else t for name, t in zip(headers, column_types)]
 
         # Create table SQL
         columns = [f'"{name}" {col_type}' for name, col_type in zip(headers, column_types)]
-        create_table_sql = f'CREATE TABLE IF NOT EXISTS {TABLE_NAME} ({", ".join(columns)});'
+        create_table_sql = f'CREATE TABLE IF NOT EXISTS {table_name} ({", ".join(columns)});'
 
         # Connect to SQLite and create table
-        conn = sqlite3.connect(DB_FILE)
+        conn = sqlite3.connect(db_file)
+        conn.execute('PRAGMA journal_mode=WAL')
+        # No fsync during the import; the file is only consistent once main() returns
+        conn.execute('PRAGMA synchronous=OFF')
         c = conn.cursor()
         c.execute(create_table_sql)
 
-        # Insert data
-        placeholders = ','.join(['?'] * len(headers))
-        insert_sql = f'INSERT INTO {TABLE_NAME} VALUES ({placeholders})'
-
-        # Insert the sample row first
-        c.execute(insert_sql, sample_row)
+        # Insert data in chunks inside one transaction
+        placeholders = ','.join(['?'] * n_columns)
+        insert_sql = f'INSERT INTO {table_name} VALUES ({placeholders})'
+        rows = (fit_row(row, n_columns) for row in chain(sample_rows, reader))
+        count = 0
+        with conn:
+            while True:
+                chunk = list(islice(rows, CHUNK_SIZE))
+                if not chunk:
+                    break
+                c.executemany(insert_sql, chunk)
+                count += len(chunk)
 
-        # Insert the rest of the rows
-        for row in reader:
-            c.execute(insert_sql, row)
+        # Indexes are cheaper to build once the data is in
+        try:
+            with conn:
+                create_indexes(conn, table_name, unique_key=True)
+        except sqlite3.IntegrityError:
+            print(f"Warning: repeated '{KEY_COLUMN}' values, the AIC code index is not unique.")
+            with conn:
+                create_indexes(conn, table_name)
+                c.execute(f'CREATE INDEX IF NOT EXISTS idx_{table_name}_aic ON {table_name} ("{KEY_COLUMN}")')
 
-        conn.commit()
+        conn.execute('PRAGMA synchronous=NORMAL')
         conn.close()
-        print(f"Database '{DB_FILE}' created with table '{TABLE_NAME}'.")
+
+    elapsed = time.perf_counter() - started
+    print(f"Database '{db_file}' created with table '{table_name}'.")
+    print(f"Loaded {count} rows in {elapsed:.2f}s ({count / elapsed:,.0f} rows/s).")
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,118 @@
+import sqlite3
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+
+CACHE_SIZE = 256  # cached query results kept per Database
+
+
+class Database:
+    """
+    Process-wide access to one SQLite file.
+
+    Reads use one connection per thread (opened once, reused across calls) and
+    can be served from an LRU cache of query results. Writes go through a single
+    shared connection, one transaction at a time; every committed write clears
+    the cache, and so does a commit by any other process (detected through
+    PRAGMA data_version), so cached reads never outlive their data.
+    The file is switched to WAL so readers are not blocked while a write runs.
+    """
+
+    def __init__(self, path, cache_size=CACHE_SIZE):
+        self.path = path
+        self.cache_size = cache_size
+        self.local = threading.local()
+        self.write_lock = threading.Lock()
+        self.cache_lock = threading.Lock()
+        self.cache = OrderedDict()
+        self.version = 0  # bumped on every committed write
+        self._writer = None
+        self._watch = self.connect()
+        self._watch.execute("PRAGMA journal_mode=WAL")
+        self._data_version = self._watch.execute("PRAGMA data_version").fetchone()[0]
+
+    def connect(self):
+        conn = sqlite3.connect(self.path, check_same_thread=False)
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA busy_timeout=5000")
+        return conn
+
+    def reader(self):
+        """Returns this thread's read connection."""
+        conn = getattr(self.local, "conn", None)
+        if conn is None:
+            conn = self.connect()
+            conn.execute("PRAGMA query_only=ON")
+            self.local.conn = conn
+        return conn
+
+    @contextmanager
+    def writer(self):
+        """
+        Yields the shared write connection inside a transaction; commits and
+        invalidates cached reads on success, rolls back on error.
+        """
+        with self.write_lock:
+            if self._writer is None:
+                self._writer = self.connect()
+            conn = self._writer
+            try:
+                yield conn
+                conn.commit()
+            except BaseException:
+                conn.rollback()
+                raise
+            finally:
+                self.invalidate()
+
+    def invalidate(self):
+        with self.cache_lock:
+            self.version += 1
+            self.cache.clear()
+
+    def _check_external_writes(self):
+        # Caller holds cache_lock. data_version changes when another connection
+        # (another process such as SheetToDb, or this process's writer) commits.
+        data_version = self._watch.execute("PRAGMA data_version").fetchone()[0]
+        if data_version != self._data_version:
+            self._data_version = data_version
+            self.version += 1
+            self.cache.clear()
+
+    def current_version(self):
+        """
+        The data version, bumped by every commit from this process or another;
+        lets callers keep their own caches keyed on it.
+        """
+        with self.cache_lock:
+            self._check_external_writes()
+            return self.version
+
+    def query(self, sql, params=(), cached=True):
+        """
+        Runs a read query.
+
+        Returns:
+            tuple: (column names, list of row tuples). With `cached`, identical
+            queries are answered from the cache until the next write.
+        """
+        key = (sql, tuple(params))
+        if cached:
+            with self.cache_lock:
+                self._check_external_writes()
+                hit = self.cache.get(key)
+                if hit is not None:
+                    self.cache.move_to_end(key)
+                    return hit
+                version = self.version
+        cursor = self.reader().execute(sql, params)
+        result = ([d[0] for d in cursor.description or ()], cursor.fetchall())
+        if cached:
+            with self.cache_lock:
+                # Skip storing if a write landed while the query ran
+                if version == self.version:
+                    self.cache[key] = result
+                    if len(self.cache) > self.cache_size:
+                        self.cache.popitem(last=False)
+        return result
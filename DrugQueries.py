@@ -0,0 +1,147 @@
+from Analytics import ATC_GLOB, ensure_analytics
+from Mentions import ensure_tables as ensure_mention_tables
+from Mentions import ingredient_key
+from RcpStore import ensure_tables, expand_row, load_sections
+from Schema import COLUMNS, KEY_COLUMN, TABLE_NAME, create_table_sql, migrate_table, quote
+from SearchIndex import ensure_search_index, search_query
+
+
+# Columns shown when browsing; the rest are loaded per row on demand
+SUMMARY_COLUMNS = [
+    "Codice  AIC",
+    "Denominazione e Confezione",
+    "Principio Attivo",
+    "Titolare AIC",
+    "Codice Gruppo Equivalenza",
+    "ATC",
+    "Class"
+]
+DETAIL_COLUMNS = [col for col in COLUMNS if col not in SUMMARY_COLUMNS]
+
+_SUMMARY_SELECT = ", ".join(quote(col) for col in SUMMARY_COLUMNS)
+
+
+def init_db(db):
+    with db.writer() as conn:
+        conn.execute(create_table_sql(TABLE_NAME))
+        # Older databases: rename legacy columns, key on "Codice  AIC", add indexes
+        migrate_table(conn, TABLE_NAME)
+        # Full RCP section texts, compressed and shared between packages
+        ensure_tables(conn)
+        # Full-text index over names, active ingredient and RCP sections, kept in sync by triggers
+        ensure_search_index(conn, TABLE_NAME)
+        # Packages per ATC level, group, holder and section outcome, kept in sync by triggers
+        ensure_analytics(conn, TABLE_NAME)
+        # Ingredients mentioned in sections 4.5/4.3, refreshed after every write (Mentions.refresh_mentions)
+        ensure_mention_tables(conn)
+
+
+def count_rows(db):
+    return db.query(f"SELECT COUNT(*) FROM {quote(TABLE_NAME)}")[1][0][0]
+
+
+def fetch_page(db, after=0, limit=20):
+    """
+    One page of the summary columns, by keyset on rowid: the rows following
+    rowid `after`. Every page costs an index seek, however deep it is.
+
+    Returns:
+        tuple: (column names, rows), rowid first.
+    """
+    return db.query(
+        f"SELECT rowid, {_SUMMARY_SELECT} FROM {quote(TABLE_NAME)} WHERE rowid > ? ORDER BY rowid LIMIT ?",
+        (after, limit)
+    )
+
+
+def fetch_details(db, rowid):
+    """
+    The long columns (RCP sections, URLs) of one row, with the AIC code, as a
+    dict; None if there is no such row. Sections kept in the RCP store are
+    returned in full rather than as their inline preview.
+    """
+    columns, rows = db.query(
+        f"SELECT {quote(KEY_COLUMN)}, {', '.join(quote(col) for col in DETAIL_COLUMNS)} "
+        f"FROM {quote(TABLE_NAME)} WHERE rowid = ?", (rowid,)
+    )
+    if not rows:
+        return None
+    details = dict(zip(columns, rows[0]))
+    details.update(load_sections(db.reader(), details[KEY_COLUMN], DETAIL_COLUMNS))
+    return details
+
+
+def fetch_by_pk(db, pk):
+    """Every column of one drug as a dict, section texts in full; None if not found."""
+    columns, rows = db.query(f"SELECT * FROM {quote(TABLE_NAME)} WHERE {quote(KEY_COLUMN)} = ?", (pk,))
+    if not rows:
+        return None
+    return expand_row(db.reader(), dict(zip(columns, rows[0])))
+
+
+def search_data(db, term, limit=200):
+    """Full-text search (see SearchIndex); returns (column names, rows), empty for a blank term."""
+    built = search_query(db.reader(), TABLE_NAME, term, limit=limit)
+    if built is None:
+        return [], []
+    return db.query(*built)
+
+
+def prefix_range(prefix):
+    """Bounds [low, high) of the strings starting with `prefix`, for an index range scan."""
+    if not prefix:
+        raise ValueError("prefix_range needs a non-empty prefix")
+    return prefix, prefix[:-1] + chr(ord(prefix[-1]) + 1)
+
+
+def atc_condition(prefix=""):
+    """
+    WHERE condition and parameters matching the ATC codes that start with
+    `prefix` (every code when blank). Values that are not ATC codes, such as
+    the scrapers' "NON" and "None - None", never match.
+
+    Returns:
+        tuple: (SQL condition, parameters).
+    """
+    prefix = (prefix or "").strip().upper()
+    if not prefix:
+        return "ATC GLOB ?", [ATC_GLOB]
+    return "ATC >= ? AND ATC < ? AND ATC GLOB ?", list(prefix_range(prefix)) + [ATC_GLOB]
+
+
+def fetch_by_atc(db, prefix, after=0, limit=100):
+    """
+    Summary rows whose ATC code starts with `prefix` (e.g. "N02B"), paged by
+    rowid like fetch_page. Uses the ATC index as a range scan.
+    """
+    condition, params = atc_condition(prefix)
+    return db.query(
+        f"SELECT rowid, {_SUMMARY_SELECT} FROM {quote(TABLE_NAME)} "
+        f"WHERE {condition} AND rowid > ? ORDER BY rowid LIMIT ?",
+        params + [after, limit]
+    )
+
+
+def fetch_by_ingredient(db, name, after=0, limit=100):
+    """Summary rows for one active ingredient (as written, or upper-case as in the sheet)."""
+    return db.query(
+        f'SELECT rowid, {_SUMMARY_SELECT} FROM {quote(TABLE_NAME)} '
+        f'WHERE "Principio Attivo" IN (?, ?) AND rowid > ? ORDER BY rowid LIMIT ?',
+        (name, name.upper(), after, limit)
+    )
+
+
+def fetch_by_mention(db, name, after=0, limit=100, include_own=False):
+    """
+    Summary rows of the drugs whose interactions (4.5) or contraindications
+    (4.3) mention an active ingredient, with the number of mentions, paged by
+    rowid. A lookup in the Mentions index, not a scan of the texts; a drug's
+    own ingredient is not counted unless `include_own`.
+    """
+    own = "" if include_own else "AND m.own = 0 "
+    return db.query(
+        f"SELECT t.rowid, {', '.join('t.' + quote(col) for col in SUMMARY_COLUMNS)}, SUM(m.hits) AS mentions "
+        f"FROM ingredient_mentions m JOIN {quote(TABLE_NAME)} t ON t.{quote(KEY_COLUMN)} = m.aic "
+        f"WHERE m.ingredient = ? {own}AND t.rowid > ? GROUP BY t.rowid ORDER BY t.rowid LIMIT ?",
+        (ingredient_key(name), after, limit)
+    )
@@ -0,0 +1,151 @@
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+
+
+LEDGER_DB = "jobs.db"
+MAX_ATTEMPTS = 3  # failed rows are retried on later runs until this many attempts
+
+
+def content_hash(value):
+    """Stable sha256 of a string, bytes or JSON-serialisable value."""
+    if isinstance(value, str):
+        value = value.encode("utf-8")
+    elif not isinstance(value, bytes):
+        value = json.dumps(value, sort_keys=True, ensure_ascii=False).encode("utf-8")
+    return hashlib.sha256(value).hexdigest()
+
+
+class JobLedger:
+    """
+    Persistent per-AIC progress of a scraper job, so an interrupted or repeated
+    run only does the rows that still need work.
+
+    Each row records its status ('running', 'done' or 'failed'), the hash of
+    the input it was processed from (source_hash), the hash of what was written
+    (content_hash), the attempt count, the last error and timestamps. Rows are
+    scoped by `job` so several scrapers can share one database.
+    """
+
+    def __init__(self, job, path=LEDGER_DB, max_attempts=MAX_ATTEMPTS):
+        self.job = job
+        self.max_attempts = max_attempts
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS jobs (
+                job TEXT NOT NULL,
+                aic TEXT NOT NULL,
+                status TEXT NOT NULL,
+                source_hash TEXT,
+                content_hash TEXT,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                last_error TEXT,
+                started_at REAL,
+                updated_at REAL,
+                PRIMARY KEY (job, aic)
+            )
+        """)
+        self.conn.commit()
+
+    def pending(self, rows, key, source=None):
+        """
+        Filters rows down to those that need processing.
+
+        A row is skipped when it is already 'done' for the same source hash, or
+        when it has failed `max_attempts` times for that source. Rows left
+        'running' by a crashed run are picked up again.
+
+        Args:
+            rows (list): Row dicts, e.g. from get_all_rows.
+            key (str): Column holding the AIC code.
+            source (list, optional): Columns whose values make up the source
+                hash. Defaults to the key column alone.
+
+        Returns:
+            list: The rows still to process, in their original order.
+        """
+        with self.lock:
+            known = {
+                aic: (status, source_hash, attempts)
+                for aic, status, source_hash, attempts in self.conn.execute(
+                    "SELECT aic, status, source_hash, attempts FROM jobs WHERE job = ?", (self.job,)
+                )
+            }
+        todo = []
+        for row in rows:
+            aic = row.get(key)
+            if not aic:
+                continue
+            state = known.get(aic)
+            if state is not None and state[1] == self.source_hash(row, key, source):
+                status, _, attempts = state
+                if status == "done" or (status == "failed" and attempts >= self.max_attempts):
+                    continue
+            todo.append(row)
+        return todo
+
+    @staticmethod
+    def source_hash(row, key, source=None):
+        return content_hash([row.get(col, "") for col in (source or [key])])
+
+    def start(self, rows, key, source=None):
+        """
+        Marks rows as running and counts the attempt, in one transaction. A row
+        whose source hash changed starts again from one attempt.
+        """
+        now = time.time()
+        entries = [(self.job, row[key], self.source_hash(row, key, source), now, now) for row in rows]
+        with self.lock:
+            self.conn.executemany("""
+                INSERT INTO jobs (job, aic, status, source_hash, attempts, started_at, updated_at)
+                VALUES (?, ?, 'running', ?, 1, ?, ?)
+                ON CONFLICT (job, aic) DO UPDATE SET
+                    status = 'running',
+                    attempts = CASE WHEN source_hash IS excluded.source_hash THEN attempts + 1 ELSE 1 END,
+                    source_hash = excluded.source_hash,
+                    started_at = excluded.started_at,
+                    updated_at = excluded.updated_at
+            """, entries)
+            self.conn.commit()
+
+    def done(self, aic, content=None):
+        """Marks a row as done, storing the hash of the content written for it. Takes effect on commit()."""
+        self._finish(aic, "done", content_hash(content) if content is not None else None, None)
+
+    def failed(self, aic, error):
+        """Marks a row as failed with the error message. Takes effect on commit()."""
+        self._finish(aic, "failed", None, str(error))
+
+    def _finish(self, aic, status, digest, error):
+        with self.lock:
+            self.conn.execute(
+                "UPDATE jobs SET status = ?, content_hash = COALESCE(?, content_hash), last_error = ?, "
+                "updated_at = ? WHERE job = ? AND aic = ?",
+                (status, digest, error, time.time(), self.job, aic),
+            )
+
+    def commit(self):
+        """
+        Persists the done/failed marks recorded so far. Call it once the results
+        are safely stored (e.g. as SheetWriter's on_flush), so a crash never
+        leaves a row marked done whose write was lost.
+        """
+        with self.lock:
+            self.conn.commit()
+
+    def summary(self):
+        """Returns the number of rows per status for this job."""
+        with self.lock:
+            return dict(self.conn.execute(
+                "SELECT status, COUNT(*) FROM jobs WHERE job = ? GROUP BY status", (self.job,)
+            ).fetchall())
+
+    def close(self):
+        with self.lock:
+            self.conn.commit()
+            self.conn.close()
@@ -0,0 +1,356 @@
+import argparse
+import hashlib
+import re
+import sqlite3
+import time
+import unicodedata
+from collections import Counter, deque
+
+from RcpStore import PREVIEW_MARK, TRUNCATED_MARK, is_partial, load_texts, text_hash
+from RcpStore import ensure_tables as ensure_store_tables
+from Schema import DB_NAME, KEY_COLUMN, SECTION_COLUMNS, TABLE_NAME, quote
+
+
+# Sections scanned for active ingredients: interactions and contraindications
+MENTION_COLUMNS = [SECTION_COLUMNS["4.5"], SECTION_COLUMNS["4.3"]]
+CHUNK_ROWS = 500      # drugs read and scanned per batch
+MIN_NAME_CHARS = 5    # shorter one-word names match too many ordinary words
+TOKEN_RE = re.compile(r"[a-z0-9]+")
+# Combining marks left by NFKD ("può" -> "puo" + grave accent)
+COMBINING_RE = re.compile("[\u0300-\u036f\u1ab0-\u1aff\u1dc0-\u1dff\u20d0-\u20ff\ufe20-\ufe2f]")
+# Separators between the ingredients of a combination ("PARACETAMOLO/CODEINA")
+COMBINATION_RE = re.compile(r"[/+;,]")
+# Salt, ester and hydrate words dropped from the end of a name: the RCP of
+# another medicine says "amlodipina", not "amlodipina besilato"
+SALT_WORDS = {
+    "cloridrato", "idrocloruro", "dicloridrato", "bromidrato", "besilato", "maleato", "mesilato",
+    "tartrato", "fumarato", "succinato", "citrato", "solfato", "fosfato", "acetato", "lattato",
+    "sodico", "sodica", "disodico", "potassico", "potassica", "calcico", "calcica", "magnesiaco",
+    "monoidrato", "diidrato", "triidrato", "emiidrato", "sesquiidrato", "anidro", "anidra",
+    "dipropionato", "propionato", "valerato", "furoato", "butirrato",
+}
+
+# (vocabulary hash, Matcher) of the last refresh: a single-drug edit reuses the automaton
+_matcher = None
+
+
+def tokens(text):
+    """Lower-case words without accents (as RcpParser.normalize_text, one regex pass instead of per character)."""
+    text = text.lower()
+    if not text.isascii():
+        text = COMBINING_RE.sub("", unicodedata.normalize("NFKD", text))
+    return TOKEN_RE.findall(text)
+
+
+def ingredient_names(value):
+    """
+    The names one "Principio Attivo" value is mentioned by, as token tuples:
+    each ingredient of a combination, without trailing salt words.
+    """
+    names = set()
+    for part in COMBINATION_RE.split(value or ""):
+        words = tokens(part)
+        while len(words) > 1 and words[-1] in SALT_WORDS:
+            words.pop()
+        if words and (len(words) > 1 or len(words[0]) >= MIN_NAME_CHARS) and not words[0].isdigit():
+            names.add(tuple(words))
+    return names
+
+
+def ingredient_key(name):
+    """The form an ingredient is stored and looked up under, e.g. "acido acetilsalicilico"."""
+    names = ingredient_names(name)
+    if len(names) == 1:
+        return " ".join(next(iter(names)))
+    return " ".join(tokens(name))
+
+
+class Matcher:
+    """
+    Aho-Corasick automaton over word tokens: finds every occurrence of every
+    pattern in one pass over a document, whatever the number of patterns.
+    Matching whole tokens means a name never matches inside a longer word.
+    """
+
+    def __init__(self, patterns):
+        """patterns: {token tuple: key reported when it occurs}."""
+        self.goto = [{}]
+        self.fail = [0]
+        self.out = [()]
+        for words, key in patterns.items():
+            node = 0
+            for word in words:
+                following = self.goto[node].get(word)
+                if following is None:
+                    following = len(self.goto)
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.out.append(())
+                    self.goto[node][word] = following
+                node = following
+            self.out[node] += (key,)
+        # Failure links, breadth first: the longest proper suffix that is also a prefix
+        queue = deque(self.goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for word, following in self.goto[node].items():
+                queue.append(following)
+                fallback = self.fail[node]
+                while fallback and word not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                self.fail[following] = self.goto[fallback].get(word, 0)
+                self.out[following] += self.out[self.fail[following]]
+
+    def count(self, words):
+        """{key: occurrences} over a token sequence."""
+        goto, fail, out = self.goto, self.fail, self.out
+        counts = Counter()
+        node = 0
+        for word in words:
+            while node and word not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(word, 0)
+            if out[node]:
+                counts.update(out[node])
+        return counts
+
+
+def ensure_tables(conn):
+    """
+    ingredient_mentions is the inverted index: for every ingredient, the drugs
+    whose 4.5/4.3 text mentions it, with the number of mentions; `own` marks
+    a drug's own active ingredient. mention_sources holds the hash of every
+    text scanned and the drug's own ingredients it was scanned with, so only
+    new or changed texts are scanned again.
+    """
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS ingredient_mentions (
+            ingredient TEXT NOT NULL,
+            aic TEXT NOT NULL,
+            section TEXT NOT NULL,
+            hits INTEGER NOT NULL,
+            own INTEGER NOT NULL,
+            PRIMARY KEY (ingredient, aic, section)
+        ) WITHOUT ROWID
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_ingredient_mentions_aic ON ingredient_mentions (aic)")
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS mention_sources (
+            aic TEXT NOT NULL,
+            section TEXT NOT NULL,
+            hash TEXT NOT NULL,
+            own TEXT,
+            PRIMARY KEY (aic, section)
+        ) WITHOUT ROWID
+    """)
+    # `own` was added after the first version of the table, which kept it in `hash`;
+    # those rows match no text hash, so their texts are scanned again once
+    columns = {row[1] for row in conn.execute("PRAGMA table_info(mention_sources)")}
+    if "own" not in columns:
+        conn.execute("ALTER TABLE mention_sources ADD COLUMN own TEXT")
+    conn.execute("CREATE TABLE IF NOT EXISTS mention_meta (name TEXT PRIMARY KEY, value TEXT)")
+
+
+def vocabulary(conn, table=TABLE_NAME):
+    """{token tuple: ingredient key} for every distinct "Principio Attivo" of the table."""
+    patterns = {}
+    for (value,) in conn.execute(f'SELECT DISTINCT "Principio Attivo" FROM {quote(table)}'):
+        for words in ingredient_names(value):
+            patterns[words] = " ".join(words)
+    return patterns
+
+
+def vocabulary_matcher(conn, table=TABLE_NAME):
+    """
+    The Matcher over the table's vocabulary, built again only when the
+    vocabulary changed since the last call.
+
+    Returns:
+        tuple: (vocabulary hash, Matcher).
+    """
+    global _matcher
+    patterns = vocabulary(conn, table)
+    names_hash = hashlib.sha256("\n".join(sorted(patterns.values())).encode("utf-8")).hexdigest()
+    cached = _matcher
+    if cached is None or cached[0] != names_hash:
+        cached = _matcher = (names_hash, Matcher(patterns))
+    return cached
+
+
+def _clean(text):
+    if is_partial(text):
+        text = text.removesuffix(PREVIEW_MARK).removesuffix(TRUNCATED_MARK)
+    return text
+
+
+def _row_chunks(conn, table, select, chunk_rows, aics):
+    if aics is None:
+        after = 0
+        while True:
+            rows = conn.execute(
+                f"SELECT rowid, {select} FROM {quote(table)} WHERE rowid > ? ORDER BY rowid LIMIT ?",
+                (after, chunk_rows)
+            ).fetchall()
+            if not rows:
+                return
+            after = rows[-1][0]
+            yield rows
+    else:
+        aics = [str(aic) for aic in aics if aic]
+        for start in range(0, len(aics), chunk_rows):
+            chunk = aics[start:start + chunk_rows]
+            rows = conn.execute(
+                f"SELECT rowid, {select} FROM {quote(table)} WHERE {quote(KEY_COLUMN)} IN ({', '.join('?' * len(chunk))})",
+                chunk
+            ).fetchall()
+            if rows:
+                yield rows
+
+
+def update_mentions(conn, table=TABLE_NAME, chunk_rows=CHUNK_ROWS, aics=None):
+    """
+    Brings the mention index up to date with `table`, in one transaction
+    (see refresh_mentions).
+
+    Returns:
+        int: Texts (drug, section) scanned.
+    """
+    with conn:
+        return refresh_mentions(conn, table, chunk_rows, aics)
+
+
+def refresh_mentions(conn, table=TABLE_NAME, chunk_rows=CHUNK_ROWS, aics=None):
+    """
+    Brings the mention index up to date with `table`, on the caller's
+    transaction: call it after writing drugs, in the same transaction.
+
+    Only texts whose hash differs from the one last scanned are matched, each
+    distinct text once (packages share their RCP). A change in the set of
+    active ingredients rescans everything, since a new name may occur in any
+    text; when only some drugs are refreshed, the change is recorded in
+    mention_meta instead and the next full refresh does the rescan.
+
+    Args:
+        aics (iterable): Only look at these drugs (e.g. the ones just
+            written, or deleted); None for every drug, which also drops the
+            drugs no longer in the table.
+
+    Returns:
+        int: Texts (drug, section) scanned.
+    """
+    ensure_tables(conn)
+    ensure_store_tables(conn)
+    names_hash, matcher = vocabulary_matcher(conn, table)
+    scanned = 0
+    cache = {}
+    select = ", ".join(quote(col) for col in [KEY_COLUMN, "Principio Attivo"] + MENTION_COLUMNS)
+    meta = dict(conn.execute("SELECT name, value FROM mention_meta WHERE name IN ('vocabulary', 'rescan')"))
+    if meta.get("vocabulary") != names_hash or meta.get("rescan"):
+        if aics is None:
+            conn.execute("DELETE FROM ingredient_mentions")
+            conn.execute("DELETE FROM mention_sources")
+            conn.execute("INSERT OR REPLACE INTO mention_meta (name, value) VALUES ('vocabulary', ?)", (names_hash,))
+            conn.execute("DELETE FROM mention_meta WHERE name = 'rescan'")
+        elif not meta.get("rescan"):
+            conn.execute("INSERT INTO mention_meta (name, value) VALUES ('rescan', 'needed')")
+    if aics is None:
+        conn.execute(f"DELETE FROM ingredient_mentions WHERE aic NOT IN (SELECT {quote(KEY_COLUMN)} FROM {quote(table)})")
+        conn.execute(f"DELETE FROM mention_sources WHERE aic NOT IN (SELECT {quote(KEY_COLUMN)} FROM {quote(table)})")
+    else:
+        aics = [str(aic) for aic in aics if aic]
+        gone = [(aic,) for aic in aics if conn.execute(
+            f"SELECT 1 FROM {quote(table)} WHERE {quote(KEY_COLUMN)} = ?", (aic,)
+        ).fetchone() is None]
+        conn.executemany("DELETE FROM ingredient_mentions WHERE aic = ?", gone)
+        conn.executemany("DELETE FROM mention_sources WHERE aic = ?", gone)
+    for rows in _row_chunks(conn, table, select, chunk_rows, aics):
+        chunk = [row[1] for row in rows if row[1]]
+        marks = ", ".join("?" * len(chunk))
+        seen = {(aic, section): (source_hash, own) for aic, section, source_hash, own in conn.execute(
+            f"SELECT aic, section, hash, own FROM mention_sources WHERE aic IN ({marks})", chunk
+        )}
+        # Texts in the RCP store are identified by the hash they are stored under
+        # (RcpStore.text_hash), so unchanged ones are skipped without being read
+        stored = {(aic, section): source_hash for aic, section, source_hash in conn.execute(
+            f"SELECT aic, section, hash FROM drug_sections WHERE aic IN ({marks}) "
+            f"AND section IN ({', '.join('?' * len(MENTION_COLUMNS))})", chunk + MENTION_COLUMNS
+        )}
+        todo, inline = [], {}
+        for _, aic, ingredient, *values in rows:
+            if not aic:
+                continue
+            own = {" ".join(words) for words in ingredient_names(ingredient)}
+            own_names = ",".join(sorted(own))
+            for section, value in zip(MENTION_COLUMNS, values):
+                source_hash = stored.get((aic, section))
+                if source_hash is None:
+                    source_hash = text_hash(value or "")
+                    inline[source_hash] = value or ""
+                # The drug's own ingredients are part of what was scanned: they set `own`
+                if seen.get((aic, section)) != (source_hash, own_names):
+                    todo.append((aic, own, own_names, section, source_hash))
+        texts = load_texts(conn, {h for _, _, _, _, h in todo if h not in cache and h not in inline})
+        texts.update(inline)
+        mentions, sources, stale = [], [], []
+        for aic, own, own_names, section, source_hash in todo:
+            if source_hash not in cache:
+                cache[source_hash] = matcher.count(tokens(_clean(texts.get(source_hash, ""))))
+            stale.append((aic, section))
+            sources.append((aic, section, source_hash, own_names))
+            mentions += [(key, aic, section, hits, key in own) for key, hits in cache[source_hash].items()]
+            scanned += 1
+        conn.executemany("DELETE FROM ingredient_mentions WHERE aic = ? AND section = ?", stale)
+        mentions.sort()  # primary key order: appends to the index pages instead of scattered inserts
+        conn.executemany(
+            "INSERT INTO ingredient_mentions (ingredient, aic, section, hits, own) VALUES (?, ?, ?, ?, ?)",
+            mentions
+        )
+        conn.executemany(
+            "INSERT OR REPLACE INTO mention_sources (aic, section, hash, own) VALUES (?, ?, ?, ?)", sources
+        )
+    return scanned
+
+
+def mentioning(conn, name, include_own=False, limit=None):
+    """
+    The drugs whose 4.5 or 4.3 text mentions an active ingredient: an
+    index range scan on the ingredient. A drug's own ingredient is left out
+    unless `include_own`.
+
+    Returns:
+        list: (AIC code, section, mentions), most mentions first.
+    """
+    sql = "SELECT aic, section, hits FROM ingredient_mentions WHERE ingredient = ?"
+    if not include_own:
+        sql += " AND own = 0"
+    sql += " ORDER BY hits DESC, aic"
+    params = [ingredient_key(name)]
+    if limit is not None:
+        sql += " LIMIT ?"
+        params.append(limit)
+    return conn.execute(sql, params).fetchall()
+
+
+def mentions_of(conn, aic):
+    """The active ingredients mentioned in one drug's 4.5/4.3 text, as (ingredient, section, mentions, own)."""
+    return conn.execute(
+        "SELECT ingredient, section, hits, own FROM ingredient_mentions WHERE aic = ? ORDER BY section, hits DESC",
+        (aic,)
+    ).fetchall()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Index the active ingredients mentioned in RCP sections 4.5 and 4.3.")
+    parser.add_argument("db", nargs="?", default=DB_NAME)
+    parser.add_argument("--table", default=TABLE_NAME)
+    parser.add_argument("--find", metavar="INGREDIENT", help="list the drugs mentioning an ingredient")
+    args = parser.parse_args()
+
+    conn = sqlite3.connect(args.db)
+    started = time.perf_counter()
+    scanned = update_mentions(conn, args.table)
+    print(f"Scanned {scanned} texts in {time.perf_counter() - started:.1f}s")
+    if args.find:
+        for aic, section, hits in mentioning(conn, args.find):
+            print(f"{aic}  {hits:>3}  {section}")
+    conn.close()
@@ -0,0 +1,244 @@
+import json
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+
+METRICS_LOG = "metrics.jsonl"                 # structured event log, one JSON object per line
+PROM_FILE = os.environ.get("AIFA_PROM_FILE")  # Prometheus text file, written only when set
+PROGRESS_EVERY = 5.0                          # seconds between progress lines
+# Upper bounds (seconds) of the Prometheus latency histogram buckets
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+class StageStats:
+    """Count, total, extremes and histogram buckets of one stage's durations."""
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = 0.0
+        self.buckets = [0] * len(BUCKETS)
+
+    def add(self, seconds):
+        self.count += 1
+        self.total += seconds
+        self.min = seconds if self.min is None else min(self.min, seconds)
+        self.max = max(self.max, seconds)
+        for i, bound in enumerate(BUCKETS):
+            if seconds <= bound:
+                self.buckets[i] += 1
+
+    def as_dict(self):
+        return {
+            "count": self.count,
+            "total_s": round(self.total, 3),
+            "mean_ms": round(self.total / self.count * 1000, 2) if self.count else None,
+            "min_ms": round(self.min * 1000, 2) if self.min is not None else None,
+            "max_ms": round(self.max * 1000, 2),
+        }
+
+
+class Metrics:
+    """
+    Stage timers, counters and progress for one scraper run.
+
+    Durations and counters are kept in memory. Every timed stage, counter
+    change passed with `log=True` and progress tick is also appended to a JSONL
+    event log. A progress line with throughput and ETA is printed every
+    `progress_every` seconds. With `prom_path` the same numbers are written in
+    Prometheus text format (for node_exporter's textfile collector) on every
+    progress line and at close. Safe to use from several threads.
+    """
+
+    def __init__(self, job="run", total=None, log_path=METRICS_LOG, prom_path=PROM_FILE,
+                 progress_every=PROGRESS_EVERY, out=sys.stdout):
+        self.job = job
+        self.total = total
+        self.prom_path = prom_path
+        self.progress_every = progress_every
+        self.out = out
+        self.lock = threading.Lock()
+        self.stages = {}
+        self.counters = {}
+        self.done = 0
+        self.started = time.monotonic()
+        self.last_progress = self.started
+        self.log = open(log_path, "a", encoding="utf-8") if log_path else None
+
+    def event(self, kind, **fields):
+        """Appends one event to the JSONL log."""
+        if self.log is None:
+            return
+        line = json.dumps(dict({"ts": round(time.time(), 3), "job": self.job, "event": kind}, **fields),
+                          ensure_ascii=False, default=str)
+        with self.lock:
+            self.log.write(line + "\n")
+
+    def observe(self, stage, seconds, **fields):
+        with self.lock:
+            self.stages.setdefault(stage, StageStats()).add(seconds)
+        self.event("stage", stage=stage, seconds=round(seconds, 4), **fields)
+
+    @contextmanager
+    def timer(self, stage, **fields):
+        """Times the block as one run of `stage`, failed or not."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - started, **fields)
+
+    def incr(self, name, n=1, log=False, **fields):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+        if log:
+            self.event("count", name=name, n=n, **fields)
+
+    def add_counters(self, values, prefix=""):
+        """Adds a dict of numbers (e.g. HttpCache.stats()) to the counters."""
+        for name, value in values.items():
+            if isinstance(value, (int, float)):
+                self.incr(prefix + name, value)
+
+    def progress(self, n=1):
+        """Counts `n` finished items; prints and exports at most every progress_every seconds."""
+        with self.lock:
+            self.done += n
+            now = time.monotonic()
+            if now - self.last_progress < self.progress_every:
+                return
+            self.last_progress = now
+        self.report()
+
+    def rate(self):
+        elapsed = time.monotonic() - self.started
+        return self.done / elapsed if elapsed > 0 else 0.0
+
+    def eta(self):
+        """Seconds left at the current rate, or None if unknown."""
+        rate = self.rate()
+        if self.total is None or rate == 0:
+            return None
+        return max(0.0, (self.total - self.done) / rate)
+
+    def progress_line(self):
+        rate, eta = self.rate(), self.eta()
+        done = f"{self.done}/{self.total} ({self.done / self.total:.0%})" if self.total else f"{self.done}"
+        line = f"[{self.job}] {done} | {rate:.1f}/s"
+        if eta is not None:
+            line += f" | ETA {format_duration(eta)}"
+        busiest = sorted(self.stages.items(), key=lambda item: item[1].total, reverse=True)[:3]
+        if busiest:
+            line += " | " + ", ".join(f"{name} {stats.total / max(1, stats.count) * 1000:.0f}ms"
+                                      for name, stats in busiest)
+        return line
+
+    def report(self):
+        """Prints the progress line, logs it and refreshes the Prometheus file."""
+        with self.lock:
+            line = self.progress_line()
+        print(line, file=self.out, flush=True)
+        self.event("progress", done=self.done, total=self.total, rate=round(self.rate(), 2), eta=self.eta())
+        if self.prom_path:
+            self.write_prometheus(self.prom_path)
+
+    def summary(self):
+        with self.lock:
+            return {
+                "job": self.job,
+                "done": self.done,
+                "total": self.total,
+                "elapsed_s": round(time.monotonic() - self.started, 2),
+                "rate_per_s": round(self.rate(), 2),
+                "counters": dict(self.counters),
+                "stages": {name: stats.as_dict() for name, stats in self.stages.items()},
+            }
+
+    def prometheus_text(self):
+        """The metrics in Prometheus text exposition format."""
+        job = _label(self.job)
+        lines = [
+            "# HELP aifa_stage_seconds Time spent per stage.",
+            "# TYPE aifa_stage_seconds histogram",
+        ]
+        with self.lock:
+            for name, stats in sorted(self.stages.items()):
+                labels = f'job="{job}",stage="{_label(name)}"'
+                for bound, count in zip(BUCKETS, stats.buckets):
+                    lines.append(f'aifa_stage_seconds_bucket{{{labels},le="{bound}"}} {count}')
+                lines.append(f'aifa_stage_seconds_bucket{{{labels},le="+Inf"}} {stats.count}')
+                lines.append(f"aifa_stage_seconds_sum{{{labels}}} {stats.total:.6f}")
+                lines.append(f"aifa_stage_seconds_count{{{labels}}} {stats.count}")
+            lines += ["# HELP aifa_events_total Events counted during the run.", "# TYPE aifa_events_total counter"]
+            for name, value in sorted(self.counters.items()):
+                lines.append(f'aifa_events_total{{job="{job}",name="{_label(name)}"}} {value}')
+            lines += [
+                "# HELP aifa_items_done Items finished so far.", "# TYPE aifa_items_done gauge",
+                f'aifa_items_done{{job="{job}"}} {self.done}',
+            ]
+            if self.total is not None:
+                lines += [
+                    "# HELP aifa_items_total Items to process in this run.", "# TYPE aifa_items_total gauge",
+                    f'aifa_items_total{{job="{job}"}} {self.total}',
+                ]
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self, path):
+        # Written to a temporary file and renamed, so a scrape never sees half a file
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(self.prometheus_text())
+        os.replace(tmp_path, path)
+
+    def close(self):
+        """Prints the final progress line and writes the summary event and Prometheus file."""
+        self.report()
+        self.event("summary", **self.summary())
+        if self.log is not None:
+            self.log.close()
+            self.log = None
+
+
+def _label(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def format_duration(seconds):
+    seconds = int(seconds)
+    if seconds >= 3600:
+        return f"{seconds // 3600}h{seconds % 3600 // 60:02d}m"
+    if seconds >= 60:
+        return f"{seconds // 60}m{seconds % 60:02d}s"
+    return f"{seconds}s"
+
+
+# Process-wide instance used by AifaClient, RcpPipeline and SheetSync; it keeps
+# numbers in memory only until a scraper calls start_metrics
+_metrics = Metrics(log_path=None, prom_path=None, progress_every=float("inf"))
+
+
+def start_metrics(job, total=None, **kwargs):
+    """Replaces the process-wide Metrics with a new one for `job` and returns it."""
+    global _metrics
+    _metrics = Metrics(job, total=total, **kwargs)
+    return _metrics
+
+
+def get_metrics():
+    return _metrics
+
+
+def timer(stage, **fields):
+    return _metrics.timer(stage, **fields)
+
+
+def incr(name, n=1, log=False, **fields):
+    _metrics.incr(name, n, log=log, **fields)
+
+
+def progress(n=1):
+    _metrics.progress(n)
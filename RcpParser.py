@@ -0,0 +1,140 @@
+import re
+import unicodedata
+from contextlib import closing
+
+
+# Target sections
+section_headers = {
+    "4.1": "Indicazioni terapeutiche",
+    "4.2": "Posologia e modo di somministrazione",
+    "4.3": "Controindicazioni",
+    "4.4": "Avvertenze speciali e precauzioni d’impiego",
+    "4.5": "Interazioni con altri medicinali",
+    "4.6": "Fertilità, gravidanza e allattamento",
+    "4.7": "Effetti sulla capacità di guidare veicoli",
+    "4.8": "Effetti indesiderati",
+    "4.9": "Sovradosaggio",
+    "6.2": "Incompatibilità"
+}
+
+# Section header: number such as "4.1", optional dot/dash/space separators, then the title (if any)
+HEADER_RE = re.compile(r"(\d\.\d)[\.\-\s]*(.*)", re.DOTALL)
+NOISE_RE = re.compile(r"^(Pagina\s+\d+|AIFA|Ministero della Salute)", re.IGNORECASE)
+WHITESPACE_RE = re.compile(r"\s+")
+
+def normalize_text(text):
+    """Normalize text for comparison (lowercase, remove accents)."""
+    text = text.lower()
+    if text.isascii():
+        # Nothing to decompose
+        return text
+    text = unicodedata.normalize('NFKD', text)
+    text = ''.join([c for c in text if not unicodedata.combining(c)])
+    return text
+
+# First characters of each normalized title, used to confirm a header line
+TITLE_KEYS = {k: normalize_text(v)[:10] for k, v in section_headers.items()}
+
+# Last target section; once it has been read the rest of the document is not needed
+LAST_SECTION = list(section_headers)[-1]
+
+# Step 1: Extract clean lines from PDF
+def iter_lines_from_pdf(pdf_bytes, use_toc=True):
+    """
+    Yields clean lines page by page, so the caller can stop reading (and
+    rendering pages) as soon as it has what it needs.
+
+    With use_toc, pages before the first target section listed in the PDF
+    outline are skipped; documents without an outline are read from page one.
+    """
+    import fitz  # PyMuPDF; imported on first use so importing the parser stays cheap
+
+    with fitz.open(stream=pdf_bytes, filetype="pdf") as doc:
+        start = _first_target_page(doc) if use_toc else 0
+        for page_number in range(start, doc.page_count):
+            text = doc[page_number].get_text()
+            for line in text.splitlines():
+                line = line.strip()
+                if not line:
+                    continue
+                if NOISE_RE.match(line):
+                    continue
+                yield line
+
+def _first_target_page(doc):
+    """0-based page of the first target section in the outline, or 0 if unknown."""
+    pages = []
+    for _level, title, page in doc.get_toc():
+        match = HEADER_RE.match(title.strip())
+        if match and match.group(1) in section_headers and page > 0:
+            pages.append(page - 1)
+    return min(pages) if pages else 0
+
+def extract_lines_from_pdf(pdf_bytes):
+    return list(iter_lines_from_pdf(pdf_bytes, use_toc=False))
+
+# Step 2: Extract sections based on section number + title format
+def extract_sections_from_lines(lines, stop_after=None):
+    """
+    Splits RCP lines into the sections listed in section_headers.
+
+    `lines` may be a list or any iterator (such as iter_lines_from_pdf). When
+    `stop_after` is a section number, reading stops as soon as that section has
+    captured some text and another section header closes it; later lines are
+    never pulled from the iterator.
+    """
+    parts = {sec: [] for sec in section_headers}
+    current_section = None
+    current_parts = None  # list of the section being captured, None when not capturing
+
+    match_header = HEADER_RE.match
+    lines = iter(lines)
+    line = next(lines, None)
+    while line is not None:
+        following = None  # next line, when it was read ahead to look for a title
+        match = match_header(line)
+        if match is None:
+            # Plain content line
+            if current_parts is not None:
+                current_parts.append(line)
+        else:
+            # Header-like line: never part of the section text
+            sec_num = match.group(1)
+            if current_parts and current_section == stop_after and sec_num != current_section:
+                break
+            opened = False
+            title_key = TITLE_KEYS.get(sec_num)
+            if title_key is not None:
+                possible_title = match.group(2).strip()
+                # Title on the same line, or on the next line when the number stands alone
+                if possible_title:
+                    opened = title_key in normalize_text(possible_title)
+                else:
+                    following = next(lines, None)
+                    if following is not None and title_key in normalize_text(following.strip()):
+                        opened = True
+                        following = None  # the title line is consumed
+            if opened:
+                current_section, current_parts = sec_num, parts[sec_num]
+            elif current_section and sec_num != current_section:
+                # Any other section number ends the current section
+                current_parts = None
+        line = following if following is not None else next(lines, None)
+
+    # Final cleanup
+    return {
+        sec: WHITESPACE_RE.sub(" ", " ".join(chunks).strip()) or "Not found"
+        for sec, chunks in parts.items()
+    }
+
+# Step 3: Extract from PDF bytes
+def extract_sections_from_pdf(pdf_bytes, stop_early=True):
+    """
+    Extracts the target sections from an RCP PDF. By default pages are parsed
+    lazily and parsing stops once section 6.2 is complete; pass
+    stop_early=False to read every page.
+    """
+    if not stop_early:
+        return extract_sections_from_lines(extract_lines_from_pdf(pdf_bytes))
+    with closing(iter_lines_from_pdf(pdf_bytes)) as lines:
+        return extract_sections_from_lines(lines, stop_after=LAST_SECTION)
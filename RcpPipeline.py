@@ -0,0 +1,142 @@
+import asyncio
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from AifaClient import fetch_bytes, rcp_key
+from Metrics import incr, progress, timer
+from RcpParser import extract_sections_from_pdf
+
+
+DOWNLOAD_WORKERS = 8
+PARSE_WORKERS = os.cpu_count() or 1
+QUEUE_SIZE = 32  # max items waiting between two stages
+
+_DONE = object()
+
+
+async def _run_stage(handle, in_queue, out_queue, n_workers, n_downstream):
+    """
+    Runs `n_workers` coroutines that take items from in_queue, pass them through
+    `handle` and put the result on out_queue. Each worker stops on a _DONE marker;
+    once all have stopped, one marker per downstream worker is forwarded.
+    """
+    async def worker():
+        while True:
+            item = await in_queue.get()
+            if item is _DONE:
+                return
+            await out_queue.put(await handle(item))
+
+    await asyncio.gather(*(worker() for _ in range(n_workers)))
+    for _ in range(n_downstream):
+        await out_queue.put(_DONE)
+
+
+def group_records(records, url_key="URL_PDF"):
+    """
+    Groups records by the RCP they point to (see AifaClient.rcp_key), keeping
+    first-seen order. Each group is downloaded and parsed once.
+    """
+    groups = {}
+    for record in records:
+        groups.setdefault(rcp_key(record.get(url_key)), []).append(record)
+    return list(groups.values())
+
+
+async def _run(groups, on_result, url_key, download_workers, parse_workers, queue_size):
+    loop = asyncio.get_running_loop()
+    download_queue = asyncio.Queue(queue_size)
+    parse_queue = asyncio.Queue(queue_size)
+    write_queue = asyncio.Queue(queue_size)
+
+    with ThreadPoolExecutor(download_workers) as io_pool, \
+            ProcessPoolExecutor(parse_workers) as cpu_pool, \
+            ThreadPoolExecutor(1) as write_pool:
+
+        def timed_download(url):
+            with timer("pdf_download"):
+                return fetch_bytes(url)
+
+        async def download(group):
+            try:
+                pdf_bytes = await loop.run_in_executor(io_pool, timed_download, group[0][url_key])
+                return group, pdf_bytes, None
+            except Exception as e:
+                return group, None, e
+
+        async def parse(item):
+            group, pdf_bytes, error = item
+            if error is not None:
+                return item
+            try:
+                # Timed from the event loop: includes the wait for a free parser process
+                with timer("pdf_parse"):
+                    sections = await loop.run_in_executor(cpu_pool, extract_sections_from_pdf, pdf_bytes)
+                return group, sections, None
+            except Exception as e:
+                return group, None, e
+
+        async def produce():
+            for group in groups:
+                await download_queue.put(group)
+            for _ in range(download_workers):
+                await download_queue.put(_DONE)
+
+        def fan_out(group, sections, error):
+            incr("rcp_documents")
+            if error is not None:
+                incr("rcp_failed", len(group), log=True, url=group[0].get(url_key), error=repr(error))
+            with timer("write", records=len(group)):
+                for record in group:
+                    on_result(record, sections, error)
+            progress(len(group))
+
+        async def write():
+            # Single writer: results are handed to on_result one at a time, off the event loop
+            count = 0
+            while True:
+                item = await write_queue.get()
+                if item is _DONE:
+                    return count
+                await loop.run_in_executor(write_pool, fan_out, *item)
+                count += len(item[0])
+
+        results = await asyncio.gather(
+            produce(),
+            _run_stage(download, download_queue, parse_queue, download_workers, parse_workers),
+            _run_stage(parse, parse_queue, write_queue, parse_workers, 1),
+            write(),
+        )
+    return results[-1]
+
+
+def run_pipeline(records, on_result, url_key="URL_PDF", download_workers=DOWNLOAD_WORKERS,
+                 parse_workers=PARSE_WORKERS, queue_size=QUEUE_SIZE, coalesce=True):
+    """
+    Downloads and parses RCP PDFs in three stages connected by bounded queues:
+    threaded downloads (through AifaClient's rate limit and cache), PDF parsing
+    and section extraction in a process pool, and a single writer.
+
+    With `coalesce`, records sharing an RCP (same codiceSis and aic6, i.e. the
+    packages of one medicine) are downloaded and parsed once, and the result
+    is handed to on_result for each of them.
+
+    Args:
+        records (iterable): Dicts holding the PDF URL under `url_key`.
+        on_result (callable): on_result(record, sections, error), called from
+            one writer thread for every record; `sections` is the
+            extract_sections_from_pdf dict, or None when `error` is set.
+        url_key (str): Key of the PDF URL in each record.
+        download_workers (int): Concurrent downloads.
+        parse_workers (int): Parser processes; defaults to the number of cores.
+        queue_size (int): Capacity of each queue between stages (backpressure).
+        coalesce (bool): Fetch and parse each distinct RCP once.
+
+    Returns:
+        int: Number of records handed to on_result.
+    """
+    if coalesce:
+        groups = group_records(records, url_key)
+    else:
+        groups = ([record] for record in records)
+    return asyncio.run(_run(groups, on_result, url_key, download_workers, parse_workers, queue_size))
@@ -0,0 +1,280 @@
+import hashlib
+import sqlite3
+import sys
+import zlib
+
+from Schema import KEY_COLUMN, SECTION_COLUMNS, TABLE_NAME, quote
+from SearchIndex import SEARCH_COLUMNS, fts_table, set_texts
+
+
+# Section texts longer than this are kept inline only as a preview
+PREVIEW_CHARS = 500
+PREVIEW_MARK = " [...]"
+# Suffix SheetSync.fit_cell adds to texts cut to fit a sheet cell
+TRUNCATED_MARK = " [TRUNCATED]"
+ZLIB_LEVEL = 6
+INDEX_CHUNK = 500  # drugs whose texts are decompressed at a time by index_sections
+
+
+def ensure_tables(conn):
+    """
+    rcp_sections holds every distinct section text once, zlib-compressed and
+    keyed by the sha256 of the text; drug_sections maps (AIC, section column)
+    to it, so packages sharing an RCP share the stored text.
+    """
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS rcp_sections (
+            hash TEXT PRIMARY KEY,
+            codec TEXT NOT NULL,
+            size INTEGER NOT NULL,
+            body BLOB NOT NULL
+        )
+    """)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS drug_sections (
+            aic TEXT NOT NULL,
+            section TEXT NOT NULL,
+            hash TEXT NOT NULL REFERENCES rcp_sections (hash),
+            PRIMARY KEY (aic, section)
+        )
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_drug_sections_hash ON drug_sections (hash)")
+
+
+def text_hash(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def preview(text):
+    """The inline form of a section text: itself if short, else its start plus PREVIEW_MARK."""
+    if text is None or len(text) <= PREVIEW_CHARS:
+        return text
+    return text[:PREVIEW_CHARS] + PREVIEW_MARK
+
+
+def is_partial(text):
+    """True for an inline preview or a text truncated for the sheet."""
+    return text.endswith(TRUNCATED_MARK) or (
+        len(text) == PREVIEW_CHARS + len(PREVIEW_MARK) and text.endswith(PREVIEW_MARK)
+    )
+
+
+def store_sections(conn, aic, texts, keep_full=True):
+    """
+    Stores full section texts for one drug.
+
+    Args:
+        conn (sqlite3.Connection): Open connection; the caller commits.
+        aic (str): AIC code.
+        texts (dict): Section column name -> full text. An empty value
+            removes the stored text of that section.
+        keep_full (bool): Do not replace a stored text with a preview or a
+            copy truncated for the sheet (see is_partial).
+    """
+    for section, text in texts.items():
+        if not text:
+            _unlink(conn, aic, section)
+            continue
+        old = conn.execute("SELECT hash FROM drug_sections WHERE aic = ? AND section = ?", (aic, section)).fetchone()
+        if keep_full and old is not None and is_partial(text):
+            continue
+        digest = text_hash(text)
+        if old is not None and old[0] == digest:
+            continue
+        data = text.encode("utf-8")
+        conn.execute(
+            "INSERT OR IGNORE INTO rcp_sections (hash, codec, size, body) VALUES (?, 'zlib', ?, ?)",
+            (digest, len(data), zlib.compress(data, ZLIB_LEVEL)),
+        )
+        conn.execute(
+            "INSERT OR REPLACE INTO drug_sections (aic, section, hash) VALUES (?, ?, ?)",
+            (aic, section, digest),
+        )
+        if old is not None:
+            # The replaced text, unless another drug still uses it
+            _drop_unlinked(conn, [old[0]])
+
+
+def _decode(codec, body):
+    if codec == "zlib":
+        return zlib.decompress(body).decode("utf-8")
+    raise ValueError(f"Unknown codec {codec!r}")
+
+
+def load_sections(conn, aic, sections=None):
+    """
+    Returns {section column: full text} for one drug, for the sections stored
+    (optionally only those listed in `sections`).
+    """
+    rows = conn.execute("""
+        SELECT d.section, s.codec, s.body
+        FROM drug_sections d JOIN rcp_sections s ON s.hash = d.hash
+        WHERE d.aic = ?
+    """, (aic,)).fetchall()
+    return {
+        section: _decode(codec, body)
+        for section, codec, body in rows
+        if sections is None or section in sections
+    }
+
+
+def section_texts(conn, sections, aics=None):
+    """
+    Returns {aic: {section column: full text}} for every stored drug (or only
+    those in `aics`), limited to the listed sections. Each distinct text is
+    decompressed once and shared between the packages that use it.
+    """
+    if not sections or aics == []:
+        return {}
+    sql = f"""
+        SELECT d.aic, d.section, d.hash, s.codec, s.body
+        FROM drug_sections d JOIN rcp_sections s ON s.hash = d.hash
+        WHERE d.section IN ({", ".join("?" * len(sections))})
+    """
+    params = list(sections)
+    if aics is not None:
+        sql += f" AND d.aic IN ({', '.join('?' * len(aics))})"
+        params += list(aics)
+    bodies = {}
+    texts = {}
+    for aic, section, digest, codec, body in conn.execute(sql, params):
+        if digest not in bodies:
+            bodies[digest] = _decode(codec, body)
+        texts.setdefault(aic, {})[section] = bodies[digest]
+    return texts
+
+
+def load_texts(conn, hashes):
+    """Returns {hash: text} for the listed text hashes that are stored."""
+    hashes = list(hashes)
+    if not hashes:
+        return {}
+    return {
+        digest: _decode(codec, body)
+        for digest, codec, body in conn.execute(
+            f"SELECT hash, codec, body FROM rcp_sections WHERE hash IN ({', '.join('?' * len(hashes))})", hashes
+        )
+    }
+
+
+def write_row_sections(conn, row):
+    """
+    Moves the section texts of a row dict into the store and returns a copy of
+    the row with previews in their place, ready to be written inline.
+    """
+    aic = row.get(KEY_COLUMN)
+    if not aic:
+        return row
+    section_columns = set(SECTION_COLUMNS.values())
+    store_sections(conn, aic, {col: row[col] for col in row if col in section_columns})
+    return {col: preview(value) if col in section_columns else value for col, value in row.items()}
+
+
+def index_sections(conn, aics=None, table=TABLE_NAME):
+    """
+    Puts the stored full texts of the searched sections in the full-text
+    index of `table` (see SearchIndex), in place of the inline previews its
+    triggers indexed. Call it after writing rows whose sections went through
+    write_row_sections.
+
+    Args:
+        aics (iterable): AIC codes to index; None for every stored drug.
+    """
+    columns = [col for col in SEARCH_COLUMNS if col in SECTION_COLUMNS.values()]
+    if not conn.execute("SELECT 1 FROM sqlite_master WHERE name = ?", (fts_table(table),)).fetchone():
+        return
+    if aics is None:
+        aics = [row[0] for row in conn.execute("SELECT DISTINCT aic FROM drug_sections")]
+    aics = [str(aic) for aic in aics if aic]
+    for start in range(0, len(aics), INDEX_CHUNK):
+        set_texts(conn, table, section_texts(conn, columns, aics[start:start + INDEX_CHUNK]))
+
+
+def expand_row(conn, row):
+    """Returns a copy of a row dict with inline previews replaced by the stored full texts."""
+    aic = row.get(KEY_COLUMN)
+    if not aic:
+        return row
+    full = load_sections(conn, str(aic))
+    return {col: full.get(col, value) for col, value in row.items()}
+
+
+def compact(conn, table=TABLE_NAME):
+    """
+    Moves the inline section texts of every row of `table` into the store and
+    leaves previews inline; the search index keeps the full texts. Texts
+    already stored in full are kept.
+
+    Returns:
+        int: Rows compacted.
+    """
+    ensure_tables(conn)
+    existing = {row[1] for row in conn.execute(f"PRAGMA table_info({quote(table)})")}
+    columns = [col for col in SECTION_COLUMNS.values() if col in existing]
+    if not columns:
+        return 0
+    select = ", ".join(quote(col) for col in [KEY_COLUMN] + columns)
+    set_clause = ", ".join(f"{quote(col)} = ?" for col in columns)
+    compacted = []
+    with conn:
+        for row in conn.execute(f"SELECT {select} FROM {quote(table)}").fetchall():
+            aic, texts = row[0], dict(zip(columns, row[1:]))
+            if not aic or all(text is None or len(text) <= PREVIEW_CHARS or is_partial(text)
+                              for text in texts.values()):
+                continue
+            store_sections(conn, str(aic), texts)
+            conn.execute(
+                f"UPDATE {quote(table)} SET {set_clause} WHERE {quote(KEY_COLUMN)} = ?",
+                [preview(texts[col]) for col in columns] + [aic],
+            )
+            compacted.append(aic)
+        index_sections(conn, compacted, table)
+    return len(compacted)
+
+
+def _drop_unlinked(conn, hashes):
+    conn.executemany(
+        "DELETE FROM rcp_sections WHERE hash = ? AND NOT EXISTS (SELECT 1 FROM drug_sections WHERE hash = ?)",
+        [(h, h) for h in hashes],
+    )
+
+
+def _unlink(conn, aic, section):
+    row = conn.execute("SELECT hash FROM drug_sections WHERE aic = ? AND section = ?", (aic, section)).fetchone()
+    if row is not None:
+        conn.execute("DELETE FROM drug_sections WHERE aic = ? AND section = ?", (aic, section))
+        _drop_unlinked(conn, [row[0]])
+
+
+def delete_sections(conn, aic):
+    """Removes a drug's links, and the texts no other drug shares."""
+    hashes = [row[0] for row in conn.execute("SELECT hash FROM drug_sections WHERE aic = ?", (aic,))]
+    conn.execute("DELETE FROM drug_sections WHERE aic = ?", (aic,))
+    _drop_unlinked(conn, hashes)
+
+
+def prune(conn, table=TABLE_NAME):
+    """
+    Deletes the links of drugs not in `table`, then texts nothing links to.
+    FetchingDaata stores sections before SheetToDb adds the drug rows, so run
+    this only once the table is up to date.
+    """
+    conn.execute(
+        f"DELETE FROM drug_sections WHERE aic NOT IN (SELECT {quote(KEY_COLUMN)} FROM {quote(table)})"
+    )
+    conn.execute("DELETE FROM rcp_sections WHERE hash NOT IN (SELECT hash FROM drug_sections)")
+
+
+if __name__ == "__main__":
+    # python RcpStore.py [--prune] <db>...: move inline section texts into the compressed store
+    args = sys.argv[1:]
+    with_prune = "--prune" in args
+    for db_path in [arg for arg in args if arg != "--prune"]:
+        conn = sqlite3.connect(db_path)
+        compacted = compact(conn)
+        if with_prune:
+            with conn:
+                prune(conn)
+        conn.execute("VACUUM")
+        conn.close()
+        print(f"{db_path}: {compacted} rows compacted")
@@ -0,0 +1,331 @@
+import argparse
+import json
+import os
+import sqlite3
+import time
+
+import numpy as np
+
+from Analytics import ABSENT, NOT_FOUND
+from RcpStore import PREVIEW_MARK, TRUNCATED_MARK, is_partial, section_texts, text_hash
+from Schema import DB_NAME, KEY_COLUMN, SECTION_COLUMNS, TABLE_NAME, quote
+
+
+MODEL_DIR = "recommender_model"
+# RCP sections describing what a medicine is for and how it interacts
+TEXT_COLUMNS = [SECTION_COLUMNS["4.1"], SECTION_COLUMNS["4.3"], SECTION_COLUMNS["4.5"]]
+N_COMPONENTS = 64      # NMF topics
+MAX_FEATURES = 50000   # TF-IDF vocabulary size
+MAX_ITER = 300
+TOP_K = 10
+# Values written in place of a section that could not be extracted
+PLACEHOLDERS = {"", NOT_FOUND, ABSENT, "NON"}
+
+DOC_FACTORS = "doc_factors.npy"    # documents x topics, rows scaled to unit length
+TERM_FACTORS = "term_factors.npy"  # topics x terms
+VECTORIZER = "vectorizer.joblib"
+DOCUMENTS = "documents.json"       # AIC codes and text hash of every factor row
+
+
+def drug_texts(conn, table=TABLE_NAME, aics=None):
+    """
+    The text every drug is compared on: its indications, contraindications and
+    interactions, in full from the RCP store when the table only has previews.
+
+    Returns:
+        dict: AIC code -> text, for the drugs with at least one section.
+    """
+    stored = section_texts(conn, TEXT_COLUMNS)
+    sql = f"SELECT {quote(KEY_COLUMN)}, {', '.join(quote(col) for col in TEXT_COLUMNS)} FROM {quote(table)}"
+    texts = {}
+    for aic, *values in conn.execute(sql):
+        if not aic or (aics is not None and aic not in aics):
+            continue
+        full = stored.get(aic, {})
+        parts = []
+        for col, value in zip(TEXT_COLUMNS, values):
+            value = full.get(col) or value or ""
+            if is_partial(value):
+                value = value.removesuffix(PREVIEW_MARK).removesuffix(TRUNCATED_MARK)
+            if value.strip() not in PLACEHOLDERS:
+                parts.append(value)
+        if parts:
+            texts[aic] = "\n".join(parts)
+    return texts
+
+
+def make_vectorizer():
+    from sklearn.feature_extraction.text import TfidfVectorizer
+
+    return TfidfVectorizer(
+        strip_accents="unicode", lowercase=True, token_pattern=r"(?u)\b[^\W\d_]{3,}\b",
+        sublinear_tf=True, min_df=2, max_df=0.8, max_features=MAX_FEATURES, dtype=np.float32,
+    )
+
+
+def normalize_rows(matrix):
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    return (matrix / np.where(norms == 0, 1, norms)).astype(np.float32)
+
+
+def _save_array(path, array):
+    # Written aside and renamed: readers holding the old file mapped keep a valid copy
+    tmp_path = f"{path}.tmp.npy"
+    np.save(tmp_path, array)
+    os.replace(tmp_path, path)
+
+
+def _save_json(path, data):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f)
+    os.replace(tmp_path, path)
+
+
+def build(conn, model_dir=MODEL_DIR, n_components=N_COMPONENTS, table=TABLE_NAME):
+    """
+    Fits the model on every drug of `table` and saves it to `model_dir`.
+
+    Packages sharing an RCP have the same text, so each distinct text is one
+    document. The documents become a sparse TF-IDF matrix, factorized with NMF
+    (which works on the sparse matrix directly) into document and term
+    factors. The document factors, scaled to unit length, are the index that
+    similar() ranks by dot product.
+
+    Returns:
+        Recommender: The saved model, opened.
+    """
+    from sklearn.decomposition import NMF
+    import joblib
+
+    by_hash = {}
+    for aic, text in drug_texts(conn, table).items():
+        by_hash.setdefault(text_hash(text), (text, []))[1].append(aic)
+    if len(by_hash) < 2:
+        raise ValueError("Need at least two distinct RCP texts to build the recommender")
+    hashes = list(by_hash)
+    vectorizer = make_vectorizer()
+    if len(hashes) < 10:
+        vectorizer.set_params(min_df=1, max_df=1.0)
+    try:
+        tfidf = vectorizer.fit_transform(by_hash[h][0] for h in hashes)
+    except ValueError as e:
+        # sklearn's "empty vocabulary" / "After pruning, no terms remain"
+        params = vectorizer.get_params()
+        raise ValueError(
+            f"No usable terms in the {len(hashes)} distinct RCP texts (words of 3+ letters, in at least "
+            f"min_df={params['min_df']} and at most max_df={params['max_df']} of the texts); "
+            f"the corpus is too small or too uniform to build the recommender"
+        ) from e
+    n_components = min(n_components, *tfidf.shape)
+    model = NMF(n_components=n_components, init="nndsvda", solver="cd", max_iter=MAX_ITER, random_state=0)
+    doc_factors = model.fit_transform(tfidf)
+
+    os.makedirs(model_dir, exist_ok=True)
+    _save_array(os.path.join(model_dir, DOC_FACTORS), normalize_rows(doc_factors))
+    _save_array(os.path.join(model_dir, TERM_FACTORS), model.components_.astype(np.float32))
+    joblib.dump(vectorizer, os.path.join(model_dir, VECTORIZER))
+    _save_json(os.path.join(model_dir, DOCUMENTS), {
+        "hashes": hashes,
+        "aics": [sorted(by_hash[h][1]) for h in hashes],
+        "n_components": n_components,
+        "built_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    })
+    return Recommender(model_dir)
+
+
+class Recommender:
+    """
+    "Similar medicines" from a model saved by build().
+
+    The factor matrices are memory-mapped, so opening the model is cheap and
+    processes serving it share one copy in the page cache. A lookup is one
+    matrix-vector product over the document factors and a partial sort.
+    scikit-learn is only imported to fold in new texts.
+    """
+
+    def __init__(self, model_dir=MODEL_DIR):
+        self.model_dir = model_dir
+        self.load()
+
+    def load(self):
+        self.factors = np.load(os.path.join(self.model_dir, DOC_FACTORS), mmap_mode="r")
+        with open(os.path.join(self.model_dir, DOCUMENTS), encoding="utf-8") as f:
+            meta = json.load(f)
+        self.meta = meta
+        self.hashes = meta["hashes"]
+        self.documents = meta["aics"]
+        self.doc_of = {aic: i for i, aics in enumerate(self.documents) for aic in aics}
+        self.doc_of_hash = {digest: i for i, digest in enumerate(self.hashes)}
+        # Documents whose packages were all moved to a newer text are never returned
+        self.live = np.array([bool(aics) for aics in self.documents])
+        self._vectorizer = None
+
+    def __contains__(self, aic):
+        return aic in self.doc_of
+
+    def __len__(self):
+        return len(self.doc_of)
+
+    def packages(self, aic):
+        """AIC codes sharing the RCP of `aic` (itself included)."""
+        doc = self.doc_of.get(aic)
+        return [] if doc is None else list(self.documents[doc])
+
+    def top_k(self, vector, k=TOP_K, exclude=None):
+        """
+        The `k` documents closest to a unit topic vector.
+
+        Returns:
+            list: (document index, cosine similarity), most similar first.
+        """
+        scores = self.factors @ vector
+        scores[~self.live] = -np.inf
+        if exclude is not None:
+            scores[exclude] = -np.inf
+        k = min(k, int(np.isfinite(scores).sum()))
+        if k <= 0:
+            return []
+        best = np.argpartition(-scores, k - 1)[:k]
+        best = best[np.argsort(-scores[best], kind="stable")]
+        return [(int(doc), float(scores[doc])) for doc in best]
+
+    def similar(self, aic, k=TOP_K):
+        """
+        The `k` medicines whose RCP is most similar to that of `aic`, one AIC
+        code per medicine (see packages() for the others), packages sharing
+        its RCP left out.
+
+        Returns:
+            list: (AIC code, cosine similarity), most similar first; empty if
+            `aic` is not in the model.
+        """
+        doc = self.doc_of.get(aic)
+        if doc is None:
+            return []
+        return [(self.documents[other][0], score)
+                for other, score in self.top_k(np.asarray(self.factors[doc]), k, exclude=doc)]
+
+    def similar_to_text(self, text, k=TOP_K):
+        """Medicines whose RCP is closest to free text (e.g. an RCP not in the database)."""
+        vector = self.fold_in_vectors([text])[0]
+        return [(self.documents[doc][0], score) for doc, score in self.top_k(vector, k)]
+
+    def vectorizer(self):
+        if self._vectorizer is None:
+            import joblib
+
+            self._vectorizer = joblib.load(os.path.join(self.model_dir, VECTORIZER))
+        return self._vectorizer
+
+    def fold_in_vectors(self, texts):
+        """
+        Topic vectors (unit length) of new texts with the term factors fixed:
+        the same NMF problem solved for the new rows only, no refit.
+        """
+        from sklearn.decomposition import non_negative_factorization
+
+        tfidf = self.vectorizer().transform(texts)
+        term_factors = np.load(os.path.join(self.model_dir, TERM_FACTORS), mmap_mode="r")
+        doc_factors, _, _ = non_negative_factorization(
+            tfidf, H=np.asarray(term_factors), n_components=term_factors.shape[0],
+            init="custom", update_H=False, solver="cd", max_iter=MAX_ITER, random_state=0,
+        )
+        return normalize_rows(doc_factors)
+
+    def fold_in(self, texts, removed=()):
+        """
+        Adds drugs, or replaces the text of drugs already in the model, without
+        refitting. A text already known only links the AIC code to it; new
+        texts get factor rows from fold_in_vectors. The model files are
+        rewritten and reopened.
+
+        Args:
+            texts (dict): AIC code -> text (see drug_texts).
+            removed (iterable): AIC codes to unlink from the model (drugs
+                deleted, or left without text); a document with no AIC code
+                left is never recommended.
+
+        Returns:
+            int: New documents added.
+        """
+        documents = [list(aics) for aics in self.documents]
+        hashes = list(self.hashes)
+        doc_of_hash = dict(self.doc_of_hash)
+        for aic in removed:
+            old = self.doc_of.get(aic)
+            if old is not None:
+                documents[old].remove(aic)
+        new_texts = []
+        for aic, text in texts.items():
+            digest = text_hash(text)
+            old = self.doc_of.get(aic)
+            if old is not None:
+                if hashes[old] == digest:
+                    continue
+                documents[old].remove(aic)
+            if digest not in doc_of_hash:
+                doc_of_hash[digest] = len(hashes)
+                hashes.append(digest)
+                documents.append([])
+                new_texts.append(text)
+            documents[doc_of_hash[digest]].append(aic)
+        factors = self.factors
+        if new_texts:
+            factors = np.vstack([np.asarray(self.factors), self.fold_in_vectors(new_texts)])
+            _save_array(os.path.join(self.model_dir, DOC_FACTORS), factors)
+        _save_json(os.path.join(self.model_dir, DOCUMENTS),
+                   dict(self.meta, hashes=hashes, aics=[sorted(aics) for aics in documents]))
+        self.load()
+        return len(new_texts)
+
+
+def update(conn, model_dir=MODEL_DIR, table=TABLE_NAME):
+    """
+    Folds into the saved model the drugs of `table` it does not have yet, or
+    whose RCP text changed, and unlinks the drugs no longer in `table` (or
+    left without text), so they are not recommended any more.
+
+    Returns:
+        tuple: (Recommender, number of new documents).
+    """
+    recommender = Recommender(model_dir)
+    texts = drug_texts(conn, table)
+    changed = {aic: text for aic, text in texts.items()
+               if aic not in recommender or recommender.hashes[recommender.doc_of[aic]] != text_hash(text)}
+    removed = [aic for aic in recommender.doc_of if aic not in texts]
+    if not changed and not removed:
+        return recommender, 0
+    return recommender, recommender.fold_in(changed, removed)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Similar medicines from their RCP indications, "
+                                                 "contraindications and interactions.")
+    parser.add_argument("command", choices=["build", "update", "similar"])
+    parser.add_argument("aic", nargs="?", help="AIC code, for similar")
+    parser.add_argument("--db", default=DB_NAME)
+    parser.add_argument("--table", default=TABLE_NAME)
+    parser.add_argument("--model", default=MODEL_DIR)
+    parser.add_argument("--components", type=int, default=N_COMPONENTS)
+    parser.add_argument("-k", type=int, default=TOP_K)
+    args = parser.parse_args()
+
+    if args.command == "similar":
+        recommender = Recommender(args.model)
+        if args.aic not in recommender:
+            raise SystemExit(f"{args.aic} is not in the model")
+        for aic, score in recommender.similar(args.aic, args.k):
+            print(f"{score:.3f}  {aic}")
+    else:
+        conn = sqlite3.connect(args.db)
+        started = time.perf_counter()
+        if args.command == "build":
+            recommender = build(conn, args.model, args.components, args.table)
+            print(f"Built from {len(recommender)} drugs ({len(recommender.documents)} distinct RCP texts, "
+                  f"{recommender.meta['n_components']} topics) in {time.perf_counter() - started:.1f}s")
+        else:
+            recommender, added = update(conn, args.model, args.table)
+            print(f"Folded in {added} new RCP texts in {time.perf_counter() - started:.1f}s "
+                  f"({len(recommender)} drugs)")
+        conn.close()
@@ -0,0 +1,226 @@
+import sqlite3
+import sys
+
+
+DB_NAME = "test_mohammad_omid.db"  # database used by the app and the sync
+TABLE_NAME = "sheet1"
+KEY_COLUMN = "Codice  AIC"  # two spaces, as in the Google Sheet header
+
+# Canonical columns, in sheet order. The names match the Google Sheet headers.
+COLUMNS = [
+    "Principio Attivo",
+    "Descrizione Gruppo",
+    "Denominazione e Confezione",
+    "Titolare AIC",
+    "Codice  AIC",
+    "Codice Gruppo Equivalenza",
+    "Class",
+    "ATC",
+    "4.1 Indicazioni terapeutiche",
+    "4.2 Posologia e modo di somministrazione",
+    "4.3 Contraindications",
+    "4.4 Special warnings and precautions for use",
+    "4.5 Interactions with other medicinal products",
+    "4.6 Fertility, pregnancy and lactation",
+    "4.7 Effects on ability to drive and use machines",
+    "4.8 Undesirable effects (side effects)",
+    "4.9 Overdose",
+    "6.2 Incompatibilities",
+    "URL_PDF",
+    "URL_json"
+]
+
+# Column holding each extracted RCP section
+SECTION_COLUMNS = {
+    "4.1": "4.1 Indicazioni terapeutiche",
+    "4.2": "4.2 Posologia e modo di somministrazione",
+    "4.3": "4.3 Contraindications",
+    "4.4": "4.4 Special warnings and precautions for use",
+    "4.5": "4.5 Interactions with other medicinal products",
+    "4.6": "4.6 Fertility, pregnancy and lactation",
+    "4.7": "4.7 Effects on ability to drive and use machines",
+    "4.8": "4.8 Undesirable effects (side effects)",
+    "4.9": "4.9 Overdose",
+    "6.2": "6.2 Incompatibilities"
+}
+
+# Secondary indexes (the AIC code is the primary key)
+INDEX_COLUMNS = ["ATC", "Principio Attivo", "Codice Gruppo Equivalenza"]
+
+# Other spellings found in existing databases and CSV exports
+LEGACY_NAMES = {
+    "Codice AIC": "Codice  AIC",
+    "Principio_Attivo": "Principio Attivo",
+    "Descrizione_Gruppo": "Descrizione Gruppo",
+    "Denominazione_e_Confezione": "Denominazione e Confezione",
+    "Titolare_AIC": "Titolare AIC",
+    "Codice_AIC": "Codice  AIC",
+    "Codice_Gruppo_Equivalenza": "Codice Gruppo Equivalenza",
+    "Indicazioni_Terapeutiche_4_1": "4.1 Indicazioni terapeutiche",
+    "Posologia_e_Modo_Somministrazione_4_2": "4.2 Posologia e modo di somministrazione",
+    "Controindicazioni_4_3": "4.3 Contraindications",
+    "Avvertenze_Speciali_Precauzioni_Uso_4_4": "4.4 Special warnings and precautions for use",
+    "Interazioni_Altri_Medicinali_4_5": "4.5 Interactions with other medicinal products",
+    "Fertilita_Gravidanza_Allattamento_4_6": "4.6 Fertility, pregnancy and lactation",
+    "Effetti_Guida_Uso_Macchinari_4_7": "4.7 Effects on ability to drive and use machines",
+    "Effetti_Indesiderati_4_8": "4.8 Undesirable effects (side effects)",
+    "Sovradosaggio_4_9": "4.9 Overdose",
+    "Incompatibilita_6_2": "6.2 Incompatibilities",
+}
+
+# Tables migrated by migrate_database
+KNOWN_TABLES = ["sheet1", "drugs"]
+
+
+def quote(name):
+    return '"' + name.replace('"', '""') + '"'
+
+
+def canonical_name(name):
+    """Maps a legacy column name to the canonical one; unknown names are kept."""
+    return LEGACY_NAMES.get(name, name)
+
+
+def create_table_sql(table=TABLE_NAME):
+    columns = []
+    for col in COLUMNS:
+        if col == KEY_COLUMN:
+            columns.append(f"{quote(col)} TEXT PRIMARY KEY")
+        else:
+            columns.append(f"{quote(col)} TEXT")
+    return f"CREATE TABLE IF NOT EXISTS {quote(table)} (\n    " + ",\n    ".join(columns) + "\n)"
+
+
+def index_name(table, column):
+    return f"idx_{table}_" + "".join(ch if ch.isalnum() else "_" for ch in column.lower())
+
+
+def create_indexes(conn, table=TABLE_NAME, unique_key=False):
+    """
+    Creates the secondary indexes on `table` (for the columns it has). With
+    unique_key, also a unique index on the AIC code, for tables where it is
+    not the primary key.
+    """
+    existing = {row[1] for row in conn.execute(f"PRAGMA table_info({quote(table)})")}
+    if unique_key and KEY_COLUMN in existing:
+        conn.execute(
+            f"CREATE UNIQUE INDEX IF NOT EXISTS {quote(index_name(table, KEY_COLUMN))} "
+            f"ON {quote(table)} ({quote(KEY_COLUMN)})"
+        )
+    for col in INDEX_COLUMNS:
+        if col in existing:
+            conn.execute(
+                f"CREATE INDEX IF NOT EXISTS {quote(index_name(table, col))} ON {quote(table)} ({quote(col)})"
+            )
+
+
+def is_canonical(conn, table):
+    """True if `table` has the canonical columns with the AIC code as primary key."""
+    info = {row[1]: row for row in conn.execute(f"PRAGMA table_info({quote(table)})")}
+    key = info.get(KEY_COLUMN)
+    return key is not None and key[5] == 1 and all(col in info for col in COLUMNS)
+
+
+def migrate_table(conn, table=TABLE_NAME, drop_unkeyed=False):
+    """
+    Converts `table` to the canonical schema in place, if it is not already.
+
+    Legacy column names are renamed (see LEGACY_NAMES), the AIC code becomes a
+    TEXT primary key, and the secondary indexes are created. Rows without an
+    AIC code, or repeating one, cannot be keyed: unless `drop_unkeyed`, the
+    migration is refused when there are any (python Schema.py <db> drops
+    them). The full-text index, which refers to the old rowids, is dropped and
+    rebuilt by the next SearchIndex.ensure_search_index call.
+
+    Returns:
+        int: Rows dropped, or None if the table was already canonical.
+
+    Raises:
+        ValueError: The table has no AIC column, or rows would be dropped
+            and `drop_unkeyed` is false.
+    """
+    if is_canonical(conn, table):
+        create_indexes(conn, table)
+        return None
+
+    old_columns = [row[1] for row in conn.execute(f"PRAGMA table_info({quote(table)})")]
+    mapping = {}
+    for col in old_columns:
+        name = canonical_name(col)
+        if name in COLUMNS and name not in mapping:
+            mapping[name] = col
+    if KEY_COLUMN not in mapping:
+        raise ValueError(f"Table {table!r} has no AIC code column; cannot migrate")
+
+    new_table = f"{table}__migrating"
+    targets = [col for col in COLUMNS if col in mapping]
+    sources = []
+    for col in targets:
+        source = quote(mapping[col])
+        # Integer AIC codes become text, without a trailing ".0" for REAL columns
+        sources.append(f"CAST(CAST({source} AS INTEGER) AS TEXT)" if col == KEY_COLUMN and
+                       _column_type(conn, table, mapping[col]) in ("INTEGER", "REAL") else source)
+
+    key = quote(mapping[KEY_COLUMN])
+    key_source = sources[targets.index(KEY_COLUMN)]
+    before, keyed = conn.execute(
+        f"SELECT COUNT(*), COUNT(DISTINCT CASE WHEN {key} IS NOT NULL AND {key} != '' THEN {key_source} END) "
+        f"FROM {quote(table)}"
+    ).fetchone()
+    if before > keyed and not drop_unkeyed:
+        raise ValueError(
+            f"Migrating table {table!r} would drop {before - keyed} of {before} rows without a unique AIC code; "
+            f"fix them, or run python Schema.py <db> to migrate and drop them"
+        )
+
+    with conn:
+        _drop_search_index(conn, table)
+        conn.execute(f"DROP TABLE IF EXISTS {quote(new_table)}")
+        conn.execute(create_table_sql(new_table))
+        conn.execute(
+            f"INSERT OR IGNORE INTO {quote(new_table)} ({', '.join(quote(c) for c in targets)}) "
+            f"SELECT {', '.join(sources)} FROM {quote(table)} "
+            f"WHERE {key} IS NOT NULL AND {key} != '' "
+            f"ORDER BY rowid"
+        )
+        after = conn.execute(f"SELECT COUNT(*) FROM {quote(new_table)}").fetchone()[0]
+        conn.execute(f"DROP TABLE {quote(table)}")
+        conn.execute(f"ALTER TABLE {quote(new_table)} RENAME TO {quote(table)}")
+        create_indexes(conn, table)
+    return before - after
+
+
+def _column_type(conn, table, column):
+    for row in conn.execute(f"PRAGMA table_info({quote(table)})"):
+        if row[1] == column:
+            return (row[2] or "").upper()
+    return ""
+
+
+def _drop_search_index(conn, table):
+    fts = f"{table}_fts"
+    for suffix in ("_ai", "_ad", "_au"):
+        conn.execute(f"DROP TRIGGER IF EXISTS {quote(fts + suffix)}")
+    conn.execute(f"DROP TABLE IF EXISTS {quote(fts)}")
+
+
+def migrate_database(path):
+    """Migrates every known table present in the database file, dropping the rows without a unique AIC code."""
+    conn = sqlite3.connect(path)
+    tables = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    results = {}
+    for table in KNOWN_TABLES:
+        if table in tables:
+            results[table] = migrate_table(conn, table, drop_unkeyed=True)
+    conn.execute("VACUUM")
+    conn.close()
+    return results
+
+
+if __name__ == "__main__":
+    for db_path in sys.argv[1:]:
+        for table, dropped in migrate_database(db_path).items():
+            if dropped is None:
+                print(f"{db_path}: {table} already up to date")
+            else:
+                print(f"{db_path}: {table} migrated ({dropped} rows without a unique AIC code dropped)")
@@ -0,0 +1,192 @@
+import re
+
+from Schema import KEY_COLUMN
+
+
+# Columns indexed for full-text search, most important first (see RANK_WEIGHTS)
+SEARCH_COLUMNS = [
+    "Denominazione e Confezione",
+    "Principio Attivo",
+    "Codice  AIC",
+    "4.1 Indicazioni terapeutiche",
+    "4.3 Contraindications",
+    "4.5 Interactions with other medicinal products",
+]
+# Columns always indexed as they are inline; the others are RCP sections
+SHORT_COLUMNS = {"Denominazione e Confezione", "Principio Attivo", "Codice  AIC"}
+# bm25 weight of each search column: name and ingredient hits rank above RCP text hits
+RANK_WEIGHTS = {
+    "Denominazione e Confezione": 10.0,
+    "Principio Attivo": 10.0,
+    "Codice  AIC": 5.0,
+}
+# Columns returned by search(); the long RCP texts are left out
+DISPLAY_COLUMNS = [
+    "Codice  AIC",
+    "Denominazione e Confezione",
+    "Principio Attivo",
+    "Titolare AIC",
+    "ATC",
+    "Class",
+]
+
+TOKEN_RE = re.compile(r"\w+")
+
+
+def fts_table(table):
+    return f"{table}_fts"
+
+
+def _quote(name):
+    return '"' + name.replace('"', '""') + '"'
+
+
+def table_columns(conn, table):
+    return [row[1] for row in conn.execute(f"PRAGMA table_info({_quote(table)})")]
+
+
+def ensure_search_index(conn, table, columns=None):
+    """
+    Creates the FTS5 index over `table` if it does not exist yet, fills it from
+    the current rows and installs triggers that keep it in sync on insert,
+    update and delete.
+
+    The index keeps its own copy of the indexed columns, so RCP sections can
+    be indexed in full while the table only has their preview (RcpStore): the
+    triggers index the inline values, keep an indexed section whose inline
+    value did not change, and RcpStore.index_sections puts the stored full
+    texts in. It is tokenized with unicode61 and diacritics removed so
+    "attivita" matches "attività", with prefix indexes for 2- and 3-character
+    prefixes. Columns missing from the table are skipped. An index over the
+    table's own columns (content=, as created before) is replaced.
+    """
+    fts = fts_table(table)
+    current = conn.execute("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = ?", (fts,)).fetchone()
+    if current is not None:
+        if "content=" not in current[0]:
+            return
+        with conn:
+            drop_search_index(conn, table)
+    existing = set(table_columns(conn, table))
+    columns = [col for col in (columns or SEARCH_COLUMNS) if col in existing]
+    if not columns:
+        return
+
+    col_list = ", ".join(_quote(col) for col in columns)
+    new_values = ", ".join(f"new.{_quote(col)}" for col in columns)
+    # An unchanged inline section keeps the indexed text, which may be the full one
+    updates = ", ".join(
+        f"{_quote(col)} = new.{_quote(col)}" if col in SHORT_COLUMNS else
+        f"{_quote(col)} = CASE WHEN new.{_quote(col)} IS old.{_quote(col)} THEN {_quote(col)} "
+        f"ELSE new.{_quote(col)} END"
+        for col in columns
+    )
+    weights = ", ".join(str(RANK_WEIGHTS.get(col, 1.0)) for col in columns)
+    with conn:
+        conn.execute(f"""
+            CREATE VIRTUAL TABLE {_quote(fts)} USING fts5(
+                {col_list},
+                tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+            )
+        """)
+        conn.execute(f"""
+            CREATE TRIGGER {_quote(fts + '_ai')} AFTER INSERT ON {_quote(table)} BEGIN
+                INSERT INTO {_quote(fts)} (rowid, {col_list}) VALUES (new.rowid, {new_values});
+            END
+        """)
+        conn.execute(f"""
+            CREATE TRIGGER {_quote(fts + '_ad')} AFTER DELETE ON {_quote(table)} BEGIN
+                DELETE FROM {_quote(fts)} WHERE rowid = old.rowid;
+            END
+        """)
+        conn.execute(f"""
+            CREATE TRIGGER {_quote(fts + '_au')} AFTER UPDATE ON {_quote(table)} BEGIN
+                UPDATE {_quote(fts)} SET {updates} WHERE rowid = old.rowid;
+            END
+        """)
+        conn.execute(f"INSERT INTO {_quote(fts)} (rowid, {col_list}) SELECT rowid, {col_list} FROM {_quote(table)}")
+        conn.execute(f"INSERT INTO {_quote(fts)} ({_quote(fts)}, rank) VALUES ('rank', 'bm25({weights})')")
+        if conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'drug_sections'").fetchone():
+            from RcpStore import index_sections  # RcpStore imports this module
+
+            index_sections(conn, None, table)
+
+
+def drop_search_index(conn, table):
+    fts = fts_table(table)
+    for suffix in ("_ai", "_ad", "_au"):
+        conn.execute(f"DROP TRIGGER IF EXISTS {_quote(fts + suffix)}")
+    conn.execute(f"DROP TABLE IF EXISTS {_quote(fts)}")
+
+
+def set_texts(conn, table, texts):
+    """
+    Replaces indexed column values of some rows of `table`.
+
+    Args:
+        texts (dict): AIC code -> {column: text}; columns not indexed are ignored.
+    """
+    fts = fts_table(table)
+    indexed = set(table_columns(conn, fts))
+    for aic, values in texts.items():
+        values = {col: text for col, text in values.items() if col in indexed}
+        if values:
+            conn.execute(
+                f"UPDATE {_quote(fts)} SET {', '.join(f'{_quote(col)} = ?' for col in values)} "
+                f"WHERE rowid = (SELECT rowid FROM {_quote(table)} WHERE {_quote(KEY_COLUMN)} = ?)",
+                list(values.values()) + [aic]
+            )
+
+
+def build_match_query(term):
+    """
+    Turns free text into an FTS5 query: every word must match as a prefix.
+    Zero-padded numbers also match without the padding, since AIC codes are
+    stored both ways.
+    """
+    parts = []
+    for token in TOKEN_RE.findall(term):
+        stripped = token.lstrip("0")
+        if token.isdigit() and stripped and stripped != token:
+            parts.append(f'("{token}"* OR "{stripped}"*)')
+        else:
+            parts.append(f'"{token}"*')
+    return " ".join(parts)
+
+
+def search_query(conn, table, term, limit=200, columns=None):
+    """
+    Builds the ranked full-text search over `table`.
+
+    Returns:
+        tuple: (sql, params) selecting the display columns present in the
+        table, best matches first, or None when there is nothing to search.
+    """
+    query = build_match_query(term)
+    existing = set(table_columns(conn, table))
+    columns = [col for col in (columns or DISPLAY_COLUMNS) if col in existing]
+    if not query or not columns:
+        return None
+    fts = fts_table(table)
+    select = ", ".join(f"t.{_quote(col)}" for col in columns)
+    sql = f"""
+        SELECT {select}
+        FROM {_quote(fts)} f JOIN {_quote(table)} t ON t.rowid = f.rowid
+        WHERE {_quote(fts)} MATCH ?
+        ORDER BY f.rank
+        LIMIT ?
+    """
+    return sql, (query, limit)
+
+
+def search(conn, table, term, limit=200, columns=None):
+    """
+    Ranked full-text search over `table`.
+
+    Returns:
+        list: Row tuples of the display columns, best matches first.
+    """
+    built = search_query(conn, table, term, limit=limit, columns=columns)
+    if built is None:
+        return []
+    return conn.execute(*built).fetchall()
@@ -0,0 +1,30 @@
+import threading
+
+
+CREDENTIALS_FILE = "swift-atom-452517-m2-6029accc8a65.json"
+SCOPES = ["https://spreadsheets.google.com/feeds", "https://www.googleapis.com/auth/drive"]
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_client(credentials_file=CREDENTIALS_FILE):
+    """
+    Returns the authorized gspread client, created on first use. gspread and
+    google-auth are imported here, so modules that only may need a sheet do
+    not pay for them (or for the authentication) at import time.
+    """
+    global _client
+    with _client_lock:
+        if _client is None:
+            import gspread
+            from google.oauth2.service_account import Credentials
+
+            creds = Credentials.from_service_account_file(credentials_file, scopes=SCOPES)
+            _client = gspread.authorize(creds)
+        return _client
+
+
+def open_sheet(sheet_name):
+    """Opens a Google Sheet by name with the shared client."""
+    return get_client().open(sheet_name)
@@ -0,0 +1,281 @@
+from Metrics import incr, timer
+from RcpStore import TRUNCATED_MARK
+
+
+# Rows buffered by SheetWriter before one batch_update is sent
+FLUSH_EVERY = 200
+# Rows fetched per request by iter_rows
+CHUNK_ROWS = 2000
+# Rows handed at a time to the job ledger and the scrapers' pipelines (see iter_batches)
+BATCH_ROWS = 5000
+# Sheets cells hold at most 50,000 characters; leave room for the truncation tag
+MAX_CELL_CHARS = 49900
+
+
+def rowcol_to_a1(row, col):
+    """(2, 28) -> "AB2", as gspread.utils.rowcol_to_a1 (without importing gspread)."""
+    letters = ""
+    while col:
+        col, rem = divmod(col - 1, 26)
+        letters = chr(ord("A") + rem) + letters
+    return f"{letters}{row}"
+
+
+def fit_cell(text):
+    """Truncates text that would not fit in a sheet cell, tagging it with TRUNCATED_MARK."""
+    if text and len(text) > MAX_CELL_CHARS:
+        return text[:MAX_CELL_CHARS] + TRUNCATED_MARK
+    return text
+
+
+def get_all_rows(sheet, column_names=None):
+    """
+    Retrieves all rows from the first worksheet of the Google Sheet, optionally mapping to specified column names.
+
+    Args:
+        sheet (gspread.Spreadsheet): The connected Google Sheet object.
+        column_names (list, optional): List of column names to filter each row dict. If None, returns all columns.
+
+    Returns:
+        list: A list of dicts (if column_names provided) or lists (raw rows).
+    """
+    worksheet = sheet.sheet1
+    rows = worksheet.get_all_values()
+    if not rows:
+        return []
+    headers = rows[0]
+    data_rows = rows[1:]
+    dict_rows = [dict(zip(headers, row)) for row in data_rows]
+    if column_names:
+        # Only include specified columns in each dict
+        filtered_rows = [{col: row.get(col, "") for col in column_names} for row in dict_rows]
+        return filtered_rows
+    return dict_rows
+
+
+class SheetRecord:
+    """
+    One sheet row, reduced to the columns asked for. Reads like a dict
+    (record[column], record.get(column)) but holds only a tuple of values and a
+    column index shared by every record of the same read.
+    """
+    __slots__ = ("row_number", "values", "index")
+
+    def __init__(self, row_number, values, index):
+        self.row_number = row_number
+        self.values = values
+        self.index = index
+
+    def __getitem__(self, column):
+        return self.values[self.index[column]]
+
+    def get(self, column, default=None):
+        position = self.index.get(column)
+        return default if position is None else self.values[position]
+
+    def keys(self):
+        return self.index.keys()
+
+    def __repr__(self):
+        return f"SheetRecord({self.row_number}, {dict(zip(self.index, self.values))})"
+
+
+def iter_rows(sheet, column_names, chunk_size=CHUNK_ROWS, as_tuples=False):
+    """
+    Streams the given columns of the first worksheet, `chunk_size` rows per request.
+
+    Only the requested columns are downloaded (one A1 range per column and
+    chunk, fetched with a single batch_get), and each chunk is yielded before
+    the next is fetched, so memory stays flat whatever the sheet size.
+    Columns missing from the sheet read as "". As with get_all_values, the
+    empty rows after the last one with a value are not yielded (the grid
+    usually has many). A chunk with no values at all is skipped, not taken
+    as the end: its rows are yielded as blanks only if a later chunk has
+    values, and reading stops at the end of the grid.
+
+    Args:
+        sheet (gspread.Spreadsheet): The connected Google Sheet object.
+        column_names (list): Columns to read, by header name.
+        chunk_size (int): Rows per request.
+        as_tuples (bool): Yield plain tuples of values, in column_names order,
+            instead of SheetRecord objects.
+
+    Yields:
+        SheetRecord or tuple: One per data row, in sheet order.
+    """
+    worksheet = sheet.sheet1
+    headers = worksheet.row_values(1)
+    index = {name: i for i, name in enumerate(column_names)}
+    positions = [headers.index(name) + 1 if name in headers else None for name in column_names]
+    present = sorted({p for p in positions if p is not None})
+    if not present:
+        return
+    blank = tuple("" for _ in column_names)
+    start = 2  # row 1 is headers
+    next_row = start  # first row not yielded yet
+    while start <= worksheet.row_count:
+        end = min(start + chunk_size - 1, worksheet.row_count)
+        ranges = [f"{rowcol_to_a1(start, col)}:{rowcol_to_a1(end, col)}" for col in present]
+        columns = dict(zip(present, worksheet.batch_get(ranges)))
+        # Trailing empty rows and cells are left out of the response
+        last = max((len(cells) for cells in columns.values() if cells), default=0)
+        if not last:
+            # A gap, or the empty grid after the data; either way next_row stays put
+            start = end + 1
+            continue
+        # Empty rows at the end of the previous chunk lie between rows with values
+        for row_number in range(next_row, start):
+            yield blank if as_tuples else SheetRecord(row_number, blank, index)
+        for offset in range(last):
+            values = []
+            for position in positions:
+                cells = columns.get(position) or []
+                row = cells[offset] if offset < len(cells) else []
+                values.append(row[0] if row else "")
+            values = tuple(values)
+            yield values if as_tuples else SheetRecord(start + offset, values, index)
+        next_row = start + last
+        start = end + 1
+
+
+def iter_batches(items, size=BATCH_ROWS):
+    """Groups an iterable, such as iter_rows, into lists of at most `size` items."""
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def update_row_in_sheet(sheet, search_column, search_value, update_dict):
+    """
+    Searches for a row where search_column == search_value and updates columns with values from update_dict.
+
+    Reads the whole sheet on every call; use SheetWriter when updating many rows.
+
+    Args:
+        sheet (gspread.Spreadsheet): The connected Google Sheet object.
+        search_column (str): The column name to search for.
+        search_value (str): The value to match in the search_column.
+        update_dict (dict): Dictionary of column names and their new values.
+
+    Returns:
+        bool: True if a row was updated, False otherwise.
+    """
+    worksheet = sheet.sheet1
+    headers = worksheet.row_values(1)
+    try:
+        col_idx = headers.index(search_column)
+    except ValueError:
+        return False
+
+    all_rows = worksheet.get_all_values()
+    for i, row in enumerate(all_rows[1:], start=2):  # start=2 because row 1 is headers
+        if len(row) > col_idx and row[col_idx] == search_value:
+            # Prepare updated row
+            updated_row = list(row) + [''] * (len(headers) - len(row))
+            for key, value in update_dict.items():
+                if key in headers:
+                    idx = headers.index(key)
+                    updated_row[idx] = value
+            # Ensure updated_row is exactly the same length as headers
+            updated_row = updated_row[:len(headers)]
+            start_cell = rowcol_to_a1(i, 1)
+            end_cell = rowcol_to_a1(i, len(headers))
+            worksheet.update(range_name=f"{start_cell}:{end_cell}", values=[updated_row])
+            return True
+    return False
+
+
+class SheetWriter:
+    """
+    Buffers row updates keyed by a column value and writes them with batch_update.
+
+    The header row and key column are read once on construction (in chunks,
+    see iter_rows) to build a key -> row-number index, so each update is a
+    dict lookup instead of a full sheet download. Pending
+    updates are flushed every `flush_every` rows and on exit when used as a
+    context manager; `on_flush` is called after each successful flush:
+
+        with SheetWriter(sheet, "Codice  AIC") as writer:
+            writer.update(aic, {"ATC": "..."})
+    """
+
+    def __init__(self, sheet, key_column, flush_every=FLUSH_EVERY, on_flush=None, rows=None):
+        self.worksheet = sheet.sheet1
+        self.flush_every = flush_every
+        self.on_flush = on_flush
+        self.row_index = {}
+        # Callers that already hold get_all_values() output can pass it to skip the read
+        if rows is None:
+            self.headers = self.worksheet.row_values(1)
+            keys = ((record.row_number, record[key_column]) for record in iter_rows(sheet, [key_column]))
+        else:
+            self.headers = rows[0] if rows else []
+            key_idx = self.headers.index(key_column)
+            keys = ((i, row[key_idx] if len(row) > key_idx else "")
+                    for i, row in enumerate(rows[1:], start=2))  # start=2 because row 1 is headers
+        self.col_index = {name: idx for idx, name in enumerate(self.headers)}
+        if key_column not in self.col_index:
+            raise KeyError(key_column)
+        for row_number, key in keys:
+            if key:
+                # Same as update_row_in_sheet: the first matching row wins
+                self.row_index.setdefault(key, row_number)
+        self.pending = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        # Flush on errors too: everything queued so far was produced successfully
+        self.flush()
+
+    def update(self, key, update_dict):
+        """
+        Queues an update for the row whose key column equals `key`.
+
+        Returns:
+            bool: True if the row exists and the update was queued, False otherwise.
+        """
+        row_number = self.row_index.get(key)
+        if row_number is None:
+            return False
+        cells = self.pending.setdefault(row_number, {})
+        for name, value in update_dict.items():
+            if name in self.col_index:
+                cells[self.col_index[name]] = value
+        if len(self.pending) >= self.flush_every:
+            self.flush()
+        return True
+
+    def flush(self):
+        """Sends every pending update in a single batch_update call."""
+        if not self.pending:
+            return
+        data = []
+        for row_number, cells in self.pending.items():
+            # Merge adjacent columns into one range so a row costs as few ranges as possible
+            run = []
+            for col in sorted(cells):
+                if run and col != run[-1] + 1:
+                    data.append(self._range(row_number, run, cells))
+                    run = []
+                run.append(col)
+            if run:
+                data.append(self._range(row_number, run, cells))
+        with timer("sheet_write", rows=len(self.pending), ranges=len(data)):
+            self.worksheet.batch_update(data)
+        incr("sheet_rows_written", len(self.pending))
+        self.pending = {}
+        if self.on_flush is not None:
+            self.on_flush()
+
+    @staticmethod
+    def _range(row_number, cols, cells):
+        start_cell = rowcol_to_a1(row_number, cols[0] + 1)
+        end_cell = rowcol_to_a1(row_number, cols[-1] + 1)
+        return {"range": f"{start_cell}:{end_cell}", "values": [[cells[c] for c in cols]]}
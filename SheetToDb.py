@@ -0,0 +1,186 @@
+import argparse
+import sqlite3
+import time
+
+from JobLedger import content_hash
+from Mentions import update_mentions
+from RcpStore import delete_sections, ensure_tables, expand_row, index_sections, write_row_sections
+from Schema import DB_NAME, KEY_COLUMN, TABLE_NAME, create_table_sql, migrate_table, quote
+from SheetSync import SheetWriter, fit_cell
+
+
+SHEET_NAME = "TestMohammad-Omid"
+STATE_TABLE = "_sheet_sync"  # last synced hash of every row (sheet and DB side), by AIC
+
+
+def _cell(value):
+    # Sheet cells are strings; DB values may be numbers or NULL
+    return "" if value is None else str(value)
+
+
+def row_hash(values):
+    return content_hash([_cell(v) for v in values])
+
+
+def ensure_state_table(conn):
+    conn.execute(f"""
+        CREATE TABLE IF NOT EXISTS {STATE_TABLE} (
+            aic TEXT PRIMARY KEY,
+            row_hash TEXT NOT NULL,
+            synced_at REAL NOT NULL
+        )
+    """)
+    # Hash of the row as written to the DB, which keeps long section texts as
+    # previews (see RcpStore); added after the first version of the table
+    columns = {row[1] for row in conn.execute(f"PRAGMA table_info({STATE_TABLE})")}
+    if "db_hash" not in columns:
+        conn.execute(f"ALTER TABLE {STATE_TABLE} ADD COLUMN db_hash TEXT")
+
+
+def sync(sheet, db_path=DB_NAME, table=TABLE_NAME, key=KEY_COLUMN, push=False, delete_missing=False):
+    """
+    Synchronises the first worksheet of a Google Sheet with a SQLite table.
+
+    The sheet is read once. Every row is hashed over the columns the sheet and
+    the table share, and both sides are compared with the hashes stored at the
+    last sync:
+
+    - sheet row changed (or new): the DB row is updated or inserted (the sheet wins)
+    - sheet row unchanged but the DB row changed: the DB was edited; with `push`
+      the edit is written back to the sheet, in one batch_update
+    - neither changed: nothing is done
+
+    Section texts go to the RCP store (RcpStore) and only their preview is kept
+    in the row; texts already stored in full are not replaced by the truncated
+    copies in the sheet. All DB changes are applied in one transaction.
+
+    Args:
+        sheet (gspread.Spreadsheet): The connected Google Sheet object.
+        db_path (str): SQLite file.
+        table (str): Table holding one row per AIC.
+        key (str): AIC column, present in both the sheet and the table.
+        push (bool): Write DB edits back to the sheet.
+        delete_missing (bool): Delete DB rows whose AIC is no longer in the sheet.
+
+    Returns:
+        dict: Number of rows inserted, updated, pushed, deleted and unchanged,
+        and of RCP texts scanned for ingredient mentions (see Mentions).
+    """
+    stats = {"inserted": 0, "updated": 0, "pushed": 0, "deleted": 0, "unchanged": 0}
+    all_values = sheet.sheet1.get_all_values()
+    if not all_values:
+        return stats
+    headers = all_values[0]
+
+    conn = sqlite3.connect(db_path)
+    conn.execute("PRAGMA busy_timeout=5000")
+    conn.execute(create_table_sql(table))
+    migrate_table(conn, table)
+    table_cols = {row[1] for row in conn.execute(f"PRAGMA table_info({quote(table)})")}
+    columns = [col for col in headers if col in table_cols and col != key]
+    positions = [headers.index(col) for col in columns]
+    key_pos = headers.index(key)
+
+    ensure_state_table(conn)
+    ensure_tables(conn)
+    synced = {aic: (sheet_digest, db_digest) for aic, sheet_digest, db_digest
+              in conn.execute(f"SELECT aic, row_hash, db_hash FROM {STATE_TABLE}")}
+    select = ", ".join(quote(col) for col in [key] + columns)
+    db_rows = {
+        _cell(row[0]): row[1:]
+        for row in conn.execute(f"SELECT {select} FROM {quote(table)}")
+    }
+
+    to_insert, to_update, to_push, new_state = [], [], [], []
+    seen = set()
+    for sheet_row in all_values[1:]:
+        sheet_row = sheet_row + [""] * (len(headers) - len(sheet_row))
+        aic = sheet_row[key_pos]
+        if not aic or aic in seen:
+            continue
+        seen.add(aic)
+        values = [sheet_row[p] for p in positions]
+        sheet_hash = row_hash(values)
+        db_values = db_rows.get(aic)
+        last_sheet_hash, last_db_hash = synced.get(aic, (None, None))
+        if db_values is None:
+            to_insert.append((aic, values))
+        elif sheet_hash != last_sheet_hash:
+            if row_hash(db_values) != sheet_hash:
+                to_update.append((aic, values))
+            else:
+                stats["unchanged"] += 1
+                new_state.append((aic, sheet_hash, sheet_hash))
+        elif row_hash(db_values) != (last_db_hash or sheet_hash):
+            if push:
+                to_push.append((aic, db_values))
+        else:
+            stats["unchanged"] += 1
+
+    def store_row(aic, values):
+        # Full section texts to the RCP store, previews inline
+        row = write_row_sections(conn, dict(zip(columns, values), **{key: aic}))
+        return [row[col] for col in columns]
+
+    now = time.time()
+    with conn:
+        if to_insert:
+            placeholders = ", ".join(["?"] * (len(columns) + 1))
+            stored = [(aic, values, store_row(aic, values)) for aic, values in to_insert]
+            conn.executemany(
+                f"INSERT INTO {quote(table)} ({select}) VALUES ({placeholders})",
+                [[aic] + inline for aic, _, inline in stored]
+            )
+            new_state.extend((aic, row_hash(values), row_hash(inline)) for aic, values, inline in stored)
+            index_sections(conn, [aic for aic, _ in to_insert], table)
+        if to_update:
+            set_clause = ", ".join(f"{quote(col)} = ?" for col in columns)
+            stored = [(aic, values, store_row(aic, values)) for aic, values in to_update]
+            conn.executemany(
+                f"UPDATE {quote(table)} SET {set_clause} WHERE {quote(key)} = ?",
+                [inline + [aic] for aic, _, inline in stored]
+            )
+            new_state.extend((aic, row_hash(values), row_hash(inline)) for aic, values, inline in stored)
+            index_sections(conn, [aic for aic, _ in to_update], table)
+        if delete_missing:
+            gone = [(aic,) for aic in db_rows if aic not in seen]
+            conn.executemany(f"DELETE FROM {quote(table)} WHERE {quote(key)} = ?", gone)
+            conn.executemany(f"DELETE FROM {STATE_TABLE} WHERE aic = ?", gone)
+            for (aic,) in gone:
+                delete_sections(conn, aic)
+            stats["deleted"] = len(gone)
+        if to_push:
+            with SheetWriter(sheet, key, flush_every=len(to_push), rows=all_values) as writer:
+                for aic, db_values in to_push:
+                    # Previews are expanded to the stored text, cut to fit a cell
+                    row = expand_row(conn, dict(zip(columns, (_cell(v) for v in db_values)), **{key: aic}))
+                    update = {col: fit_cell(row[col]) for col in columns}
+                    writer.update(aic, update)
+                    new_state.append((aic, row_hash(update.values()), row_hash(db_values)))
+        conn.executemany(
+            f"INSERT OR REPLACE INTO {STATE_TABLE} (aic, row_hash, db_hash, synced_at) VALUES (?, ?, ?, ?)",
+            [(aic, sheet_digest, db_digest, now) for aic, sheet_digest, db_digest in new_state],
+        )
+    # Ingredients mentioned in 4.5/4.3: only new or changed texts are scanned
+    stats["mentions_scanned"] = update_mentions(conn, table)
+    conn.close()
+
+    stats["inserted"] = len(to_insert)
+    stats["updated"] = len(to_update)
+    stats["pushed"] = len(to_push)
+    return stats
+
+
+if __name__ == "__main__":
+    from SheetClient import open_sheet
+
+    parser = argparse.ArgumentParser(description="Sync the Google Sheet into the medicines database.")
+    parser.add_argument("--sheet", default=SHEET_NAME)
+    parser.add_argument("--db", default=DB_NAME)
+    parser.add_argument("--push", action="store_true", help="write DB edits back to the sheet")
+    parser.add_argument("--delete-missing", action="store_true", help="delete DB rows no longer in the sheet")
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    stats = sync(open_sheet(args.sheet), db_path=args.db, push=args.push, delete_missing=args.delete_missing)
+    print(f"Sync done in {time.perf_counter() - started:.1f}s: {stats}")
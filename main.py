@@ -2,125 +2,132 @@ import streamlit as st
 import sqlite3
 import pandas as pd
 
-DB_NAME = "test_mohammad_omid.db"
-TABLE_NAME = "sheet1"
-
-COLUMNS = [
-    "Principio Attivo",
-    "Descrizione Gruppo",
-    "Denominazione e Confezione",
-    "Titolare AIC",
-    "Codice  AIC",
-    "Codice Gruppo Equivalenza",
-    "Class",
-    "ATC",
-    "4.1 Indicazioni terapeutiche",
-    "4.2 Posologia e modo di somministrazione",
-    "4.3 Contraindications",
-    "4.4 Special warnings and precautions for use",
-    "4.5 Interactions with other medicinal products",
-    "4.6 Fertility, pregnancy and lactation",
-    "4.7 Effects on ability to drive and use machines",
-    "4.8 Undesirable effects (side effects)",
-    "4.9 Overdose",
-    "6.2 Incompatibilities",
-    "URL_PDF",
-    "URL_json"
-]
-
-def get_connection():
-    return sqlite3.connect(DB_NAME, check_same_thread=False)
-
-def init_db():
-    conn = get_connection()
-    c = conn.cursor()
-    c.execute(f"""
-        CREATE TABLE IF NOT EXISTS {TABLE_NAME} (
-            "Principio Attivo" TEXT,
-            "Descrizione Gruppo" TEXT,
-            "Denominazione e Confezione" TEXT PRIMARY KEY,
-            "Titolare AIC" TEXT,
-            "Codice AIC" INTEGER,
-            "Codice Gruppo Equivalenza" TEXT,
-            "Class" TEXT,
-            "ATC" TEXT,
-            "4.1 Indicazioni terapeutiche" TEXT,
-            "4.2 Posologia e modo di somministrazione" TEXT,
-            "4.3 Contraindications" TEXT,
-            "4.4 Special warnings and precautions for use" TEXT,
-            "4.5 Interactions with other medicinal products" TEXT,
-            "4.6 Fertility, pregnancy and lactation" TEXT,
-            "4.7 Effects on ability to drive and use machines" TEXT,
-            "4.8 Undesirable effects (side effects)" TEXT,
-            "4.9 Overdose" TEXT,
-            "6.2 Incompatibilities" TEXT,
-            "URL_PDF" TEXT,
-            "URL_json" TEXT
-        )
-    """)
-    conn.commit()
-    conn.close()
-
-def fetch_all(offset=0, limit=20):
-    conn = get_connection()
-    df = pd.read_sql_query(
-        f'SELECT * FROM "{TABLE_NAME}" LIMIT ? OFFSET ?',
-        conn, params=(limit, offset)
-    )
-    conn.close()
-    return df
-
-def search_data(term):
-    conn = get_connection()
-    query = f'''
-        SELECT * FROM "{TABLE_NAME}"
-        WHERE "Principio Attivo" LIKE ?
-           OR "Denominazione e Confezione" LIKE ?
-           OR "Codice  AIC" LIKE ?
-    '''
-    df = pd.read_sql_query(query, conn, params=(f"%{term}%", f"%{term}%", f"%{term}%"))
-    conn.close()
-    return df
+import Analytics
+import BulkEdit
+from Database import Database
+import DrugQueries
+from DrugQueries import DETAIL_COLUMNS
+from Mentions import refresh_mentions
+from RcpStore import delete_sections, index_sections, write_row_sections
+from Schema import COLUMNS, DB_NAME, KEY_COLUMN, SECTION_COLUMNS, TABLE_NAME
+
+@st.cache_resource
+def get_db():
+    """One Database per process: shared across sessions and reruns, initialised once."""
+    db = Database(DB_NAME)
+    try:
+        DrugQueries.init_db(db)
+    except ValueError as e:
+        # A legacy table whose migration would drop rows (see Schema.migrate_table)
+        st.error(str(e))
+        st.stop()
+    return db
+
+def to_dataframe(result):
+    columns, rows = result
+    return pd.DataFrame(rows, columns=columns)
+
+# The queries live in DrugQueries, shared with the REST API (ApiServer.py)
+def count_rows():
+    return DrugQueries.count_rows(get_db())
+
+def fetch_page(after=0, limit=20):
+    return to_dataframe(DrugQueries.fetch_page(get_db(), after, limit))
+
+def fetch_details(rowid):
+    details = DrugQueries.fetch_details(get_db(), rowid)
+    return pd.Series(details) if details is not None else None
+
+def search_data(term, limit=200):
+    return to_dataframe(DrugQueries.search_data(get_db(), term, limit))
+
+def search_mentions(ingredient, limit=500):
+    return to_dataframe(DrugQueries.fetch_by_mention(get_db(), ingredient, limit=limit))
 
 def fetch_by_pk(pk):
-    conn = get_connection()
-    df = pd.read_sql_query(
-        f'SELECT * FROM "{TABLE_NAME}" WHERE "Codice  AIC" = ?',
-        conn, params=(pk,)
-    )
-    conn.close()
-    return df.iloc[0] if not df.empty else None
+    # Full section texts, so that saving the form does not store the previews
+    record = DrugQueries.fetch_by_pk(get_db(), pk)
+    return pd.Series(record) if record is not None else None
+
+# Dashboard figures, read from the summary table kept by Analytics
+def fetch_overview():
+    return Analytics.overview(get_db())
+
+def fetch_top(dimension, limit=20):
+    return to_dataframe(Analytics.top_values(get_db(), dimension, limit))
+
+def fetch_atc(level, prefix=""):
+    return to_dataframe(Analytics.atc_breakdown(get_db(), level, prefix))
+
+def fetch_section_status():
+    return to_dataframe(Analytics.section_status(get_db()))
+
+def fetch_groups(limit=50):
+    return to_dataframe(Analytics.group_summary(get_db(), limit))
+
+# Bulk import / export (see BulkEdit)
+def preview_upload(columns, records):
+    return BulkEdit.diff_upload(get_db().reader(), columns, records)
+
+def apply_upload(columns, records):
+    try:
+        with get_db().writer() as conn:
+            return BulkEdit.apply_upload(conn, columns, records)
+    except Exception as e:
+        st.error(f"Import failed: {e}")
+        return None
+
+def diff_table(diff, limit=1000):
+    """One row per changed cell, texts shortened, for the import preview."""
+    def short(value):
+        value = "" if value is None else str(value)
+        return value if len(value) <= 80 else value[:80] + "..."
+    rows = [(record[KEY_COLUMN], "(new)", "", "") for record in diff["new"][:limit]]
+    for record, changes in diff["changed"][:limit]:
+        rows += [(record[KEY_COLUMN], col, short(old), short(new)) for col, (old, new) in changes.items()]
+    return pd.DataFrame(rows, columns=[KEY_COLUMN, "column", "current", "uploaded"])
+
+def record_fields(record=None):
+    """Form inputs for every column: text areas for the RCP sections, single lines for the rest."""
+    values = {}
+    for col in COLUMNS:
+        value = record[col] if record is not None and pd.notnull(record[col]) else ""
+        if col in SECTION_COLUMNS.values():
+            values[col] = st.text_area(col, str(value))
+        else:
+            values[col] = st.text_input(col, str(value))
+    return values
 
 def update_record(pk, data):
-    conn = get_connection()
-    c = conn.cursor()
     set_clause = ", ".join([f'"{col}"=?' for col in COLUMNS if col != "Codice  AIC"])
-    values = [data[col] for col in COLUMNS if col != "Codice  AIC"]
-    values.append(pk)
     try:
-        c.execute(
-            f'UPDATE "{TABLE_NAME}" SET {set_clause} WHERE "Codice  AIC" = ?',
-            values
-        )
-        conn.commit()
+        with get_db().writer() as conn:
+            data = write_row_sections(conn, dict(data, **{"Codice  AIC": pk}))
+            values = [data[col] for col in COLUMNS if col != "Codice  AIC"]
+            values.append(pk)
+            conn.execute(
+                f'UPDATE "{TABLE_NAME}" SET {set_clause} WHERE "Codice  AIC" = ?',
+                values
+            )
+            index_sections(conn, [pk])
+            refresh_mentions(conn, aics=[pk])
         return True
     except Exception as e:
         st.error(f"Update failed: {e}")
         return False
-    finally:
-        conn.close()
 
 def insert_record(data):
-    conn = get_connection()
-    c = conn.cursor()
     placeholders = ", ".join(["?"] * len(COLUMNS))
     col_names = ', '.join([f'"{col}"' for col in COLUMNS])
     try:
-        c.execute(
-            f'INSERT INTO "{TABLE_NAME}" ({col_names}) VALUES ({placeholders})',
-            [data[col] for col in COLUMNS]
-        )
-        conn.commit()
+        with get_db().writer() as conn:
+            data = write_row_sections(conn, data)
+            conn.execute(
+                f'INSERT INTO "{TABLE_NAME}" ({col_names}) VALUES ({placeholders})',
+                [data[col] for col in COLUMNS]
+            )
+            index_sections(conn, [data["Codice  AIC"]])
+            refresh_mentions(conn, aics=[data["Codice  AIC"]])
         return True
     except sqlite3.IntegrityError:
         st.error("A record with this Codice  AIC already exists.")
@@ -128,46 +135,78 @@ def insert_record(data):
     except Exception as e:
         st.error(f"Insertion failed: {e}")
         return False
-    finally:
-        conn.close()
 
 def delete_record(pk):
-    conn = get_connection()
-    c = conn.cursor()
     try:
-        c.execute(
-            f'DELETE FROM "{TABLE_NAME}" WHERE "Codice  AIC" = ?',
-            (pk,)
-        )
-        conn.commit()
+        with get_db().writer() as conn:
+            conn.execute(
+                f'DELETE FROM "{TABLE_NAME}" WHERE "Codice  AIC" = ?',
+                (pk,)
+            )
+            delete_sections(conn, pk)
+            refresh_mentions(conn, aics=[pk])
         return True
     except Exception as e:
         st.error(f"Delete failed: {e}")
         return False
-    finally:
-        conn.close()
 
 def main():
     st.set_page_config(page_title="Medicines DB Manager", layout="wide")
     st.title("Medicines Database Manager")
 
-    init_db()
+    get_db()
 
-    menu = st.sidebar.radio("Menu", ["View All", "Search", "Add New", "Edit", "Delete"])
+    menu = st.sidebar.radio("Menu", ["View All", "Search", "Analytics", "Import / Export", "Add New", "Edit", "Delete"])
 
     if menu == "View All":
         st.header("All Drugs")
         page_size = st.number_input("Rows per page", 5, 100, 20)
-        page = st.number_input("Page", 1, 100, 1)
-        offset = (page - 1) * page_size
-        df = fetch_all(offset=offset, limit=page_size)
-        st.dataframe(df, use_container_width=True)
+        # Start rowid of every page visited so far; the last one is the current page
+        if st.session_state.get("browse_page_size") != page_size:
+            st.session_state["browse_page_size"] = page_size
+            st.session_state["browse_cursors"] = [0]
+        cursors = st.session_state["browse_cursors"]
+        total = count_rows()
+        df = fetch_page(after=cursors[-1], limit=page_size)
+
+        n_pages = max(1, -(-total // page_size))
+        st.caption(f"Page {len(cursors)} of {n_pages} ({total} drugs)")
+        col_first, col_prev, col_next = st.columns(3)
+        if col_first.button("First", disabled=len(cursors) == 1):
+            del cursors[1:]
+            st.rerun()
+        if col_prev.button("Previous", disabled=len(cursors) == 1):
+            cursors.pop()
+            st.rerun()
+        if col_next.button("Next", disabled=df.empty or len(cursors) * page_size >= total):
+            cursors.append(int(df["rowid"].iloc[-1]))
+            st.rerun()
+
+        st.dataframe(df.drop(columns="rowid"), use_container_width=True)
+        if not df.empty and st.checkbox("Show RCP sections"):
+            selected = st.selectbox(
+                "Drug", df.index,
+                format_func=lambda i: f'{df.at[i, "Codice  AIC"]} - {df.at[i, "Denominazione e Confezione"]}'
+            )
+            details = fetch_details(int(df.at[selected, "rowid"]))
+            if details is not None:
+                for col in DETAIL_COLUMNS:
+                    st.markdown(f"**{col}**")
+                    st.write(details[col] if pd.notnull(details[col]) else "")
 
     elif menu == "Search":
         st.header("Search Drugs")
-        term = st.text_input('Search by "Principio Attivo", "Denominazione e Confezione", or "Codice  AIC"')
-        if term:
-            df = search_data(term)
+        mode = st.radio("Search", ["Text", "Interactions with an active ingredient"], horizontal=True)
+        if mode == "Text":
+            term = st.text_input(
+                'Search by "Principio Attivo", "Denominazione e Confezione", "Codice  AIC" '
+                'or indications, contraindications and interactions (word prefixes, accents optional)'
+            )
+            df = search_data(term) if term else None
+        else:
+            term = st.text_input("Active ingredient mentioned in the interactions (4.5) or contraindications (4.3)")
+            df = search_mentions(term).drop(columns="rowid") if term else None
+        if df is not None:
             st.dataframe(df, use_container_width=True)
             if not df.empty:
                 selected = st.selectbox("Select a record to edit", df["Codice  AIC"])
@@ -176,6 +215,82 @@ def main():
                         st.session_state["edit_pk"] = selected
                         st.rerun()
 
+    elif menu == "Analytics":
+        st.header("Catalogue Analytics")
+        overview = fetch_overview()
+        for col, (label, key) in zip(st.columns(5), [("Packages", "packages"), ("ATC codes", "atc_codes"),
+                                                      ("Equivalence groups", "groups"), ("Holders", "holders"),
+                                                      ("Active ingredients", "ingredients")]):
+            col.metric(label, f"{overview[key]:,}")
+
+        st.subheader("Packages per ATC code")
+        col_level, col_prefix = st.columns(2)
+        level = col_level.selectbox("ATC level", sorted(Analytics.ATC_LEVELS), index=1)
+        prefix = col_prefix.text_input("Under ATC code (optional)", "").strip()
+        df = fetch_atc(level, prefix)
+        if df.empty:
+            st.info("No packages for this ATC code.")
+        else:
+            st.bar_chart(df.set_index("ATC")["packages"])
+
+        st.subheader("RCP sections")
+        st.caption('"failed": the RCP could not be processed ("NON - TROVATO"); '
+                   '"absent": the RCP has no such section')
+        st.dataframe(fetch_section_status().set_index("section"), use_container_width=True)
+
+        col_holders, col_groups = st.columns(2)
+        with col_holders:
+            st.subheader("Top marketing authorisation holders")
+            st.dataframe(fetch_top("holder").rename(columns={"value": "Titolare AIC"}),
+                         use_container_width=True, hide_index=True)
+        with col_groups:
+            st.subheader("Largest equivalence groups")
+            st.dataframe(fetch_groups(), use_container_width=True, hide_index=True)
+
+    elif menu == "Import / Export":
+        st.header("Bulk Import")
+        st.caption(f'CSV, XLSX or Parquet with a "{KEY_COLUMN}" column and any of the other columns. '
+                   "New AIC codes are added; for existing ones every non-blank cell replaces the stored "
+                   "value, blank cells leave it as it is.")
+        upload = st.file_uploader("File", type=["csv", "xlsx", "parquet"])
+        if upload is not None:
+            try:
+                columns, records, skipped = BulkEdit.read_upload(upload, upload.name)
+            except (ValueError, ImportError) as e:
+                st.error(f"Cannot read {upload.name}: {e}")
+            else:
+                diff = preview_upload(columns, records)
+                col_new, col_changed, col_same, col_skipped = st.columns(4)
+                col_new.metric("New", len(diff["new"]))
+                col_changed.metric("Changed", len(diff["changed"]))
+                col_same.metric("Unchanged", diff["unchanged"])
+                col_skipped.metric("Skipped", len(skipped))
+                if skipped:
+                    with st.expander("Skipped rows"):
+                        st.write("\n".join(f"- {message}" for message in skipped[:200]))
+                if diff["new"] or diff["changed"]:
+                    st.dataframe(diff_table(diff), use_container_width=True, hide_index=True)
+                    if st.button(f'Apply {len(diff["new"]) + len(diff["changed"])} changes'):
+                        written = apply_upload(columns, diff["new"] + [record for record, _ in diff["changed"]])
+                        if written is not None:
+                            st.success(f"{written} rows written.")
+                            st.rerun()
+                else:
+                    st.info("Nothing to change.")
+
+        st.header("Export")
+        col_atc, col_ingredient, col_term = st.columns(3)
+        atc = col_atc.text_input("ATC code prefix").strip()
+        ingredient = col_ingredient.text_input("Active ingredient").strip()
+        term = col_term.text_input("Full-text search").strip()
+        fmt = st.radio("Format", list(BulkEdit.FORMATS), horizontal=True)
+        # The file is written in chunks only when the button is clicked
+        st.download_button(
+            "Download", data=lambda: BulkEdit.export_file(get_db().reader(), fmt, atc=atc,
+                                                          ingredient=ingredient, term=term),
+            file_name=f"drugs.{fmt}", mime=BulkEdit.FORMATS[fmt],
+        )
+
     elif menu == "Edit":
         st.header("Edit Drug")
         pk = st.text_input("Enter Codice  AIC (Primary Key) to edit", st.session_state.get("edit_pk", ""))
@@ -183,10 +298,7 @@ def main():
             record = fetch_by_pk(pk)
             if record is not None:
                 with st.form("edit_form"):
-                    new_data = {}
-                    for col in COLUMNS:
-                        value = st.text_area(col, str(record[col]) if pd.notnull(record[col]) else "")
-                        new_data[col] = value
+                    new_data = record_fields(record)
                     submitted = st.form_submit_button("Save Changes")
                     if submitted:
                         if update_record(pk, new_data):
@@ -197,10 +309,7 @@ def main():
     elif menu == "Add New":
         st.header("Add New Drug")
         with st.form("add_form"):
-            new_data = {}
-            for col in COLUMNS:
-                value = st.text_area(col, "")
-                new_data[col] = value
+            new_data = record_fields()
             submitted = st.form_submit_button("Add Drug")
             if submitted:
                 if insert_record(new_data):
@@ -0,0 +1,84 @@
+from RcpParser import extract_sections_from_lines
+
+
+# Sample RCP text and the sections the extractor must return for it, whatever
+# its implementation: title on the header line or on the next one, separators
+# after the number, accents missing from a title, a section that is not a
+# target (5.1) and a line starting with a dose ("0.5 mg"), which reads as a
+# section number and closes the section, as it always has
+GOLDEN_LINES = [
+    "RIASSUNTO DELLE CARATTERISTICHE DEL PRODOTTO",
+    "1. DENOMINAZIONE DEL MEDICINALE",
+    "4.   INFORMAZIONI CLINICHE",
+    "4.1 Indicazioni terapeutiche",
+    "Trattamento del dolore lieve o moderato",
+    "e degli stati febbrili.",
+    "4.2",
+    "Posologia e modo di somministrazione",
+    "Adulti: una compressa ogni 8 ore.",
+    "0.5 mg/kg nei bambini",
+    "Non superare la dose indicata.",
+    "4.3 - Controindicazioni",
+    "Ipersensibilità al principio attivo.",
+    "4.4. Avvertenze speciali e precauzioni d'impiego",
+    "Usare con cautela    nei pazienti anziani.",
+    "4.5 Interazioni con altri medicinali ed altre forme d'interazione",
+    "Warfarin: aumento dell'effetto anticoagulante.",
+    "4.6 Fertilità, gravidanza e allattamento",
+    "Non usare in gravidanza.",
+    "4.7 Effetti sulla capacita di guidare veicoli e sull'uso di macchinari",
+    "Nessuno.",
+    "4.8 Effetti indesiderati",
+    "Nausea.",
+    "4.9",
+    "Sovradosaggio",
+    "Lavanda gastrica.",
+    "5.1 Proprietà farmacodinamiche",
+    "Inibitore della COX.",
+    "6.2 Incompatibilità",
+    "Non pertinente.",
+    "6.3 Periodo di validità",
+    "3 anni.",
+]
+GOLDEN_SECTIONS = {
+    "4.1": "Trattamento del dolore lieve o moderato e degli stati febbrili.",
+    "4.2": "Adulti: una compressa ogni 8 ore.",
+    "4.3": "Ipersensibilità al principio attivo.",
+    "4.4": "Usare con cautela nei pazienti anziani.",
+    "4.5": "Warfarin: aumento dell'effetto anticoagulante.",
+    "4.6": "Non usare in gravidanza.",
+    "4.7": "Nessuno.",
+    "4.8": "Nausea.",
+    "4.9": "Lavanda gastrica.",
+    "6.2": "Non pertinente.",
+}
+# With stop_after="4.5", reading stops at the 4.6 header that closes it
+GOLDEN_STOP_AFTER = "4.5"
+GOLDEN_STOP_READ = GOLDEN_LINES.index("4.6 Fertilità, gravidanza e allattamento") + 1
+
+
+def test_list_input():
+    assert extract_sections_from_lines(GOLDEN_LINES) == GOLDEN_SECTIONS
+
+
+def test_iterator_input():
+    assert extract_sections_from_lines(iter(GOLDEN_LINES)) == GOLDEN_SECTIONS
+
+
+def test_stop_after_last_section():
+    assert extract_sections_from_lines(iter(GOLDEN_LINES), stop_after="6.2") == GOLDEN_SECTIONS
+
+
+def test_stop_after_reads_up_to_the_next_header():
+    read = []
+
+    def counted():
+        for line in GOLDEN_LINES:
+            read.append(line)
+            yield line
+
+    order = list(GOLDEN_SECTIONS)
+    kept = order[:order.index(GOLDEN_STOP_AFTER) + 1]
+    expected = {sec: GOLDEN_SECTIONS[sec] if sec in kept else "Not found" for sec in order}
+    assert extract_sections_from_lines(counted(), stop_after=GOLDEN_STOP_AFTER) == expected
+    assert len(read) == GOLDEN_STOP_READ
@@ -0,0 +1,70 @@
+from SheetSync import CHUNK_ROWS, SheetWriter, iter_rows
+
+
+class FakeWorksheet:
+    """In-memory worksheet answering batch_get like the Sheets API."""
+
+    def __init__(self, rows):
+        self.rows = [list(row) for row in rows]
+
+    @property
+    def row_count(self):
+        return len(self.rows)
+
+    def row_values(self, row):
+        return list(self.rows[row - 1])
+
+    def batch_get(self, ranges):
+        results = []
+        for a1_range in ranges:
+            first, last = a1_range.split(":")
+            col = ord(first.rstrip("0123456789")) - ord("A")
+            first_row, last_row = int(first[1:]), int(last[1:])
+            block = [[row[col]] if col < len(row) and row[col] else []
+                     for row in self.rows[first_row - 1:last_row]]
+            # Trailing empty rows are left out of the response
+            while block and not block[-1]:
+                block.pop()
+            results.append(block)
+        return results
+
+
+class FakeSheet:
+    def __init__(self, worksheet):
+        self.sheet1 = worksheet
+
+
+def make_sheet(blank_rows, last_data_row, grid_rows):
+    """Sheet with a key in every row up to last_data_row except blank_rows, then empty rows."""
+    rows = [["AIC", "Name"]]
+    for row_number in range(2, grid_rows + 1):
+        if row_number in blank_rows or row_number > last_data_row:
+            rows.append(["", ""])
+        else:
+            rows.append([f"{row_number:09d}", f"name {row_number}"])
+    return FakeSheet(FakeWorksheet(rows))
+
+
+def test_gap_of_whole_chunks_is_read_through():
+    # With chunk_size=3 the chunks start at rows 2, 5, 8, 11, 14...; rows 10-17 cover
+    # chunks 11-13 and 14-16 entirely
+    sheet = make_sheet(blank_rows=range(10, 18), last_data_row=40, grid_rows=60)
+    records = list(iter_rows(sheet, ["AIC", "Name"], chunk_size=3))
+    assert [record.row_number for record in records] == list(range(2, 41))
+    assert [record["AIC"] for record in records] == [
+        "" if n in range(10, 18) else f"{n:09d}" for n in range(2, 41)]
+
+
+def test_trailing_empty_rows_are_not_yielded():
+    sheet = make_sheet(blank_rows=(), last_data_row=7, grid_rows=30)
+    rows = list(iter_rows(sheet, ["AIC"], chunk_size=4, as_tuples=True))
+    assert rows == [(f"{n:09d}",) for n in range(2, 8)]
+
+
+def test_writer_indexes_rows_after_a_gap():
+    # SheetWriter reads with the default CHUNK_ROWS; the gap covers the whole second chunk
+    gap = range(100, CHUNK_ROWS * 2 + 100)
+    sheet = make_sheet(blank_rows=gap, last_data_row=CHUNK_ROWS * 3, grid_rows=CHUNK_ROWS * 4)
+    writer = SheetWriter(sheet, "AIC")
+    expected = {f"{n:09d}": n for n in range(2, CHUNK_ROWS * 3 + 1) if n not in gap}
+    assert writer.row_index == expected